@@ -1,12 +1,41 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
-import json
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, Response, FileResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List, Literal, Tuple, Union
+import gzip
 import math
+import json
+import os
+import secrets
+import time
 from math import ceil
-from bisect import bisect_left
+from functools import lru_cache
+from flow import Node
+from expressions import compile_action, make_namespace
+from render import TemplateCache
+from store import MemoryStore, create_store
+from snapshot import SessionSerializer, SnapshotError, sign, snapshot_version, verify
+from state import StatePacker
+from knowledge import KnowledgeBase, ContentRegistry
+from batch import FLOOR_NODE, size_rooms
+from bundle import BundleError, export_bundle
+from circuits import OUTLETS, CircuitError, partition_circuits
+from engine import StepError, advance, peek, choose_option, set_inputs
+from executor import Overloaded, TurnExecutor, TurnTimeout, in_pool_process
+from locks import KeyedLock
+from prerender import PrerenderedMessage, prerender
+import precompiled
+from responses import Message, dumps
+import metrics
+from static_cache import AssetCache, safe_join
+from logs import setup_logging, get_logger, log_context, conversation_id_var, node_id_var
+
+# Logging estructurado y no bloqueante (PEISA_LOG_LEVEL, PEISA_LOG_FORMAT=json|text)
+setup_logging(os.environ.get("PEISA_LOG_LEVEL", "INFO"), os.environ.get("PEISA_LOG_FORMAT", "json") == "json")
+logger = get_logger("app")
+# Fracción de respuestas cuyo contexto completo se registra en DEBUG
+LOG_CONTEXT_SAMPLE = float(os.environ.get("PEISA_LOG_CONTEXT_SAMPLE", 0.01))
 
 app = FastAPI(title="PEISA - SOLDASUR S.A", description="Asistente para cálculos de calefacción")
 
@@ -31,297 +60,422 @@ class ConversationResponse(BaseModel):
     is_final: Optional[bool] = None
     error: Optional[str] = None
 
-# Cargar la base de conocimiento
-try:
-    with open("peisa_advisor_knowledge_base.json", "r", encoding="utf-8") as f:
-        knowledge_base = json.load(f)
-except FileNotFoundError:
-    print("Advertencia: No se encontró el archivo peisa_advisor_knowledge_base.json")
-    knowledge_base = []
-
-# Contexto de la conversación
-conversations = {}
-
-# Base de datos de modelos de radiadores
-RADIATOR_MODELS = {
-    "TROPICAL 350": {
-        "type": "principal",
-        "installation": ["superficie"],
-        "style": "clasico",
-        "colors": ["blanco"],
-        "coeficiente": 0.75,
-        "potencia": 185,
-        "description": "Radiador de aluminio inyectado, ideal para calefacción principal"
-    },
-    "TROPICAL 500": {
-        "type": "principal",
-        "installation": ["superficie"],
-        "style": "clasico",
-        "colors": ["blanco"],
-        "coeficiente": 1.0,
-        "potencia": 185,
-        "description": "Radiador de aluminio inyectado, alto rendimiento"
-    },
-    "TROPICAL 600": {
-        "type": "principal",
-        "installation": ["superficie"],
-        "style": "clasico",
-        "colors": ["blanco"],
-        "coeficiente": 1.16,
-        "potencia": 185,
-        "description": "Radiador de aluminio inyectado, máxima potencia"
-    },
-    "BROEN 350": {
-        "type": ["principal", "complementaria"],
-        "installation": ["superficie"],
-        "style": "moderno",
-        "colors": ["blanco", "negro"],
-        "coeficiente": 0.75,
-        "potencia": 185,
-        "description": "Diseño discreto y moderno, disponible en dos colores"
-    },
-    "BROEN 500": {
-        "type": ["principal", "complementaria"],
-        "installation": ["superficie"],
-        "style": "moderno",
-        "colors": ["blanco", "negro"],
-        "coeficiente": 1.0,
-        "potencia": 185,
-        "description": "Versión intermedia de la línea Broen"
-    },
-    "BROEN 600": {
-        "type": ["principal", "complementaria"],
-        "installation": ["superficie"],
-        "style": "moderno",
-        "colors": ["blanco", "negro"],
-        "coeficiente": 1.16,
-        "potencia": 185,
-        "description": "Máxima potencia en la línea Broen clásica"
-    },
-    "BROEN PLUS 700": {
-        "type": ["principal", "complementaria"],
-        "installation": ["empotrada", "superficie"],
-        "style": "moderno",
-        "colors": ["blanco"],
-        "coeficiente": 1.27,
-        "potencia": 185,
-        "description": "Emisores mixtos con gran versatilidad de instalación"
-    },
-    "BROEN PLUS 800": {
-        "type": ["principal", "complementaria"],
-        "installation": ["empotrada", "superficie"],
-        "style": "moderno",
-        "colors": ["blanco"],
-        "coeficiente": 1.4,
-        "potencia": 185,
-        "description": "Alto rendimiento con diseño de líneas modernas"
-    },
-    "BROEN PLUS 1000": {
-        "type": ["principal", "complementaria"],
-        "installation": ["empotrada", "superficie"],
-        "style": "moderno",
-        "colors": ["blanco"],
-        "coeficiente": 1.65,
-        "potencia": 185,
-        "description": "Máxima potencia en la línea Broen Plus"
-    },
-    "GAMMA 500": {
-        "type": "complementaria",
-        "installation": ["superficie"],
-        "style": "moderno",
-        "colors": ["blanco"],
-        "coeficiente": 0.93,
-        "potencia": 185,
-        "description": "Radiador de aluminio con alma de acero, resistente a la corrosión"
-    },
-    "TOALLERO SCALA": {
-        "type": "toallero",
-        "installation": ["superficie"],
-        "style": "moderno",
-        "colors": ["blanco", "cromo"],
-        "potencia": 632,
-        "description": "Especial para baños, mantiene toallas secas y calientes"
-    }
-}
+# ConversationResponse sólo documenta la API: los handlers arman un Message y lo
+# serializan directamente, así que ambos deben tener los mismos campos
+if Message.__slots__ != tuple(ConversationResponse.model_fields):
+    raise RuntimeError("Message y ConversationResponse deben tener los mismos campos en el mismo orden")
+# Lo que devuelve get_next_message: un mensaje armado en el momento o uno pre-renderizado
+Reply = Union[Message, PrerenderedMessage]
 
-def get_node_by_id(node_id: str) -> Optional[Dict[str, Any]]:
-    """Busca un nodo por su ID en la base de conocimiento"""
-    for node in knowledge_base:
-        if node["id"] == node_id:
-            return node
-    return None
+class RoomRequest(BaseModel):
+    nombre: Optional[str] = None
+    tipo: Literal['radiadores', 'piso_radiante']
+    # Radiadores
+    largo: Optional[float] = Field(None, gt=0, le=100)
+    ancho: Optional[float] = Field(None, gt=0, le=100)
+    alto: Optional[float] = Field(None, gt=0, le=20)
+    nivel_aislacion: Optional[Literal['alta', 'media', 'baja']] = None
+    objetivo_radiadores: Optional[Literal['principal', 'complementaria', 'toallero']] = None
+    tipo_instalacion: Optional[str] = None
+    estilo_diseno: Optional[str] = None
+    color_preferido: Optional[str] = None
+    # Piso radiante
+    superficie: Optional[float] = Field(None, gt=0, le=10000)
+    zona_geografica: Optional[Literal['norte', 'sur']] = None
+    tipo_piso: Optional[str] = None
+
+class BatchSizeRequest(BaseModel):
+    rooms: List[RoomRequest] = Field(..., min_length=1, max_length=1000)
+
+class BatchSizeResponse(BaseModel):
+    rooms: List[Dict[str, Any]]
+    totals: Dict[str, Any]
+
+class FloorZone(BaseModel):
+    nombre: Optional[str] = None
+    superficie: float = Field(..., gt=0, le=10000)
+    planta: Optional[str] = None
+
+class FloorCircuitsRequest(BaseModel):
+    zonas: List[FloorZone] = Field(..., min_length=1, max_length=5000)
+    # Por defecto, los parámetros del nodo de cálculo de piso radiante
+    densidad: Optional[float] = Field(None, gt=0, le=50)
+    longitud_maxima: Optional[float] = Field(None, gt=0, le=1000)
+    salidas: int = Field(OUTLETS, ge=1, le=24)
+    exacto: bool = True
 
-def replace_variables(text: str, context: Dict[str, Any]) -> str:
+class FloorCircuitsResponse(BaseModel):
+    circuitos: List[Dict[str, Any]]
+    colectores: List[Dict[str, Any]]
+    resumen: Dict[str, Any]
+
+class FlowStep(BaseModel):
+    option_index: Optional[int] = None
+    input_values: Optional[Dict[str, Any]] = {}
+
+class FlowSubmitRequest(BaseModel):
+    conversation_id: str
+    version: str
+    replies: List[FlowStep] = Field(default_factory=list, max_length=200)
+
+# Plantillas compiladas de 'pregunta'/'texto' de cada nodo
+templates = TemplateCache(maxsize=256)
+
+def get_node_by_id(node_id: str, kb: Optional[KnowledgeBase] = None) -> Optional[Node]:
+    """Busca un nodo por su ID en la base de conocimiento (por defecto, la versión vigente)"""
+    return (kb or contents.current).flow.get(node_id)
+
+def replace_variables(text: str, context: Dict[str, Any], node_id: Optional[str] = None) -> str:
     """Reemplaza variables en el texto usando el contexto"""
     if not isinstance(text, str):
         return text
-        
-    for key, val in context.items():
-        if isinstance(val, (int, float, str)):
-            text = text.replace("{{"+key+"}}", str(val))
-    
+
+    start = time.perf_counter()
     try:
-        from jinja2 import Template
-        template = Template(text)
-        return template.render(**context)
+        return templates.render(text, context, node_id)
     except Exception as e:
-        print(f"Error en template Jinja2: {e}")
+        logger.warning("Error en template Jinja2: %s", e)
         return text
+    finally:
+        metrics.template_seconds.observe(time.perf_counter() - start)
 
 def filter_radiators(radiator_type: str, installation: str, style: str, color: str, heat_load: float) -> List[Dict[str, Any]]:
     """Filtra radiadores según las preferencias del usuario"""
-    recommended = []
-    
-    for name, model in RADIATOR_MODELS.items():
-        # Filtrar por tipo de radiador (aceptar si coincide o si está en la lista)
-        if isinstance(model.get('type'), str):
-            if model.get('type') != radiator_type:
-                continue
-        else:
-            if radiator_type not in model.get('type', []):
-                continue
-                
-        # Filtrar por tipo de instalación
-        if installation != 'cualquiera':
-            if isinstance(model['installation'], str):
-                if model['installation'] != installation:
-                    continue
-            elif installation not in model['installation']:
-                continue
-                
-        # Filtrar por estilo
-        if style != 'cualquiera' and model['style'] != style:
-            continue
-            
-        # Filtrar por color
-        if color != 'cualquiera' and color not in model['colors']:
-            continue
-            
-        recommended.append({
-            'name': name,
-            'description': model['description'],
-            'coeficiente': model.get('coeficiente', 1.0),
-            'potencia': model['potencia'],
-            'colors': model['colors']
-        })
-    
-    # Ordenar por mejor ajuste a la carga térmica
-    recommended.sort(key=lambda x: abs(x['potencia'] * x['coeficiente'] - heat_load))
-    
-    return recommended[:3]  # Top 3 recomendaciones
+    return contents.current.catalog.filter(radiator_type, installation, style, color, heat_load)  # Top 3 recomendaciones
 
 def format_radiator_recommendations(models: List[Dict[str, Any]], heat_load: float) -> str:
     """Formatea las recomendaciones para mostrarlas al usuario"""
     if not models or not isinstance(models, list):
         return "No encontramos modelos que coincidan con tus requisitos. Por favor intenta con diferentes parámetros."
     
-    result = []
+    # La carga térmica sólo influye en el texto a través de los módulos estimados,
+    # así que la clave de caché usa esos valores en lugar de la carga exacta
+    entries = []
     for i, model in enumerate(models, 1):
         try:
             potencia_efectiva = model.get('potencia', 0) * model.get('coeficiente', 1)
             modulos_estimados = ceil(heat_load / potencia_efectiva) if potencia_efectiva > 0 else 0
-            
-            model_info = [
-                f"{i}. {model.get('name', 'Modelo desconocido')}",
-                f"   - Potencia efectiva: {potencia_efectiva:.0f} kcal/h",
-                f"   - Módulos estimados: {modulos_estimados}",
-                f"   - Descripción: {model.get('description', 'Sin descripción disponible')}"
-            ]
-            
-            if 'colors' in model:
-                model_info.append(f"   - Colores disponibles: {', '.join(model['colors'])}")
-                
-            result.append("\n".join(model_info))
+            colors = ', '.join(model['colors']) if 'colors' in model else None
+            entries.append((
+                i,
+                model.get('name', 'Modelo desconocido'),
+                potencia_efectiva,
+                modulos_estimados,
+                model.get('description', 'Sin descripción disponible'),
+                colors
+            ))
         except Exception as e:
-            print(f"Error formateando modelo {model}: {e}")
+            logger.warning("Error formateando modelo %s: %s", model, e)
             continue
     
+    return _render_recommendations(tuple(entries))
+
+@lru_cache(maxsize=1024)
+def _render_recommendations(entries: tuple) -> str:
+    result = []
+    for i, name, potencia_efectiva, modulos_estimados, description, colors in entries:
+        model_info = [
+            f"{i}. {name}",
+            f"   - Potencia efectiva: {potencia_efectiva:.0f} kcal/h",
+            f"   - Módulos estimados: {modulos_estimados}",
+            f"   - Descripción: {description}"
+        ]
+        
+        if colors is not None:
+            model_info.append(f"   - Colores disponibles: {colors}")
+            
+        result.append("\n".join(model_info))
+    
     return "\n\n".join(result) if result else "No se pudieron generar recomendaciones."
 
-def perform_calculation(node: Dict[str, Any], context: Dict[str, Any]) -> None:
+def format_radiator_mixes(mixes: List[Dict[str, Any]]) -> str:
+    """Formatea las combinaciones de equipos que devuelve radiator_mixes"""
+    if not mixes or not isinstance(mixes, list):
+        return "No encontramos combinaciones de equipos que cubran la carga térmica en el largo de pared disponible."
+    lines = ["Combinaciones de equipos que cubren la carga térmica:"]
+    for i, mix in enumerate(mixes, 1):
+        units = ' + '.join(f"{unit['cantidad']} x {unit['name']} de {unit['modulos']} módulos" for unit in mix['equipos'])
+        lines.append(f"{i}. {units}")
+        lines.append(f"   - Potencia total: {mix['potencia']:.0f} kcal/h (exceso: {mix['exceso']:.0f} kcal/h)")
+        lines.append(f"   - Largo total: {mix['largo_cm']} cm")
+    return "\n".join(lines)
+
+def node_fields(node: Node) -> Dict[str, Any]:
+    """Campos de la respuesta que dependen sólo de la estructura del nodo, no del contexto"""
+    fields: Dict[str, Any] = {}
+    if 'pregunta' in node:
+        fields['type'] = 'question'
+        if 'opciones' in node:
+            fields['options'] = list(node.option_texts)
+        elif node.get('tipo') == 'entrada_usuario':
+            if 'variable' in node:
+                fields['input_type'] = 'number'
+                fields['input_label'] = 'Ingrese el valor'
+            elif 'variables' in node:
+                fields['input_type'] = 'multiple'
+                fields['inputs'] = [
+                    {'name': var, 'label': f'Ingrese {var} (metros)', 'type': 'number'}
+                    for var in node['variables']
+                ]
+    elif node.get('tipo') == 'respuesta':
+        fields['type'] = 'response'
+        if 'opciones' in node:
+            fields['options'] = list(node.option_texts)
+        else:
+            fields['is_final'] = True
+    return fields
+
+# Base de conocimiento y catálogo de radiadores, recargables sin reiniciar
+KNOWLEDGE_BASE_PATH = "peisa_advisor_knowledge_base.json"
+CATALOG_PATH = "peisa_radiator_catalog.json"
+
+# Contenidos ya compilados (python precompiled.py); se usan si corresponden a los JSON
+KNOWLEDGE_SNAPSHOT_PATH = os.environ.get("PEISA_KNOWLEDGE_SNAPSHOT", precompiled.DEFAULT_PATH)
+
+def load_knowledge() -> KnowledgeBase:
+    """Versión vigente de los contenidos: la precompilada si sigue valiendo, si no los JSON"""
+    kb = precompiled.load(KNOWLEDGE_SNAPSHOT_PATH, KNOWLEDGE_BASE_PATH, CATALOG_PATH)
+    if kb is None:
+        return compile_knowledge()
+    bind_functions(kb)
+    return kb
+
+def compile_knowledge() -> KnowledgeBase:
+    """Compila y valida una versión de los contenidos"""
+    kb = KnowledgeBase.from_files(KNOWLEDGE_BASE_PATH, CATALOG_PATH)
+    bind_functions(kb)
+    kb.static = prerender(kb.flow, static_payload)
+    kb.bundle = build_bundle(kb)
+    return kb
+
+def bind_functions(kb: KnowledgeBase) -> None:
+    """Funciones disponibles para las acciones de los nodos de cálculo, ligadas a su catálogo"""
+    kb.namespace = make_namespace({
+        'filter_radiators': kb.catalog.filter,
+        'format_radiator_recommendations': format_radiator_recommendations,
+        'radiator_mixes': kb.catalog.mixes,
+        'format_radiator_mixes': format_radiator_mixes,
+        'partition_circuits': partition_circuits,
+        'ceil': ceil,
+    })
+
+def build_bundle(kb: KnowledgeBase) -> Optional[Dict[str, bytes]]:
+    """Paquete del flujo para el navegador, o None si no puede ejecutarse allí"""
+    try:
+        body = dumps(export_bundle(kb, node_fields))
+    except BundleError as e:
+        logger.warning("El chat usará el servidor para la versión %s: %s", kb.version, e)
+        return None
+    return {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+
+def static_payload(node: Node) -> Dict[str, Any]:
+    """Respuesta de un nodo sin variables, igual para todas las conversaciones"""
+    text = node['pregunta'] if 'pregunta' in node else node['texto']
+    response = Message(conversation_id='', node_id=node.id, **node_fields(node))
+    response.text = replace_variables(text, {}, node.id)
+    payload = response.model_dump()
+    del payload['conversation_id']
+    return payload
+
+contents = ContentRegistry(load_knowledge)
+if os.environ.get("PEISA_RELOAD_WATCH") == "1":
+    contents.watch([KNOWLEDGE_BASE_PATH, CATALOG_PATH])
+
+# Contexto de la conversación (memory://, sqlite:///ruta.db o redis://host:puerto/db).
+# Los backends compartidos guardan el formato binario de snapshot.py
+# (PEISA_CONVERSATION_FORMAT=json para mantener JSON).
+conversations = create_store(
+    os.environ.get("PEISA_CONVERSATION_STORE", "memory://"),
+    ttl=float(os.environ.get("PEISA_CONVERSATION_TTL", 3600)),
+    max_size=int(os.environ.get("PEISA_MAX_CONVERSATIONS", 10000)),
+    serializer=None if os.environ.get("PEISA_CONVERSATION_FORMAT") == "json" else SessionSerializer(contents, logger),
+    # En memoria cada conversación se guarda compactada (state.py)
+    packer=StatePacker(contents)
+)
+
+# Serializa las peticiones de una misma conversación dentro del worker
+conversation_locks = KeyedLock()
+# Respuestas recientes guardadas por Idempotency-Key en cada conversación
+IDEMPOTENCY_KEEP = 2
+
+# Cálculos de los turnos fuera del event loop (PEISA_TURN_EXECUTOR=inline|thread|process),
+# con un máximo de turnos en espera y de segundos por turno. Los nodos de cálculo
+# que suelen tardar menos de PEISA_TURN_INLINE_MS (y la primera vez que se ejecuta
+# cada uno) corren en el event loop, sin el límite de PEISA_TURN_TIMEOUT.
+turns = TurnExecutor(
+    os.environ.get("PEISA_TURN_EXECUTOR", "thread"),
+    workers=int(os.environ.get("PEISA_TURN_WORKERS", 0)) or None,
+    max_pending=int(os.environ.get("PEISA_TURN_MAX_PENDING", 0)) or None,
+    timeout=float(os.environ.get("PEISA_TURN_TIMEOUT", 10)) or None,
+    inline_below=float(os.environ.get("PEISA_TURN_INLINE_MS", 1)) / 1000
+)
+
+# Clave para firmar los snapshots que se entregan al cliente. Sin ella /snapshot y
+# /resume no están habilitados: el cliente podría alterar el contexto que se ejecuta
+SNAPSHOT_KEY = os.environ.get("PEISA_SNAPSHOT_KEY", "").encode() or None
+MAX_SNAPSHOT_SIZE = 64 * 1024
+
+def perform_calculation(node: Node, context: Dict[str, Any], kb: Optional[KnowledgeBase] = None) -> None:
     """Ejecuta los cálculos definidos en un nodo"""
+    namespace = (kb or contents.current).namespace
     params = node.get("parametros", {})
     for key, val in params.items():
         context[key] = val
 
-    for action in node.get("acciones", []):
-        exec_expression(action, context)
+    node_id_var.set(node.id)
+    node_start = time.perf_counter()
+    for action in node.actions:
+        start = time.perf_counter()
+        try:
+            action.run(context, namespace)
+        except Exception as e:
+            logger.error("Error evaluando expresión '%s': %s", action.source, e)
+            raise
+        finally:
+            metrics.action_seconds.labels(node.id, action.target).observe(time.perf_counter() - start)
+    metrics.node_seconds.labels('calculo').observe(time.perf_counter() - node_start)
 
 def exec_expression(expr: str, context: Dict[str, Any]) -> None:
     """Ejecuta una expresión matemática y guarda el resultado en el contexto"""
     try:
-        # Agregar funciones especiales al contexto
-        local_context = {
-            'filter_radiators': filter_radiators,
-            'format_radiator_recommendations': format_radiator_recommendations,
-            'ceil': ceil,
-            'context': context  # Pasamos el contexto completo
-        }
-        
-        # Dividir la expresión en variable y valor
-        var, val_expr = [x.strip() for x in expr.split("=", 1)]
-        
-        # Reemplazar context['variable'] por simplemente variable
-        val_expr = val_expr.replace("context['", "").replace("']", "")
-        
-        # Evaluar la expresión con las variables del contexto
-        val = eval(val_expr, {"__builtins__": None}, {**context, **local_context})
-        context[var] = val
+        compile_action(expr).run(context, contents.current.namespace)
     except Exception as e:
-        print(f"Error evaluando expresión '{expr}': {e}")
+        logger.error("Error evaluando expresión '%s': %s", expr, e)
         raise
 
-# Servir archivos estáticos (CSS, JS, imágenes)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Servir archivos estáticos (CSS, JS, imágenes) desde memoria, comprimidos y con ETag.
+# Con PEISA_DEV=1 se vigilan los archivos y se recargan al cambiar en disco.
+assets = AssetCache(watch=os.environ.get("PEISA_DEV") == "1")
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"], name="static", include_in_schema=False)
+async def static_files(path: str, request: Request):
+    """Sirve un archivo del directorio static"""
+    full_path = safe_join("static", path)
+    if full_path is None or not os.path.isfile(full_path):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    # Los archivos demasiado grandes para la caché se sirven desde disco
+    return assets.serve(request, full_path) or FileResponse(full_path)
 
 @app.get("/", response_class=HTMLResponse)
-async def home():
+async def home(request: Request):
     """Sirve la página principal del chat"""
-    try:
-        with open("chat.html", "r", encoding="utf-8") as f:
-            return HTMLResponse(content=f.read())
-    except FileNotFoundError:
+    response = assets.serve(request, "chat.html")
+    if response is None:
         raise HTTPException(status_code=404, detail="Archivo chat.html no encontrado")
+    return response
 
 @app.post("/start", response_model=ConversationResponse)
+@metrics.instrument("/start")
 async def start_conversation(request: StartConversationRequest):
     """Inicia una nueva conversación"""
     conversation_id = request.conversation_id
-    conversations[conversation_id] = {
+    conversation_id_var.set(conversation_id)
+    conv = {
         'current_node': 'inicio',
-        'context': {}
+        'context': {},
+        # La conversación queda ligada a la versión de los contenidos con que empezó
+        'version': contents.current.version
     }
-    return await get_next_message(conversation_id)
+    response = await get_next_message(conversation_id, conv)
+    save_conversation(conversation_id, conv, response)
+    return send(response)
 
 @app.post("/reply", response_model=ConversationResponse)
-async def handle_reply(request: ReplyRequest):
-    """Maneja las respuestas del usuario"""
+@metrics.instrument("/reply")
+async def handle_reply(request: ReplyRequest,
+                       idempotency_key: Optional[str] = Header(None, max_length=128)):
+    """Maneja las respuestas del usuario.
+
+    Con el encabezado Idempotency-Key, un reintento de la misma respuesta
+    devuelve la respuesta ya calculada en lugar de volver a aplicarla.
+    """
+    async with conversation_locks.hold(request.conversation_id):
+        conversation_id, conv, early = apply_reply(request, idempotency_key)
+        if early is not None:
+            return early
+
+        response = await get_next_message(conversation_id, conv)
+        response = commit_reply(conversation_id, conv, response, idempotency_key)
+    return send(response)
+
+@app.post("/reply/stream")
+async def handle_reply_stream(request: ReplyRequest,
+                              idempotency_key: Optional[str] = Header(None, max_length=128)):
+    """Igual que /reply, pero como Server-Sent Events.
+
+    Antes de ejecutar los cálculos envía un evento 'node' con los campos del
+    nodo en que se detendrá el flujo (tipo, opciones, entradas) y su texto si
+    no depende del contexto, para que el cliente lo muestre de inmediato. Es el
+    único dato anticipado: el texto calculado (las recomendaciones) se arma
+    entero en el pool de turnos y llega en el evento 'done', con la misma
+    respuesta que /reply. Los errores (conversación inexistente, conflicto de
+    turnos) llegan como evento 'error' con su código.
+    """
+    async def events():
+        async with conversation_locks.hold(request.conversation_id):
+            try:
+                conversation_id, conv, early = apply_reply(request, idempotency_key)
+                if early is not None:
+                    yield sse_event('done', early.model_dump())
+                    return
+                kb = contents.get(conv.get('version'))
+                node = get_node_by_id(conv['current_node'], kb)
+                if node is not None:
+                    target = peek(node)
+                    header = {'conversation_id': conversation_id, 'node_id': target.id, **node_fields(target)}
+                    static = kb.static.get(target.id)
+                    if static is not None:
+                        header['text'] = static.text
+                    yield sse_event('node', header)
+                response = await get_next_message(conversation_id, conv)
+                response = commit_reply(conversation_id, conv, response, idempotency_key)
+            except HTTPException as e:
+                yield sse_event('error', {'status_code': e.status_code, 'detail': e.detail})
+                return
+        yield sse_event('done', response.model_dump())
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def apply_reply(request: ReplyRequest, idempotency_key: Optional[str] = None):
+    """Aplica la respuesta del usuario al estado de la conversación.
+
+    Devuelve (conversation_id, conv, early); early es la respuesta a enviar sin
+    avanzar el flujo: la ya calculada para esta Idempotency-Key, o el error
+    cuando los valores ingresados no son válidos.
+    """
     conversation_id = request.conversation_id
     option_index = request.option_index
     input_values = request.input_values or {}
+    conversation_id_var.set(conversation_id)
     
-    if conversation_id not in conversations:
+    conv = conversations.get(conversation_id)
+    if conv is None:
         raise HTTPException(status_code=404, detail="Conversación no encontrada")
-    
-    conv = conversations[conversation_id]
-    node = get_node_by_id(conv['current_node'])
+
+    cached = conv.get('replies', {}).get(idempotency_key) if idempotency_key else None
+    if cached is not None:
+        return conversation_id, conv, Message(**cached)
+    return conversation_id, conv, apply_input(conversation_id, conv, option_index, input_values)
+
+def apply_input(conversation_id: str, conv: Dict[str, Any], option_index: Optional[int],
+                input_values: Dict[str, Any]) -> Optional[Message]:
+    """Aplica la opción elegida o los valores ingresados; devuelve el error si no son válidos"""
+    node = get_node_by_id(conv['current_node'], contents.get(conv.get('version')))
     
     if not node:
         raise HTTPException(status_code=404, detail="Nodo no encontrado")
+    node_id_var.set(node.id)
     
     # Procesar la respuesta del usuario
-    if node.get('tipo') == 'entrada_usuario':
+    if node.tipo == 'entrada_usuario':
         try:
-            if 'variable' in node:
-                value = str(input_values.get('value', '')).replace(',', '.')
-                conv['context'][node['variable']] = float(value)
-            elif 'variables' in node:
-                for var in node['variables']:
-                    value = str(input_values.get(var, '')).replace(',', '.')
-                    conv['context'][var] = float(value)
-            conv['current_node'] = node['siguiente']
+            conv['current_node'] = set_inputs(node, conv['context'], input_values).id
         except ValueError:
-            return ConversationResponse(
+            return Message(
                 conversation_id=conversation_id,
                 node_id=node['id'],
                 error='Por favor ingrese valores numéricos válidos (ej: 4.5, 3.75)',
@@ -329,62 +483,144 @@ async def handle_reply(request: ReplyRequest):
                 text=node['pregunta']
             )
     
-    elif 'opciones' in node:
-        if option_index is not None and 0 <= option_index < len(node['opciones']):
-            selected = node['opciones'][option_index]
-            # Guardar el valor usando el ID del nodo como clave
-            conv['context'][node['id']] = selected.get('valor', selected['texto'])
-            # Guardar también el texto para mostrar
-            conv['context'][f"{node['id']}_texto"] = selected['texto']
-            conv['current_node'] = selected['siguiente']
+    elif node.options:
+        target = choose_option(node, conv['context'], option_index)
+        if target is not None:
+            conv['current_node'] = target.id
     
-    # Debug: Mostrar el contexto completo
-    print("Contexto completo:", conv['context'])
-    
-    return await get_next_message(conversation_id)
+    # Debug: volcar el contexto completo sólo para una muestra de las respuestas
+    log_context(logger, conv['context'], LOG_CONTEXT_SAMPLE)
+    return None
+
+def send(response: Reply) -> Response:
+    """Respuesta HTTP ya serializada; FastAPI no vuelve a validarla con response_model"""
+    return response.to_response()
+
+def save_conversation(conversation_id: str, conv: Dict[str, Any], response: Reply) -> None:
+    """Guarda el estado de la conversación, o la descarta si ya terminó"""
+    if response.is_final:
+        conversations.delete(conversation_id)
+    else:
+        conversations.set(conversation_id, conv)
 
-async def get_next_message(conversation_id: str) -> ConversationResponse:
-    """Obtiene el siguiente mensaje de la conversación"""
-    conv = conversations[conversation_id]
-    node = get_node_by_id(conv['current_node'])
+def commit_reply(conversation_id: str, conv: Dict[str, Any], response: Reply,
+                 idempotency_key: Optional[str] = None) -> Reply:
+    """Guarda el turno sólo si nadie más avanzó la conversación desde que se leyó.
+
+    La respuesta queda guardada junto con el estado bajo su Idempotency-Key, así
+    que ambos cambian juntos; por eso una conversación terminada con clave se
+    conserva hasta que vence, para poder responder a sus reintentos. Devuelve la
+    respuesta a enviar: la propia, o la de otro worker que ya procesó la misma clave.
+    """
+    expected_turn = conv.get('turn', 0)
+    conv['turn'] = expected_turn + 1
+    if idempotency_key:
+        replies = conv.setdefault('replies', {})
+        replies[idempotency_key] = response.model_dump(exclude_none=True)
+        while len(replies) > IDEMPOTENCY_KEEP:
+            del replies[next(iter(replies))]
+    elif response.is_final:
+        conversations.delete(conversation_id)
+        return response
+    if conversations.compare_and_set(conversation_id, conv, expected_turn):
+        return response
+
+    current = conversations.get(conversation_id) if idempotency_key else None
+    cached = current.get('replies', {}).get(idempotency_key) if current else None
+    if cached is not None:
+        return Message(**cached)
+    logger.warning("Conflicto de turnos en la conversación %s", conversation_id)
+    raise HTTPException(status_code=409, detail="La conversación fue modificada por otra petición")
+
+class TurnError(Exception):
+    """HTTPException lanzada en el pool; a diferencia de ella, se puede pasar entre procesos"""
+
+async def get_next_message(conversation_id: str, conv: Dict[str, Any]) -> Reply:
+    """Obtiene el siguiente mensaje de la conversación.
+
+    Si hay nodos de cálculo por recorrer, el turno corre en el pool de turnos
+    sobre una copia del estado, que se aplica sólo si termina a tiempo; el
+    resto (nodos de pregunta o respuesta) cuesta menos que pasar al pool.
+    """
+    node = get_node_by_id(conv['current_node'], contents.get(conv.get('version')))
+    if node is None or node.tipo != 'calculo' or turns.mode == 'inline':
+        return next_message(conversation_id, conv)
+
+    state = {'current_node': conv['current_node'], 'context': dict(conv['context']), 'version': conv.get('version')}
+    response, state = await offload(run_turn, conversation_id, state, key=node.id)
+    conv['current_node'] = state['current_node']
+    conv['context'] = state['context']
+    node_id_var.set(response.node_id)
+    return response
+
+async def offload(fn, *args, key: Optional[str] = None):
+    """Ejecuta fn en el pool de turnos, traduciendo la saturación y los tiempos vencidos a HTTP"""
+    try:
+        return await turns.run(fn, *args, key=key)
+    except Overloaded as e:
+        metrics.turns_rejected.labels('saturado').inc()
+        logger.warning("Pool de turnos saturado: %s", e)
+        raise HTTPException(status_code=503, detail="El servidor está ocupado, intente nuevamente",
+                            headers={'Retry-After': '1'})
+    except TurnTimeout as e:
+        metrics.turns_rejected.labels('tiempo').inc()
+        logger.error("Turno cancelado: %s", e)
+        raise HTTPException(status_code=504, detail="El cálculo tardó demasiado")
+    except TurnError as e:
+        raise HTTPException(status_code=e.args[0], detail=e.args[1])
+
+def turn_contents(version: Optional[str]) -> KnowledgeBase:
+    """Contenidos de una versión; un proceso del pool que no la tiene relee los archivos"""
+    if version is not None and contents.find(version) is None and in_pool_process():
+        contents.reload()
+    return contents.get(version)
+
+def run_turn(conversation_id: str, state: Dict[str, Any]) -> Tuple[Reply, Dict[str, Any]]:
+    """Trabajo de CPU de un turno; en modo 'process' corre en otro proceso y sus métricas quedan allí"""
+    turn_contents(state.get('version'))
+    try:
+        return next_message(conversation_id, state), state
+    except HTTPException as e:
+        raise TurnError(e.status_code, e.detail) from None
+
+def next_message(conversation_id: str, conv: Dict[str, Any]) -> Reply:
+    """Avanza el flujo y arma el mensaje del nodo en que se detiene.
+
+    Para los nodos sin variables devuelve la respuesta pre-renderizada al cargar
+    los contenidos; los handlers la envían con send().
+    """
+    kb = contents.get(conv.get('version'))
+    node = get_node_by_id(conv['current_node'], kb)
     
     if not node:
         raise HTTPException(status_code=404, detail="Nodo no encontrado")
     
-    response = ConversationResponse(
+    # Recorrer en un solo ciclo la cadena de nodos de cálculo
+    try:
+        node = advance(node, conv['context'], lambda calc, context: perform_calculation(calc, context, kb))
+    except StepError as e:
+        logger.error("No se pudo avanzar el flujo: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    conv['current_node'] = node.id
+    node_id_var.set(node.id)
+    node_start = time.perf_counter()
+
+    static = kb.static.get(node.id)
+    if static is not None:
+        metrics.node_seconds.labels(node.tipo or 'pregunta').observe(time.perf_counter() - node_start)
+        return PrerenderedMessage(conversation_id, static)
+    
+    response = Message(
         conversation_id=conversation_id,
-        node_id=node['id']
+        node_id=node.id,
+        **node_fields(node)
     )
     
     # Procesar según el tipo de nodo
-    if node.get('tipo') == 'calculo':
-        perform_calculation(node, conv['context'])
-        conv['current_node'] = node['siguiente']
-        return await get_next_message(conversation_id)
-    elif 'pregunta' in node:
-        response.type = 'question'
-        response.text = replace_variables(node['pregunta'], conv['context'])
-        
-        if 'opciones' in node:
-            response.options = [opt['texto'] for opt in node['opciones']]
-        elif node.get('tipo') == 'entrada_usuario':
-            if 'variable' in node:
-                response.input_type = 'number'
-                response.input_label = 'Ingrese el valor'
-            elif 'variables' in node:
-                response.input_type = 'multiple'
-                response.inputs = [
-                    {'name': var, 'label': f'Ingrese {var} (metros)', 'type': 'number'}
-                    for var in node['variables']
-                ]
+    if 'pregunta' in node:
+        response.text = replace_variables(node['pregunta'], conv['context'], node.id)
     elif node.get('tipo') == 'respuesta':
-        response.type = 'response'
-        response.text = replace_variables(node['texto'], conv['context'])
-        
-        if 'opciones' in node:
-            response.options = [opt['texto'] for opt in node['opciones']]
-        else:
-            response.is_final = True
+        response.text = replace_variables(node['texto'], conv['context'], node.id)
     elif node.get('tipo') == 'opciones_dinamicas':
         # Manejar opciones dinámicas basadas en modelos recomendados
         if 'modelos_recomendados' in conv['context']:
@@ -396,8 +632,173 @@ async def get_next_message(conversation_id: str) -> ConversationResponse:
                 for model in models
             ]
     
+    metrics.node_seconds.labels(node.tipo or 'pregunta').observe(time.perf_counter() - node_start)
     return response
 
+def require_snapshot_key() -> bytes:
+    if SNAPSHOT_KEY is None:
+        raise HTTPException(status_code=404, detail="Snapshots no habilitados (PEISA_SNAPSHOT_KEY)")
+    return SNAPSHOT_KEY
+
+@app.get("/conversations/{conversation_id}/snapshot", response_class=Response,
+         include_in_schema=SNAPSHOT_KEY is not None)
+async def conversation_snapshot(conversation_id: str):
+    """Estado de la conversación en formato binario y firmado, para retomarla en otro worker o nodo"""
+    key = require_snapshot_key()
+    conversation_id_var.set(conversation_id)
+    conv = conversations.get(conversation_id)
+    if conv is None:
+        raise HTTPException(status_code=404, detail="Conversación no encontrada")
+    data = contents.get(conv.get('version')).codec.encode(conv)
+    return Response(content=sign(data, key), media_type="application/octet-stream")
+
+@app.post("/conversations/{conversation_id}/resume", response_model=ConversationResponse,
+          include_in_schema=SNAPSHOT_KEY is not None)
+async def resume_conversation(conversation_id: str, request: Request):
+    """Retoma una conversación a partir de un snapshot y devuelve el mensaje en que quedó.
+
+    Además de la firma se comprueba que el contexto tenga sólo lo que el flujo
+    puede producir (SnapshotCodec.check_context). Del estado guardado se
+    conservan el nodo, el contexto y el turno; no las respuestas por Idempotency-Key.
+    """
+    key = require_snapshot_key()
+    conversation_id_var.set(conversation_id)
+    data = await request.body()
+    if len(data) > MAX_SNAPSHOT_SIZE:
+        raise HTTPException(status_code=413, detail="Snapshot demasiado grande")
+    try:
+        data = verify(data, key)
+        kb = contents.find(snapshot_version(data))
+        if kb is None:
+            raise HTTPException(status_code=409, detail="El snapshot corresponde a una versión de los contenidos que ya no está cargada")
+        decoded = kb.codec.decode(data)
+        context = decoded.get('context')
+        node_id = decoded.get('current_node')
+        if not isinstance(context, dict) or not isinstance(node_id, str) or get_node_by_id(node_id, kb) is None:
+            raise SnapshotError("Snapshot inválido")
+        kb.codec.check_context(context)
+    except SnapshotError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    conv = {'current_node': node_id, 'context': context, 'version': kb.version}
+    if type(decoded.get('turn')) is int:
+        conv['turn'] = decoded['turn']
+
+    response = await get_next_message(conversation_id, conv)
+    save_conversation(conversation_id, conv, response)
+    return send(response)
+
+@app.post("/batch/size", response_model=BatchSizeResponse)
+async def batch_size(request: BatchSizeRequest):
+    """Dimensiona en una sola petición todos los ambientes de una obra"""
+    rooms = [room.model_dump() for room in request.rooms]
+    return await offload(run_batch, contents.current.version, rooms)
+
+def run_batch(version: str, rooms: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Cálculo de /batch/size, ejecutado en el pool de turnos"""
+    kb = turn_contents(version)
+    return size_rooms(rooms, lambda node_id, context: perform_calculation(kb.flow.get(node_id), context, kb))
+
+@app.post("/floor/circuits", response_model=FloorCircuitsResponse)
+async def floor_circuits(request: FloorCircuitsRequest):
+    """Reparte el piso radiante de una obra en circuitos equilibrados y colectores"""
+    node = get_node_by_id(FLOOR_NODE)
+    params = node.get('parametros', {}) if node is not None else {}
+    density = request.densidad or params.get('densidad_caño')
+    max_length = request.longitud_maxima or params.get('longitud_maxima_circuito')
+    if density is None or max_length is None:
+        raise HTTPException(status_code=422, detail="Indique densidad y longitud_maxima: la base de conocimiento no las define")
+    zones = [zone.model_dump() for zone in request.zonas]
+    return await offload(run_circuits, zones, density, max_length, request.salidas, request.exacto)
+
+def run_circuits(zones: List[Dict[str, Any]], density: float, max_length: float,
+                 outlets: int, exact: bool) -> Dict[str, Any]:
+    """Cálculo de /floor/circuits, ejecutado en el pool de turnos"""
+    try:
+        return partition_circuits(zones, density, max_length, outlets, exact)
+    except CircuitError as e:
+        raise TurnError(422, str(e)) from None
+
+@app.get("/flow/bundle", include_in_schema=False)
+async def flow_bundle(request: Request):
+    """Paquete de la versión vigente del flujo, para ejecutarlo en el navegador (static/flow.js).
+
+    El ETag es la versión de los contenidos: el chat lo revalida al empezar cada
+    conversación y recibe 304 mientras no cambien.
+    """
+    kb = contents.current
+    if kb.bundle is None:
+        raise HTTPException(status_code=404, detail="El flujo de esta versión sólo se ejecuta en el servidor")
+    etag = f'"{kb.version}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if etag in [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]:
+        return Response(status_code=304, headers=headers)
+    body = kb.bundle['identity']
+    if 'gzip' in request.headers.get('accept-encoding', ''):
+        body, headers['Content-Encoding'] = kb.bundle['gzip'], 'gzip'
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.post("/flow/submit", response_model=ConversationResponse)
+@metrics.instrument("/flow/submit")
+async def flow_submit(request: FlowSubmitRequest):
+    """Recibe una conversación ejecutada en el navegador.
+
+    El servidor la reproduce con la misma versión de los contenidos, sin
+    guardarla, y devuelve el último mensaje para que el chat lo compare con el
+    suyo. Si esa versión ya no está cargada responde 409 y el chat descarga de
+    nuevo el paquete.
+    """
+    conversation_id = request.conversation_id
+    conversation_id_var.set(conversation_id)
+    kb = contents.find(request.version)
+    if kb is None:
+        raise HTTPException(status_code=409, detail="La versión de los contenidos ya no está cargada")
+    conv = {'current_node': 'inicio', 'context': {}, 'version': kb.version}
+    response = await get_next_message(conversation_id, conv)
+    for step in request.replies:
+        error = apply_input(conversation_id, conv, step.option_index, step.input_values or {})
+        response = error or await get_next_message(conversation_id, conv)
+    return send(response)
+
+@app.post("/admin/reload", include_in_schema=False)
+async def reload_contents(request: Request):
+    """Recarga la base de conocimiento y el catálogo sin reiniciar el worker.
+
+    Requiere el encabezado X-Admin-Token igual a PEISA_ADMIN_TOKEN. Sólo
+    recarga el worker que atiende la petición; con varios workers usar
+    PEISA_RELOAD_WATCH=1 para que cada uno vigile los archivos.
+    """
+    token = os.environ.get("PEISA_ADMIN_TOKEN")
+    if not token or not secrets.compare_digest(request.headers.get("x-admin-token", ""), token):
+        raise HTTPException(status_code=403, detail="No autorizado")
+    try:
+        # Compilar y validar fuera del event loop
+        changed = await run_in_threadpool(contents.reload)
+    except Exception as e:
+        logger.error("No se pudo recargar los contenidos: %s", e)
+        raise HTTPException(status_code=422, detail=f"Contenidos inválidos: {e}")
+    return {"version": contents.current.version, "changed": changed, "versions": contents.versions()}
+
+# Tamaño del almacén de conversaciones. En memoria se cuenta al leer /metrics; en
+# los backends compartidos contar recorre todas las claves (SCAN en Redis, COUNT(*)
+# en SQLite), así que se recalcula cada PEISA_CONVERSATIONS_GAUGE_SECONDS (0: sin gauge)
+CONVERSATIONS_GAUGE_SECONDS = float(os.environ.get("PEISA_CONVERSATIONS_GAUGE_SECONDS", 60))
+if isinstance(conversations, MemoryStore):
+    metrics.registry.register(metrics.Gauge(
+        'peisa_conversations', 'Conversaciones activas en el almacén', lambda: len(conversations)))
+elif CONVERSATIONS_GAUGE_SECONDS > 0:
+    metrics.registry.register(metrics.Gauge(
+        'peisa_conversations', 'Conversaciones activas en el almacén compartido (todos los workers)',
+        lambda: len(conversations), max_age=CONVERSATIONS_GAUGE_SECONDS))
+metrics.registry.register(metrics.Gauge(
+    'peisa_turns_pending', 'Turnos en curso o esperando en el pool de turnos', lambda: turns.pending))
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Métricas del proceso en formato Prometheus"""
+    # Fuera del event loop: algunos gauges consultan el almacén compartido
+    content = await run_in_threadpool(metrics.registry.exposition)
+    return Response(content=content, media_type=metrics.CONTENT_TYPE)
+
 # Endpoint adicional para salud del servicio
 @app.get("/health")
 async def health_check():
@@ -406,4 +807,6 @@ async def health_check():
 
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    # Con varios workers usar un backend compartido (PEISA_CONVERSATION_STORE=sqlite:///... o redis://...)
+    workers = int(os.environ.get("PEISA_WORKERS", 1))
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=workers, reload=workers == 1)
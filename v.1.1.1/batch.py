@@ -0,0 +1,113 @@
+from math import ceil
+from typing import Callable, Dict, Any, List, Optional
+
+# Nodos de cálculo de la base de conocimiento que se reutilizan por ambiente
+RADIATOR_NODE = 'recomendar_modelos'
+FLOOR_NODE = 'calculo_piso_radiante'
+# El flujo resuelve los toalleros con una recomendación fija, sin calcular
+TOWEL_NODE = 'seleccion_toallero'
+
+RADIATOR_FIELDS = ('largo', 'ancho', 'alto', 'nivel_aislacion')
+RADIATOR_PREFERENCES = {
+    'objetivo_radiadores': 'principal',
+    'tipo_instalacion': 'cualquiera',
+    'estilo_diseno': 'cualquiera',
+    'color_preferido': 'cualquiera',
+}
+FLOOR_FIELDS = ('superficie', 'zona_geografica')
+
+
+def _room_context(room: Dict[str, Any]) -> Dict[str, Any]:
+    """Contexto equivalente al que arma la conversación para el ambiente"""
+    if room['tipo'] == 'radiadores':
+        required = RADIATOR_FIELDS
+        context = {**RADIATOR_PREFERENCES, **{k: v for k, v in room.items() if k in RADIATOR_PREFERENCES and v is not None}}
+    else:
+        required = FLOOR_FIELDS
+        context = {'tipo_piso': room.get('tipo_piso')}
+
+    if context.get('objetivo_radiadores') == 'toallero':
+        raise ValueError(f"Los toalleros no se dimensionan por ambiente: el flujo los resuelve en '{TOWEL_NODE}'")
+    missing = [field for field in required if room.get(field) is None]
+    if missing:
+        raise ValueError(f"Faltan datos: {', '.join(missing)}")
+    context.update({field: room[field] for field in required})
+    return context
+
+
+def _radiator_result(context: Dict[str, Any]) -> Dict[str, Any]:
+    heat_load = context['carga_termica']
+    models = []
+    for model in context['modelos_recomendados']:
+        potencia_efectiva = model['potencia'] * model['coeficiente']
+        models.append({
+            'name': model['name'],
+            'potencia_efectiva': round(potencia_efectiva),
+            'modulos_estimados': ceil(heat_load / potencia_efectiva) if potencia_efectiva > 0 else 0,
+            'description': model['description'],
+            'colors': model['colors'],
+        })
+    return {
+        'volumen': context['volumen'],
+        'carga_termica': heat_load,
+        'modelos': models,
+        'texto': context['modelos_recomendados_formateados'],
+        'combinaciones': context['combinaciones_radiadores'],
+    }
+
+
+def _floor_result(context: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'superficie': context['superficie'],
+        'carga_termica': context['carga_termica'],
+        'longitud_total': context['longitud_total'],
+        'circuitos': context['circuitos'],
+    }
+
+
+def size_rooms(rooms: List[Dict[str, Any]], run_node: Callable[[str, Dict[str, Any]], None]) -> Dict[str, Any]:
+    """Dimensiona todos los ambientes de una obra con las fórmulas de los nodos de cálculo.
+
+    run_node(node_id, context) ejecuta las acciones compiladas de un nodo. Los
+    ambientes con datos idénticos (habituales en una obra) se calculan una sola vez.
+    """
+    results: List[Dict[str, Any]] = []
+    computed: Dict[tuple, Dict[str, Any]] = {}
+    totals = {
+        'ambientes': len(rooms),
+        'errores': 0,
+        'radiadores': {'ambientes': 0, 'carga_termica': 0.0},
+        'piso_radiante': {'ambientes': 0, 'superficie': 0.0, 'carga_termica': 0.0,
+                          'longitud_total': 0.0, 'circuitos': 0},
+    }
+
+    for room in rooms:
+        name: Optional[str] = room.get('nombre')
+        try:
+            context = _room_context(room)
+            key = (room['tipo'],) + tuple(sorted(context.items()))
+            result = computed.get(key)
+            if result is None:
+                if room['tipo'] == 'radiadores':
+                    run_node(RADIATOR_NODE, context)
+                    result = _radiator_result(context)
+                else:
+                    run_node(FLOOR_NODE, context)
+                    result = _floor_result(context)
+                computed[key] = result
+        except ValueError as e:
+            # Datos del ambiente inválidos (incluye ExpressionError y CircuitError); el resto es un error del servidor
+            totals['errores'] += 1
+            results.append({'nombre': name, 'tipo': room['tipo'], 'error': str(e)})
+            continue
+
+        results.append({'nombre': name, 'tipo': room['tipo'], **result})
+        summary = totals[room['tipo']]
+        summary['ambientes'] += 1
+        summary['carga_termica'] += result['carga_termica']
+        if room['tipo'] == 'piso_radiante':
+            summary['superficie'] += result['superficie']
+            summary['longitud_total'] += result['longitud_total']
+            summary['circuitos'] += result['circuitos']
+
+    return {'rooms': results, 'totals': totals}
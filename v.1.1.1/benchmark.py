@@ -0,0 +1,739 @@
+"""Benchmarks del asistente.
+
+    python benchmark.py micro                      # microbenchmarks de las funciones internas
+    python benchmark.py load --users 50 --rounds 20  # conversaciones completas en proceso (ASGI)
+    python benchmark.py load --url http://127.0.0.1:8000  # contra un uvicorn local
+    python benchmark.py sessions                   # bytes por conversación guardada: JSON vs binario
+    python benchmark.py memory --sessions 200      # memoria por conversación en MemoryStore: dict vs compacta
+    python benchmark.py mixed --rooms 1000         # latencia de /health mientras corren cálculos grandes
+                                                   # (comparar PEISA_TURN_EXECUTOR=inline, thread y process)
+    python benchmark.py circuits                   # escalado del reparto de piso radiante en circuitos
+    python benchmark.py startup                    # arranque de un worker: JSON vs contenidos precompilados
+    python benchmark.py parity --sessions 300      # static/flow.js (con node) contra /start + /reply
+    python benchmark.py all --output bench.json --compare anterior.json
+
+La carga usa httpx (pip install httpx). La salida JSON permite comparar versiones.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import uuid
+from typing import Callable, Dict, Any, List, Tuple
+
+# La app carga sus archivos con rutas relativas
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())
+
+import app as peisa  # noqa: E402
+from store import MemoryStore  # noqa: E402
+
+# Conversaciones completas por cada camino del flujo: (endpoint, cuerpo sin conversation_id)
+FLOWS = {
+    'piso_radiante': [
+        ('/start', {}),
+        ('/reply', {'option_index': 0}),
+        ('/reply', {'input_values': {'value': '42.5'}}),
+        ('/reply', {'option_index': 0}),
+        ('/reply', {'option_index': 1}),
+        ('/reply', {'option_index': 1}),
+    ],
+    'radiadores': [
+        ('/start', {}),
+        ('/reply', {'option_index': 1}),
+        ('/reply', {'option_index': 0}),
+        ('/reply', {'input_values': {'largo': '4.5', 'ancho': '3,75', 'alto': '2.6'}}),
+        ('/reply', {'option_index': 1}),
+        ('/reply', {'option_index': 2}),
+        ('/reply', {'option_index': 2}),
+        ('/reply', {'option_index': 3}),
+        ('/reply', {'option_index': 1}),
+    ],
+}
+
+# Contexto típico al llegar a la recomendación de radiadores
+RADIATOR_CONTEXT = {
+    'objetivo_radiadores': 'principal', 'largo': 4.5, 'ancho': 3.75, 'alto': 2.6,
+    'nivel_aislacion': 'media', 'tipo_instalacion': 'cualquiera',
+    'estilo_diseno': 'cualquiera', 'color_preferido': 'cualquiera',
+}
+
+MICRO: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def micro(name: str):
+    """Registra un microbenchmark: la función prepara el estado y devuelve lo que se mide"""
+    def register(setup):
+        MICRO[name] = setup
+        return setup
+    return register
+
+
+@micro('get_node_by_id')
+def _get_node():
+    return lambda: peisa.get_node_by_id('mostrar_recomendaciones')
+
+
+@micro('replace_variables')
+def _replace_variables():
+    context = dict(RADIATOR_CONTEXT)
+    peisa.perform_calculation(peisa.get_node_by_id('recomendar_modelos'), context)
+    text = peisa.get_node_by_id('mostrar_recomendaciones')['texto']
+    return lambda: peisa.replace_variables(text, context, 'mostrar_recomendaciones')
+
+
+@micro('exec_expression')
+def _exec_expression():
+    context = dict(RADIATOR_CONTEXT)
+    actions = peisa.get_node_by_id('recomendar_modelos')['acciones']
+
+    def run():
+        for action in actions:
+            peisa.exec_expression(action, context)
+    return run
+
+
+# Contexto al llegar al cálculo de piso radiante (sólo aritmética y subíndices)
+FLOOR_CONTEXT = {'superficie': 42.5, 'tipo_piso': 'ceramico', 'zona_geografica': 'sur'}
+
+
+def _floor_actions():
+    node = peisa.get_node_by_id('calculo_piso_radiante')
+    context = dict(FLOOR_CONTEXT, **node.get('parametros', {}))
+    return node, context
+
+
+@micro('actions_dsl')
+def _actions_dsl():
+    node, context = _floor_actions()
+    namespace = peisa.contents.current.namespace
+
+    def run():
+        for action in node.actions:
+            action.run(context, namespace)
+    return run
+
+
+@micro('actions_eval')
+def _actions_eval():
+    """Referencia: las mismas acciones evaluadas con eval() sobre código compilado"""
+    from expressions import parse_action
+    node, context = _floor_actions()
+    namespace = {'__builtins__': {}, **peisa.contents.current.namespace}
+    compiled = []
+    for action in node['acciones']:
+        target, tree = parse_action(action)
+        compiled.append((target, compile(tree, '<accion>', 'eval')))
+
+    def run():
+        for target, code in compiled:
+            context[target] = eval(code, namespace, context)
+    return run
+
+
+def _model_response(response):
+    """Lo que hace FastAPI con response_model: validar el modelo devuelto y serializarlo"""
+    from fastapi.responses import JSONResponse
+    model = peisa.ConversationResponse
+    return JSONResponse(model.model_validate(response.model_dump()).model_dump(mode='json'))
+
+
+@micro('response_model')
+def _response_model():
+    """Referencia: respuesta de un nodo estático construyendo el modelo y renderizando"""
+    node = peisa.get_node_by_id('nivel_aislacion')
+
+    def run():
+        response = peisa.ConversationResponse(conversation_id='bench', node_id=node.id, **peisa.node_fields(node))
+        response.text = peisa.replace_variables(node['pregunta'], {}, node.id)
+        return _model_response(response)
+    return run
+
+
+@micro('response_static')
+def _response_static():
+    from prerender import PrerenderedMessage
+    static = peisa.contents.current.static['nivel_aislacion']
+    return lambda: PrerenderedMessage('bench', static).to_response()
+
+
+def _recommendations():
+    context = dict(RADIATOR_CONTEXT)
+    peisa.perform_calculation(peisa.get_node_by_id('recomendar_modelos'), context)
+    node = peisa.get_node_by_id('mostrar_recomendaciones')
+    return node, peisa.replace_variables(node['texto'], context, node.id)
+
+
+@micro('response_model_dynamic')
+def _response_model_dynamic():
+    """Referencia: nodo con variables, modelo de Pydantic y serialización de FastAPI"""
+    node, text = _recommendations()
+
+    def run():
+        response = peisa.ConversationResponse(conversation_id='bench', node_id=node.id, **peisa.node_fields(node))
+        response.text = text
+        return _model_response(response)
+    return run
+
+
+@micro('response_lean_dynamic')
+def _response_lean_dynamic():
+    from responses import Message
+    node, text = _recommendations()
+
+    def run():
+        response = Message(conversation_id='bench', node_id=node.id, **peisa.node_fields(node))
+        response.text = text
+        return response.to_response()
+    return run
+
+
+@micro('filter_radiators')
+def _filter_radiators():
+    return lambda: peisa.filter_radiators('principal', 'cualquiera', 'cualquiera', 'cualquiera', 1755.0)
+
+
+@micro('radiator_mixes')
+def _radiator_mixes():
+    catalog = peisa.contents.current.catalog
+    return lambda: catalog.mixes('principal', 'cualquiera', 'cualquiera', 'cualquiera', 1755.0, 8.25)
+
+
+@micro('snapshot_encode')
+def _snapshot_encode():
+    context = dict(RADIATOR_CONTEXT)
+    peisa.perform_calculation(peisa.get_node_by_id('recomendar_modelos'), context)
+    conv = {'current_node': 'mostrar_recomendaciones', 'context': context, 'version': peisa.contents.current.version}
+    return lambda: peisa.contents.current.codec.encode(conv)
+
+
+@micro('snapshot_decode')
+def _snapshot_decode():
+    data = _snapshot_encode()()
+    return lambda: peisa.contents.current.codec.decode(data)
+
+
+def run_micro(number: int, repeat: int) -> Dict[str, Any]:
+    results = {}
+    for name, setup in MICRO.items():
+        fn = setup()
+        timings = timeit.repeat(fn, number=number, repeat=repeat)
+        results[name] = {'ns_per_op': round(min(timings) / number * 1e9, 1), 'number': number}
+        print(f"{name:32s} {results[name]['ns_per_op']:>12.1f} ns/op")
+    return results
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def _simulate_user(client, latencies: List[float], errors: List[str], rounds: int) -> None:
+    for i in range(rounds):
+        flow = FLOWS['piso_radiante'] if i % 2 == 0 else FLOWS['radiadores']
+        conversation_id = uuid.uuid4().hex
+        for path, body in flow:
+            start = time.perf_counter()
+            response = await client.post(path, json={'conversation_id': conversation_id, **body})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(f"{path} {response.status_code}")
+
+
+async def _run_load(users: int, rounds: int, url: str = None) -> Dict[str, Any]:
+    try:
+        import httpx
+    except ImportError:
+        sys.exit("El benchmark de carga requiere httpx (pip install httpx)")
+
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=30)
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=peisa.app), base_url='http://bench')
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    in_process = url is None
+    if in_process:
+        tracemalloc.start()
+        conversations_before = len(peisa.conversations)
+        memory_before = tracemalloc.get_traced_memory()[0]
+
+    async with client:
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        await asyncio.gather(*(_simulate_user(client, latencies, errors, rounds) for _ in range(users)))
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+
+    latencies.sort()
+    result = {
+        'target': url or 'asgi',
+        'users': users,
+        'rounds': rounds,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(_percentile(latencies, 50) * 1000, 3),
+            'p95': round(_percentile(latencies, 95) * 1000, 3),
+            'p99': round(_percentile(latencies, 99) * 1000, 3),
+            'mean': round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        },
+    }
+    if in_process:
+        memory_after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        result['conversations'] = {'before': conversations_before, 'after': len(peisa.conversations)}
+        # CPU del proceso (app y cliente ASGI) por petición
+        result['cpu_ms_per_request'] = round(cpu / len(latencies) * 1000, 3) if latencies else 0.0
+        result['memory_growth_kb'] = round((memory_after - memory_before) / 1024, 1)
+    return result
+
+
+def run_load(users: int, rounds: int, url: str = None) -> Dict[str, Any]:
+    result = asyncio.run(_run_load(users, rounds, url))
+    latency = result['latency_ms']
+    print(f"{result['requests']} peticiones ({result['errors']} errores) en {result['elapsed_s']} s "
+          f"-> {result['rps']} req/s | p50 {latency['p50']} ms  p95 {latency['p95']} ms  p99 {latency['p99']} ms")
+    if 'conversations' in result:
+        print(f"conversaciones: {result['conversations']['before']} -> {result['conversations']['after']} "
+              f"| memoria: +{result['memory_growth_kb']} KB | CPU: {result['cpu_ms_per_request']} ms/petición")
+    return result
+
+
+async def _run_sessions() -> Dict[str, Any]:
+    import httpx
+    results = {}
+    transport = httpx.ASGITransport(app=peisa.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for name, flow in FLOWS.items():
+            conversation_id = uuid.uuid4().hex
+            steps = []
+            # El último paso termina la conversación y la borra del almacén
+            for path, body in flow[:-1]:
+                await client.post(path, json={'conversation_id': conversation_id, **body})
+                conv = peisa.conversations.get(conversation_id)
+                steps.append({
+                    'node': conv['current_node'],
+                    'json': len(json.dumps(conv, ensure_ascii=False, separators=(',', ':')).encode()),
+                    'binary': len(peisa.contents.get(conv['version']).codec.encode(conv)),
+                })
+            peisa.conversations.delete(conversation_id)
+            results[name] = steps
+    return results
+
+
+def run_sessions() -> Dict[str, Any]:
+    """Tamaño del estado guardado en cada paso de las conversaciones de ejemplo"""
+    results = asyncio.run(_run_sessions())
+    for name, steps in results.items():
+        print(name)
+        for step in steps:
+            print(f"  {step['node']:32s} json {step['json']:>6} B  binario {step['binary']:>6} B "
+                  f"({step['binary'] / step['json']:.0%})")
+    return results
+
+
+async def _retained_per_session(client, flow: List[Tuple[str, Dict[str, Any]]], sessions: int,
+                                idempotency: bool) -> float:
+    """Bytes que retiene cada conversación detenida al final de flow, medidos con tracemalloc"""
+    async def converse() -> str:
+        conversation_id = uuid.uuid4().hex
+        for path, body in flow:
+            # Como el chat: cada respuesta con su Idempotency-Key
+            headers = {'Idempotency-Key': uuid.uuid4().hex} if idempotency and path == '/reply' else {}
+            await client.post(path, json={'conversation_id': conversation_id, **body}, headers=headers)
+        return conversation_id
+
+    for _ in range(10):  # Cachés y plantillas ya cargadas antes de medir
+        peisa.conversations.delete(await converse())
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    ids = [await converse() for _ in range(sessions)]
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    for conversation_id in ids:
+        peisa.conversations.delete(conversation_id)
+    return retained / sessions
+
+
+async def _run_memory(sessions: int) -> Dict[str, Any]:
+    import httpx
+    store = peisa.conversations
+    packer = store.packer
+    results: Dict[str, Any] = {}
+    tracemalloc.start()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=peisa.app), base_url='http://bench') as client:
+            for name, flow in FLOWS.items():
+                steps = []
+                # El último paso termina la conversación y la borra del almacén
+                for end in range(1, len(flow)):
+                    conversation_id = uuid.uuid4().hex
+                    for path, body in flow[:end]:
+                        await client.post(path, json={'conversation_id': conversation_id, **body})
+                    step: Dict[str, Any] = {'node': store.get(conversation_id)['current_node']}
+                    store.delete(conversation_id)
+                    for idempotency in (False, True):
+                        suffix = '_idempotency' if idempotency else ''
+                        for label, current in (('dict', None), ('compact', packer)):
+                            store.packer = current
+                            step[label + suffix] = round(
+                                await _retained_per_session(client, flow[:end], sessions, idempotency))
+                    steps.append(step)
+                results[name] = steps
+    finally:
+        store.packer = packer
+        tracemalloc.stop()
+    return results
+
+
+def run_memory(sessions: int) -> Dict[str, Any]:
+    """Memoria por conversación viva en MemoryStore, con y sin el estado compacto de state.py"""
+    if not isinstance(peisa.conversations, MemoryStore):
+        sys.exit("El benchmark de memoria requiere PEISA_CONVERSATION_STORE=memory://")
+    results = asyncio.run(_run_memory(sessions))
+    for name, steps in results.items():
+        print(name)
+        for step in steps:
+            print(f"  {step['node']:26s} dict {step['dict']:>6} B  compacta {step['compact']:>5} B "
+                  f"({step['dict'] / step['compact']:4.1f}x) | con Idempotency-Key {step['dict_idempotency']:>6} B "
+                  f"-> {step['compact_idempotency']:>5} B ({step['dict_idempotency'] / step['compact_idempotency']:4.1f}x)")
+    return results
+
+
+async def _run_mixed(users: int, rounds: int, rooms: int) -> Dict[str, Any]:
+    import httpx
+    body = {'rooms': [
+        {'tipo': 'radiadores', 'largo': 4 + i % 5, 'ancho': 3.5, 'alto': 2.6, 'nivel_aislacion': 'media',
+         'objetivo_radiadores': 'principal', 'tipo_instalacion': 'cualquiera',
+         'estilo_diseno': 'cualquiera', 'color_preferido': 'cualquiera'}
+        if i % 2 else {'tipo': 'piso_radiante', 'superficie': 20 + i % 30, 'zona_geografica': 'sur', 'tipo_piso': 'ceramica'}
+        for i in range(rooms)
+    ]}
+    probes: List[float] = []
+    statuses: Dict[int, int] = {}
+    done = asyncio.Event()
+    transport = httpx.ASGITransport(app=peisa.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=60) as client:
+        async def heavy():
+            for _ in range(rounds):
+                response = await client.post('/batch/size', json=body)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get('/health')
+                probes.append(time.perf_counter() - start)
+                await asyncio.sleep(0.005)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(heavy() for _ in range(users)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+    probes.sort()
+    return {
+        'executor': peisa.turns.mode,
+        'users': users,
+        'rounds': rounds,
+        'rooms': rooms,
+        'statuses': statuses,
+        'elapsed_s': round(elapsed, 3),
+        'probes': len(probes),
+        'health_ms': {
+            'p50': round(_percentile(probes, 50) * 1000, 3),
+            'p99': round(_percentile(probes, 99) * 1000, 3),
+            'max': round(probes[-1] * 1000, 3) if probes else 0.0,
+        },
+    }
+
+
+def run_mixed(users: int, rounds: int, rooms: int) -> Dict[str, Any]:
+    """Capacidad de respuesta del event loop con cálculos pesados en curso"""
+    result = asyncio.run(_run_mixed(users, rounds, rooms))
+    health = result['health_ms']
+    print(f"{result['executor']}: {result['users']}x{result['rounds']} lotes de {result['rooms']} ambientes "
+          f"en {result['elapsed_s']} s {result['statuses']} | {result['probes']} /health: p50 {health['p50']} ms  "
+          f"p99 {health['p99']} ms  máx {health['max']} ms")
+    return result
+
+
+# Cantidades de zonas del benchmark de circuitos y tiempo máximo aceptado por obra
+CIRCUIT_SIZES = (10, 50, 100, 200, 500, 1000, 2000)
+CIRCUIT_LIMIT_MS = 100.0
+
+
+def _building(zones: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Obra sintética: ambientes chicos (baños, pasillos) y grandes, en plantas de hasta 40 zonas"""
+    rng = random.Random(seed)
+    return [
+        {'nombre': f'Zona {i + 1}', 'planta': f'P{i // 40}',
+         'superficie': round(rng.uniform(2, 12) if rng.random() < 0.4 else rng.uniform(12, 60), 1)}
+        for i in range(zones)
+    ]
+
+
+def run_circuits(repeat: int) -> Dict[str, Any]:
+    """Tiempo de partition_circuits según la cantidad de zonas, con y sin búsqueda exacta"""
+    params = peisa.get_node_by_id(peisa.FLOOR_NODE)['parametros']
+    density, max_length = params['densidad_caño'], params['longitud_maxima_circuito']
+    results = {}
+    for zones in CIRCUIT_SIZES:
+        building = _building(zones)
+        row: Dict[str, Any] = {}
+        for label, exact in (('heuristica', False), ('exacta', True)):
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                plan = peisa.partition_circuits(building, density, max_length, exact=exact)
+                times.append(time.perf_counter() - start)
+            row[f'{label}_ms'] = round(min(times) * 1000, 3)
+            row[f'{label}_circuitos'] = plan['resumen']['circuitos']
+        row['cota_inferior'] = plan['resumen']['cota_inferior']
+        row['colectores'] = plan['resumen']['colectores']
+        results[str(zones)] = row
+        flag = '' if row['exacta_ms'] <= CIRCUIT_LIMIT_MS else f'  > {CIRCUIT_LIMIT_MS:.0f} ms'
+        print(f"{zones:>5} zonas: heurística {row['heuristica_ms']:>8.2f} ms ({row['heuristica_circuitos']} circuitos)  "
+              f"exacta {row['exacta_ms']:>8.2f} ms ({row['exacta_circuitos']}, cota {row['cota_inferior']})  "
+              f"{row['colectores']} colectores{flag}")
+    return results
+
+
+# Arranque de un proceso nuevo: segundos en importar la app y si quedó cargado jinja2.
+# Los registros de la app también van a stdout: el resultado va en su propia línea
+_STARTUP_MARKER = 'startup:'
+_STARTUP_SCRIPT = ("import sys, time; start = time.perf_counter(); import app; "
+                   f"print({_STARTUP_MARKER!r}, time.perf_counter() - start, 'jinja2' in sys.modules)")
+
+
+def run_startup(repeat: int) -> Dict[str, Any]:
+    """Importar la app en un proceso nuevo compilando los JSON y con los contenidos precompilados"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'kb.snapshot')
+        with open(path, 'wb') as f:
+            f.write(peisa.precompiled.dump(peisa.compile_knowledge()))
+        for label, snapshot in (('json', os.path.join(tmp, 'no-existe')), ('precompilado', path)):
+            env = {**os.environ, 'PEISA_KNOWLEDGE_SNAPSHOT': snapshot}
+            times, jinja = [], False
+            for _ in range(repeat):
+                stdout = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], env=env, check=True,
+                                        capture_output=True, text=True).stdout
+                out = next(line for line in stdout.splitlines() if line.startswith(_STARTUP_MARKER)).split()
+                times.append(float(out[1]))
+                jinja = out[2] == 'True'
+            load = min(timeit.repeat(peisa.compile_knowledge if label == 'json' else
+                                     lambda: peisa.precompiled.load(path, peisa.KNOWLEDGE_BASE_PATH, peisa.CATALOG_PATH),
+                                     number=1, repeat=repeat))
+            results[label] = {'import_ms': round(min(times) * 1000, 1), 'load_ms': round(load * 1000, 2),
+                              'jinja2': jinja, 'bytes': os.path.getsize(path) if label != 'json' else None}
+            print(f"{label:12s} import app {results[label]['import_ms']:>8.1f} ms  "
+                  f"contenidos {results[label]['load_ms']:>7.2f} ms  jinja2 {'sí' if jinja else 'no'}")
+    return results
+
+
+# Valores que escribe el usuario: números bien y mal formados, como en el chat
+_PARITY_INPUTS = ('4.5', '3,75', '10', '1e2', ' 7 ', '1_000', 'abc', '', '0.1', '2.', '.5', '-3',
+                  '12.345', '1e-5', '999999', '0', 'inf', 'nan', '-Infinity', '1__0', '+8', '3.333333333')
+
+# Reproduce las conversaciones con static/flow.js: lee {bundle, sessions} de stdin
+# y escribe las respuestas de cada una; un error local se marca con 'local_error'
+_PARITY_SCRIPT = """
+const PeisaFlow = require(process.argv[1]);
+let input = '';
+process.stdin.on('data', data => input += data);
+process.stdin.on('end', () => {
+    const { bundle, sessions } = JSON.parse(input);
+    const flow = new PeisaFlow.Flow(bundle);
+    const results = sessions.map(s => {
+        const session = flow.session(s.conversation_id);
+        const responses = [session.begin()];
+        for (const request of s.requests) {
+            try {
+                responses.push(session.reply(request));
+            } catch (error) {
+                responses.push({ local_error: String(error && error.message || error) });
+                break;
+            }
+        }
+        return responses;
+    });
+    process.stdout.write(JSON.stringify(results));
+});
+"""
+
+
+def _parity_request(rng: random.Random, response: Dict[str, Any]) -> Dict[str, Any]:
+    """Respuesta al azar del usuario al mensaje recibido, a veces inválida"""
+    if response.get('options'):
+        index = rng.randrange(len(response['options']))
+        return {'option_index': rng.choice([99, -1, None]) if rng.random() < 0.05 else index}
+    if response.get('inputs'):
+        return {'input_values': {field['name']: rng.choice(_PARITY_INPUTS) if rng.random() < 0.2
+                                 else str(round(rng.uniform(1, 9), 2)) for field in response['inputs']}}
+    value = rng.choice(_PARITY_INPUTS) if rng.random() < 0.3 else str(rng.choice(
+        [rng.randint(1, 400), round(rng.uniform(0.5, 80), rng.randint(0, 3))]))
+    return {'input_values': {'value': value}}
+
+
+async def _parity_sessions(sessions: int, seed: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Paquete del flujo y conversaciones al azar contra el servidor, con sus respuestas"""
+    import httpx
+    rng = random.Random(seed)
+    # Los valores mal formados producen errores 500 a propósito: se registran como respuesta
+    transport = httpx.ASGITransport(app=peisa.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        bundle = (await client.get('/flow/bundle')).json()
+        recorded = []
+        for n in range(sessions):
+            conversation_id = f'parity-{seed}-{n}'
+            response = (await client.post('/start', json={'conversation_id': conversation_id})).json()
+            session = {'conversation_id': conversation_id, 'requests': [], 'responses': [response], 'status': 200}
+            for _ in range(30):
+                if response.get('is_final'):
+                    break
+                request = _parity_request(rng, response)
+                reply = await client.post('/reply', json={'conversation_id': conversation_id, **request})
+                session['requests'].append(request)
+                if reply.status_code != 200:
+                    session['status'] = reply.status_code
+                    break
+                response = reply.json()
+                session['responses'].append(response)
+            peisa.conversations.delete(conversation_id)
+            recorded.append(session)
+    return bundle, recorded
+
+
+def run_parity(sessions: int, seed: int) -> Dict[str, Any]:
+    """Compara static/flow.js con el servidor en conversaciones al azar (requiere node).
+
+    Cada respuesta local debe ser igual a la del servidor. Si el servidor
+    respondió con error, el motor local debe fallar: el chat sigue entonces
+    la conversación en el servidor.
+    """
+    logging.getLogger('peisa').setLevel(logging.CRITICAL)  # Errores esperados de las entradas inválidas
+    bundle, recorded = asyncio.run(_parity_sessions(sessions, seed))
+    payload = json.dumps({'bundle': bundle, 'sessions': [
+        {'conversation_id': s['conversation_id'], 'requests': s['requests']} for s in recorded]})
+    output = subprocess.run(['node', '-e', _PARITY_SCRIPT, os.path.abspath('static/flow.js')],
+                            input=payload, capture_output=True, text=True, check=True).stdout
+    mismatches = []
+    for session, local in zip(recorded, json.loads(output)):
+        for step, (expected, got) in enumerate(zip(session['responses'], local)):
+            if got != expected:
+                mismatches.append({'conversation_id': session['conversation_id'], 'step': step,
+                                   'request': session['requests'][step - 1] if step else None,
+                                   'server': expected, 'local': got})
+                break
+        else:
+            if session['status'] != 200 and 'local_error' not in local[-1]:
+                mismatches.append({'conversation_id': session['conversation_id'], 'step': len(local) - 1,
+                                   'request': session['requests'][-1], 'server': session['status'],
+                                   'local': local[-1]})
+    steps = sum(len(s['requests']) for s in recorded)
+    print(f"{len(recorded)} conversaciones, {steps} respuestas: {len(mismatches)} diferencias")
+    for mismatch in mismatches[:5]:
+        print(json.dumps(mismatch, ensure_ascii=False))
+    return {'sessions': len(recorded), 'steps': steps, 'seed': seed, 'mismatches': mismatches}
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> None:
+    """Muestra la variación respecto de una corrida anterior"""
+    for name, values in current.get('micro', {}).items():
+        before = previous.get('micro', {}).get(name)
+        if before:
+            print(f"{name:32s} {before['ns_per_op']:>10.1f} -> {values['ns_per_op']:>10.1f} ns/op "
+                  f"({values['ns_per_op'] / before['ns_per_op']:.2f}x)")
+    if 'load' in current and 'load' in previous:
+        for key in ('p50', 'p95', 'p99'):
+            print(f"load {key:27s} {previous['load']['latency_ms'][key]:>10.3f} -> "
+                  f"{current['load']['latency_ms'][key]:>10.3f} ms")
+        print(f"load rps {previous['load']['rps']:>34} -> {current['load']['rps']:>10}")
+        if 'cpu_ms_per_request' in current['load'] and 'cpu_ms_per_request' in previous['load']:
+            print(f"load cpu ms/petición {previous['load']['cpu_ms_per_request']:>22.3f} -> "
+                  f"{current['load']['cpu_ms_per_request']:>10.3f}")
+    for zones, row in current.get('circuits', {}).items():
+        before = previous.get('circuits', {}).get(zones)
+        if before:
+            print(f"circuits {zones:>5} zonas {before['exacta_ms']:>17.3f} -> {row['exacta_ms']:>10.3f} ms")
+    for name, steps in current.get('memory', {}).items():
+        for step, before in zip(steps, previous.get('memory', {}).get(name, [])):
+            print(f"memory {name} {step['node']:20s} {before['compact_idempotency']:>6} -> "
+                  f"{step['compact_idempotency']:>6} B/conversación")
+    for label, row in current.get('startup', {}).items():
+        before = previous.get('startup', {}).get(label)
+        if before:
+            print(f"startup {label:24s} {before['import_ms']:>10.1f} -> {row['import_ms']:>10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=['micro', 'load', 'sessions', 'memory', 'mixed', 'circuits', 'startup',
+                                         'parity', 'all'])
+    parser.add_argument('--number', type=int, default=2000, help='iteraciones por repetición (micro)')
+    parser.add_argument('--repeat', type=int, default=5, help='repeticiones, se toma la mejor (micro, circuits, startup)')
+    parser.add_argument('--users', type=int, default=20, help='usuarios simulados concurrentes (load)')
+    parser.add_argument('--rounds', type=int, default=10, help='conversaciones por usuario (load)')
+    parser.add_argument('--sessions', type=int, default=200,
+                        help='conversaciones por paso del flujo (memory) o al azar (parity)')
+    parser.add_argument('--seed', type=int, default=0, help='semilla de las conversaciones al azar (parity)')
+    parser.add_argument('--rooms', type=int, default=500, help='ambientes por lote de /batch/size (mixed)')
+    parser.add_argument('--url', help='servidor uvicorn a medir en lugar de la app en proceso')
+    parser.add_argument('--output', help='guardar los resultados en JSON')
+    parser.add_argument('--compare', help='JSON de una corrida anterior para comparar')
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    if args.mode in ('micro', 'all'):
+        results['micro'] = run_micro(args.number, args.repeat)
+    if args.mode in ('load', 'all'):
+        results['load'] = run_load(args.users, args.rounds, args.url)
+    if args.mode in ('sessions', 'all'):
+        results['sessions'] = run_sessions()
+    if args.mode in ('memory', 'all'):
+        results['memory'] = run_memory(args.sessions)
+    if args.mode in ('mixed', 'all'):
+        results['mixed'] = run_mixed(min(args.users, 8), 3, args.rooms)
+    if args.mode in ('circuits', 'all'):
+        results['circuits'] = run_circuits(args.repeat)
+    if args.mode in ('startup', 'all'):
+        results['startup'] = run_startup(args.repeat)
+    # No entra en 'all': no mide tiempos y requiere node
+    if args.mode == 'parity':
+        results['parity'] = run_parity(args.sessions, args.seed)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+    if results.get('parity', {}).get('mismatches'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Paquete del flujo para ejecutarlo en el navegador (static/flow.js).
+
+    python bundle.py [salida.json]   # exporta el paquete de la versión vigente
+
+Contiene los nodos, las acciones de cálculo como árbol JSON, las plantillas
+partidas en texto y variables, y el catálogo de radiadores. Lleva la misma
+versión que los contenidos; si algo no puede ejecutarse en el cliente (una
+plantilla con lógica de Jinja2, por ejemplo) no se genera y el chat sigue
+usando el servidor; lo mismo si las acciones llaman a una función que
+flow.js no implementa (el paquete lista las que usan).
+"""
+import ast
+from typing import Callable, Dict, Any, List, Union
+
+from expressions import parse_action
+from render import environment
+
+# Versión del formato; flow.js rechaza paquetes de un formato que no conoce
+FORMAT = 2
+
+_OPERATORS = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.FloorDiv: '//', ast.Mod: '%', ast.Pow: '**',
+    ast.USub: '-', ast.UAdd: '+', ast.Not: 'not', ast.And: 'and', ast.Or: 'or',
+    ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=',
+    ast.In: 'in', ast.NotIn: 'not in',
+}
+
+
+class BundleError(ValueError):
+    """La base de conocimiento usa algo que el cliente no sabe ejecutar"""
+
+
+def typed(value: Any) -> Any:
+    """Valor JSON que conserva la diferencia entre int y float ({"$f": x} para los float)"""
+    if isinstance(value, float):
+        return {'$f': value}
+    if isinstance(value, (list, tuple)):
+        return [typed(item) for item in value]
+    if isinstance(value, dict):
+        return {key: typed(item) for key, item in value.items()}
+    return value
+
+
+def export_expression(node: ast.AST) -> list:
+    """Árbol de una expresión validada como listas: [tipo, ...argumentos]"""
+    if isinstance(node, ast.Constant):
+        return ['const', typed(node.value)]
+    if isinstance(node, ast.Name):
+        return ['name', node.id]
+    if isinstance(node, ast.BinOp):
+        return ['bin', _OPERATORS[type(node.op)], export_expression(node.left), export_expression(node.right)]
+    if isinstance(node, ast.UnaryOp):
+        return ['unary', _OPERATORS[type(node.op)], export_expression(node.operand)]
+    if isinstance(node, ast.BoolOp):
+        return ['bool', _OPERATORS[type(node.op)], [export_expression(value) for value in node.values]]
+    if isinstance(node, ast.Compare):
+        return ['cmp', export_expression(node.left),
+                [[_OPERATORS[type(op)], export_expression(right)] for op, right in zip(node.ops, node.comparators)]]
+    if isinstance(node, ast.IfExp):
+        return ['if', export_expression(node.test), export_expression(node.body), export_expression(node.orelse)]
+    if isinstance(node, ast.Subscript):
+        return ['sub', export_expression(node.value), export_expression(node.slice)]
+    if isinstance(node, ast.Call):
+        return ['call', node.func.id, [export_expression(arg) for arg in node.args]]
+    if isinstance(node, (ast.Tuple, ast.List)):
+        return ['list', [export_expression(item) for item in node.elts]]
+    raise BundleError(f"Construcción no soportada en el cliente: {type(node).__name__}")
+
+
+def export_template(text: Any) -> Union[str, List[Union[str, List[str]]]]:
+    """Plantilla como lista de textos y ['var', nombre]; sólo se admiten {{ variable }}"""
+    if not isinstance(text, str):
+        return text
+    from jinja2 import nodes as jinja_nodes
+    parts: List[Union[str, List[str]]] = []
+    for statement in environment().parse(text).body:
+        if not isinstance(statement, jinja_nodes.Output):
+            raise BundleError(f"Plantilla con lógica de Jinja2: {text[:40]!r}")
+        for item in statement.nodes:
+            if isinstance(item, jinja_nodes.TemplateData):
+                parts.append(item.data)
+            elif isinstance(item, jinja_nodes.Name):
+                parts.append(['var', item.name])
+            else:
+                raise BundleError(f"Plantilla con expresiones de Jinja2: {text[:40]!r}")
+    if all(isinstance(part, str) for part in parts):
+        return ''.join(parts)
+    return parts
+
+
+def export_node(node, fields: Callable[[Any], Dict[str, Any]]) -> Dict[str, Any]:
+    """Nodo con sus aristas como IDs y los campos fijos de su respuesta"""
+    data: Dict[str, Any] = {'id': node.id, 'tipo': node.tipo, 'fields': fields(node)}
+    if node.siguiente is not None:
+        data['siguiente'] = node.siguiente.id
+    for key in ('pregunta', 'texto'):
+        if key in node:
+            # El texto original se envía tal cual en los errores de entrada; la
+            # plantilla sólo cuando el texto renderizado no es el original
+            data[key] = node[key]
+            template = export_template(node[key])
+            if template != node[key]:
+                data.setdefault('plantillas', {})[key] = template
+    if 'variable' in node:
+        data['variable'] = node['variable']
+    if 'variables' in node:
+        data['variables'] = list(node['variables'])
+    if node.options:
+        data['opciones'] = [
+            {'texto': opt.texto, 'valor': typed(opt.valor), 'siguiente': opt.siguiente.id}
+            for opt in node.options
+        ]
+    if 'parametros' in node:
+        data['parametros'] = typed(node['parametros'])
+    if node.actions:
+        data['acciones'] = [
+            {'target': action.target, 'expr': export_expression(parse_action(action.source)[1].body)}
+            for action in node.actions
+        ]
+    return data
+
+
+def used_functions(nodes) -> List[str]:
+    """Funciones que llaman las acciones; el cliente debe implementarlas todas"""
+    names = set()
+    for node in nodes:
+        for action in node.actions:
+            names.update(call.func.id for call in ast.walk(parse_action(action.source)[1])
+                         if isinstance(call, ast.Call))
+    return sorted(names)
+
+
+def export_bundle(kb, fields: Callable[[Any], Dict[str, Any]]) -> Dict[str, Any]:
+    """Paquete completo de una versión de los contenidos.
+
+    fields(node) son los campos de la respuesta que dependen sólo del nodo
+    (los mismos que usa el servidor), para que el cliente arme respuestas iguales.
+    """
+    return {
+        'format': FORMAT,
+        'version': kb.version,
+        'start': 'inicio',
+        'functions': used_functions(kb.flow.nodes.values()),
+        'nodes': [export_node(node, fields) for node in kb.flow.nodes.values()],
+        'catalog': {
+            'any': kb.catalog.ANY,
+            'models': [
+                {**typed(record), 'attributes': attributes, 'modular': modular}
+                for record, attributes, modular in zip(kb.catalog.records, kb.catalog.attributes, kb.catalog.modular)
+            ],
+        },
+    }
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    output = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else None
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    if output is None:
+        # El paquete sale por stdout: los registros de arranque van a stderr
+        from logs import setup_logging
+        setup_logging(stream=sys.stderr)
+    import app
+
+    kb = app.contents.current
+    if kb.bundle is None:
+        sys.exit("Esta versión de los contenidos no puede ejecutarse en el cliente")
+    if output is None:
+        sys.stdout.buffer.write(kb.bundle['identity'])
+    else:
+        with open(output, 'wb') as f:
+            f.write(kb.bundle['identity'])
+        print(f"versión {kb.version}: {len(kb.bundle['identity'])} bytes ({len(kb.bundle['gzip'])} con gzip)")
@@ -0,0 +1,151 @@
+import math
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import product
+from typing import Dict, Any, List, Tuple
+
+import numpy as np
+
+from radiator_mix import describe, pareto_mixes, wall_modules
+
+
+def _as_list(value: Any) -> List[str]:
+    """Normaliza atributos que pueden venir como texto o como lista"""
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+class RadiatorCatalog:
+    """Catálogo de radiadores normalizado en columnas con índices por atributo.
+
+    Cada valor de tipo, instalación, estilo y color tiene una máscara booleana
+    precalculada; seleccionar los modelos es combinar máscaras.
+
+    Como las preferencias son un espacio discreto pequeño, se precalcula para
+    cada combinación la lista de candidatos ordenada por potencia efectiva; en
+    cada petición sólo se ubica la carga con bisect y se eligen los más cercanos
+    a |potencia*coeficiente - carga térmica|.
+    """
+
+    ANY = 'cualquiera'
+
+    def __init__(self, models: Dict[str, Dict[str, Any]]):
+        self.names = list(models)
+        self.records = []
+        self.attributes: List[Dict[str, List[str]]] = []  # Atributos de filtrado normalizados, por fila
+        self.modular: List[bool] = []  # Se arma con módulos; si no, es un equipo de medida fija
+        effective = []
+        columns = {'type': [], 'installation': [], 'style': [], 'colors': []}
+
+        for name, model in models.items():
+            record = {
+                'name': name,
+                'description': model['description'],
+                'coeficiente': model.get('coeficiente', 1.0),
+                'potencia': model['potencia'],
+                'colors': model['colors']
+            }
+            self.records.append(record)
+            effective.append(record['potencia'] * record['coeficiente'])
+            self.modular.append(model.get('modular', True))
+            self.attributes.append({column: _as_list(model.get(column)) for column in columns})
+            for column in columns:
+                columns[column].append(self.attributes[-1][column])
+
+        self.effective = np.array(effective, dtype=np.float64)
+        self._all = np.ones(len(self.names), dtype=bool)
+        self._none = np.zeros(len(self.names), dtype=bool)
+        self._indexes = {column: self._build_index(values) for column, values in columns.items()}
+        self._lookup = self._build_lookup()
+        # Frentes de Pareto por (candidatos, carga térmica, módulos que entran en la pared)
+        self._mixes = lru_cache(maxsize=1024)(self._pareto)
+
+    def _build_index(self, values: List[List[str]]) -> Dict[str, np.ndarray]:
+        index: Dict[str, np.ndarray] = {}
+        for row, row_values in enumerate(values):
+            for value in row_values:
+                if value not in index:
+                    index[value] = np.zeros(len(values), dtype=bool)
+                index[value][row] = True
+        return index
+
+    def _build_lookup(self) -> Dict[Tuple[str, str, str, str], Tuple[List[float], List[int]]]:
+        """Candidatos de cada combinación de preferencias, ordenados por (potencia efectiva, orden de catálogo)"""
+        lookup = {}
+        values = [list(self._indexes[column]) + ([] if column == 'type' else [self.ANY])
+                  for column in ('type', 'installation', 'style', 'colors')]
+        for combination in product(*values):
+            rows = sorted(self.select(*combination).tolist(), key=lambda row: (self.effective[row], row))
+            lookup[combination] = ([float(self.effective[row]) for row in rows], rows)
+        return lookup
+
+    def mask(self, column: str, value: str, allow_any: bool = True) -> np.ndarray:
+        """Máscara de filas que aceptan el valor ('cualquiera' acepta todas)"""
+        if allow_any and value == self.ANY:
+            return self._all
+        return self._indexes[column].get(value, self._none)
+
+    def select(self, radiator_type: str, installation: str, style: str, color: str) -> np.ndarray:
+        """Índices de los modelos que cumplen las preferencias, en orden de catálogo"""
+        mask = (self.mask('type', radiator_type, allow_any=False)
+                & self.mask('installation', installation)
+                & self.mask('style', style)
+                & self.mask('colors', color))
+        return np.flatnonzero(mask)
+
+    def lookup(self, radiator_type: str, installation: str, style: str, color: str,
+               heat_load: float, limit: int = 3) -> List[int]:
+        """Los 'limit' modelos cuya potencia efectiva más se acerca a la carga térmica.
+
+        Ante empates se respeta el orden del catálogo, igual que un sort estable.
+        """
+        entry = self._lookup.get((radiator_type, installation, style, color))
+        if entry is None:
+            # Combinación sin candidatos posibles (valor desconocido)
+            return []
+        effective, rows = entry
+        pos = bisect_left(effective, heat_load)
+        lo, hi = max(0, pos - limit), min(len(rows), pos + limit)
+        # Incluir los empatados en los bordes de la ventana
+        while lo > 0 and effective[lo - 1] == effective[lo]:
+            lo -= 1
+        while hi < len(rows) and effective[hi] == effective[hi - 1]:
+            hi += 1
+        window = sorted(range(lo, hi), key=lambda i: (abs(effective[i] - heat_load), rows[i]))
+        return [rows[i] for i in window[:limit]]
+
+    def filter(self, radiator_type: str, installation: str, style: str, color: str,
+               heat_load: float, limit: int = 3) -> List[Dict[str, Any]]:
+        rows = self.lookup(radiator_type, installation, style, color, heat_load, limit)
+        return [dict(self.records[i]) for i in rows]
+
+    def _pareto(self, rows: Tuple[int, ...], heat_load: float, wall: int) -> list:
+        return pareto_mixes([float(self.effective[row]) for row in rows], heat_load, wall)
+
+    def mixes(self, radiator_type: str, installation: str, style: str, color: str,
+              heat_load: float, wall_length: float, limit: int = 3) -> List[Dict[str, Any]]:
+        """Combinaciones de modelos y módulos que cubren la carga con el menor exceso (radiator_mix.py).
+
+        Considera los modelos modulares que cumplen las preferencias (los de
+        medida fija, como el toallero, no se arman por módulos); wall_length es
+        el largo de pared disponible en metros.
+        """
+        if not math.isfinite(heat_load) or heat_load <= 0:
+            return []
+        rows = tuple(row for row in self.select(radiator_type, installation, style, color).tolist() if self.modular[row])
+        front = self._mixes(rows, float(heat_load), wall_modules(wall_length))
+        names = [self.names[row] for row in rows]
+        effective = [float(self.effective[row]) for row in rows]
+        return [describe(mix, names, effective, heat_load) for mix in front[:limit]]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # La caché de combinaciones no se guarda (precompiled.py): empieza vacía
+        return {k: v for k, v in self.__dict__.items() if k != '_mixes'}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._mixes = lru_cache(maxsize=1024)(self._pareto)
+
+    def __len__(self) -> int:
+        return len(self.names)
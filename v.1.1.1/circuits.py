@@ -0,0 +1,349 @@
+"""Partición del caño de piso radiante en circuitos y colectores.
+
+Cada zona lleva superficie * densidad metros de caño. Una zona que supera el
+largo máximo de circuito se parte en el mínimo de circuitos propios de largos
+iguales; las zonas chicas se agrupan en circuitos compartidos (bin packing)
+con Best Fit Decreasing, que se refina con una búsqueda exacta acotada por
+cantidad de nodos y luego se equilibra. Los circuitos de cada planta se
+reparten entre el mínimo de colectores, con cantidades de salidas parejas y
+sin separar las zonas de un mismo circuito.
+
+Las longitudes se manejan en centímetros enteros: sumas y comparaciones exactas.
+"""
+import heapq
+import math
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+# Salidas por colector
+OUTLETS = 12
+# Circuitos que examina la búsqueda exacta en toda la obra: acota el tiempo en obras grandes
+EXACT_STEPS = 100000
+# Pares de circuitos que examina la etapa de equilibrio, por planta
+BALANCE_STEPS = 20000
+# Circuitos que puede llegar a tener una obra (cada zona chica cuenta como uno)
+MAX_CIRCUITS = 10000
+
+_CM = 100
+
+
+class CircuitError(ValueError):
+    """Zonas o parámetros inválidos para calcular los circuitos"""
+
+
+def _zones(zones: Sequence[Any]) -> List[Tuple[str, Any, float]]:
+    """(nombre, planta, superficie) de cada zona; acepta superficies sueltas o dicts"""
+    result = []
+    for i, zone in enumerate(zones):
+        if isinstance(zone, dict):
+            name = zone.get('nombre') or f"Zona {i + 1}"
+            area, floor = zone.get('superficie'), zone.get('planta')
+        else:
+            name, area, floor = f"Zona {i + 1}", zone, None
+        if isinstance(area, bool) or not isinstance(area, (int, float)) or not math.isfinite(area) or area <= 0:
+            raise CircuitError(f"Superficie inválida para '{name}': {area!r}")
+        result.append((name, floor, area))
+    return result
+
+
+def lower_bound(lengths: Sequence[int], capacity: int) -> int:
+    """Mínimo de circuitos posible (cota L2 de Martello y Toth)"""
+    sizes = sorted(lengths)
+    prefix = [0]
+    for size in sizes:
+        prefix.append(prefix[-1] + size)
+    half = bisect_right(sizes, capacity // 2)  # tramos que ocupan a lo sumo medio circuito
+    best = 0
+    for alpha in [0] + sorted(set(sizes[:half])):
+        # Tramos grandes que no comparten circuito con uno de al menos alpha, los de más de
+        # medio circuito y los de [alpha, medio circuito] que no entran en el espacio que dejan
+        top = bisect_right(sizes, capacity - alpha)
+        low = bisect_left(sizes, alpha)
+        large = len(sizes) - half
+        spare = (top - half) * capacity - (prefix[top] - prefix[half])
+        rest = prefix[half] - prefix[low] - spare
+        best = max(best, large + max(0, -(-rest // capacity)))
+    return best
+
+
+def best_fit(lengths: Sequence[int], capacity: int) -> List[List[int]]:
+    """Best Fit Decreasing: cada tramo va al circuito con menos espacio libre donde entra"""
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    bins: List[List[int]] = []
+    free: List[Tuple[int, int]] = []  # (espacio libre, circuito), ordenada
+    for i in order:
+        pos = bisect_left(free, (lengths[i], -1))
+        if pos == len(free):
+            bins.append([i])
+            insort(free, (capacity - lengths[i], len(bins) - 1))
+        else:
+            space, b = free.pop(pos)
+            bins[b].append(i)
+            insort(free, (space - lengths[i], b))
+    return bins
+
+
+def exact_fit(lengths: Sequence[int], capacity: int, count: int, budget: int) -> Tuple[Optional[List[List[int]]], int]:
+    """Reparte los tramos en count circuitos por búsqueda en profundidad.
+
+    Devuelve (circuitos o None, pasos usados); None también si se agotó el
+    presupuesto (circuitos examinados) sin encontrar un reparto. Poda circuitos con la misma carga
+    (intercambiables), tramos iguales en orden decreciente de circuito y el
+    espacio que ya no puede usar ningún tramo restante.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    sizes = [lengths[i] for i in order]
+    n = len(sizes)
+    if n == 0:
+        return [], 0
+    suffix = [0] * (n + 1)
+    for k in range(n - 1, -1, -1):
+        suffix[k] = suffix[k + 1] + sizes[k]
+    smallest = sizes[-1]
+
+    def usable(load: int) -> int:
+        return capacity - load if capacity - load >= smallest else 0
+
+    loads = [0] * count
+    free = count * capacity  # espacio que todavía puede recibir algún tramo
+    choice = [-1] * n
+    nodes = 0
+    k = 0
+    while 0 <= k < n:
+        size = sizes[k]
+        if choice[k] >= 0:
+            b = choice[k]
+            free += usable(loads[b] - size) - usable(loads[b])
+            loads[b] -= size
+            b += 1
+        else:
+            b = choice[k - 1] if k and sizes[k - 1] == size else 0
+        seen = set(loads[:b])
+        nodes += b + 1
+        placed = False
+        while b < count:
+            nodes += 1
+            load = loads[b]
+            if load + size <= capacity and load not in seen:
+                change = usable(load + size) - usable(load)
+                if free + change >= suffix[k + 1]:
+                    loads[b] = load + size
+                    free += change
+                    placed = True
+                    break
+            seen.add(load)
+            b += 1
+        if nodes >= budget:
+            return None, nodes
+        if placed:
+            choice[k] = b
+            k += 1
+        else:
+            choice[k] = -1
+            k -= 1
+    if k < 0:
+        return None, nodes
+    bins: List[List[int]] = [[] for _ in range(count)]
+    for k, b in enumerate(choice):
+        bins[b].append(order[k])
+    return bins, nodes
+
+
+def worst_fit(lengths: Sequence[int], capacity: int, count: int) -> Optional[List[List[int]]]:
+    """Worst Fit Decreasing en count circuitos: cada tramo al menos cargado; None si no entra"""
+    bins: List[List[int]] = [[] for _ in range(count)]
+    heap = [(0, b) for b in range(count)]
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        load, b = heapq.heappop(heap)
+        if load + lengths[i] > capacity:
+            return None
+        bins[b].append(i)
+        heapq.heappush(heap, (load + lengths[i], b))
+    return bins
+
+
+def balance(bins: List[List[int]], lengths: Sequence[int], capacity: int, steps: int = BALANCE_STEPS) -> None:
+    """Acerca las cargas de los circuitos moviendo o intercambiando tramos, sin vaciar ninguno.
+
+    Cada cambio entre un circuito cargado y otro más liviano reduce la suma de
+    los cuadrados de las cargas, así que la búsqueda termina; steps acota los
+    pares de circuitos examinados.
+    """
+    loads = [sum(lengths[i] for i in items) for items in bins]
+    improved = True
+    while improved and steps > 0:
+        ranked = sorted(range(len(bins)), key=lambda b: loads[b])
+        improved = False
+        for heavy in reversed(ranked):
+            for light in ranked:
+                gap = loads[heavy] - loads[light]
+                steps -= 1
+                if gap <= 1 or steps <= 0:
+                    break
+                room = capacity - loads[light]
+                best: Optional[Tuple[int, int, int]] = None  # (distancia a gap/2, tramo, tramo o -1)
+                for x in bins[heavy]:
+                    if len(bins[heavy]) > 1 and lengths[x] < gap and lengths[x] <= room:
+                        candidate = (abs(2 * lengths[x] - gap), x, -1)
+                        best = candidate if best is None or candidate < best else best
+                    for y in bins[light]:
+                        delta = lengths[x] - lengths[y]
+                        if 0 < delta < gap and delta <= room:
+                            candidate = (abs(2 * delta - gap), x, y)
+                            best = candidate if best is None or candidate < best else best
+                if best is not None:
+                    _, x, y = best
+                    bins[heavy].remove(x)
+                    bins[light].append(x)
+                    delta = lengths[x]
+                    if y >= 0:
+                        bins[light].remove(y)
+                        bins[heavy].append(y)
+                        delta -= lengths[y]
+                    loads[heavy] -= delta
+                    loads[light] += delta
+                    improved = True
+                    break
+            if improved or steps <= 0:
+                break
+
+
+def pack(lengths: Sequence[int], capacity: int, budget: int = EXACT_STEPS) -> Tuple[List[List[int]], int, int]:
+    """Circuitos (índices de tramos) con el mínimo de circuitos encontrado, equilibrados.
+
+    Devuelve también la cota inferior (si coincide con la cantidad de
+    circuitos, el reparto es óptimo) y los pasos de búsqueda exacta usados;
+    con budget=0 queda el resultado de la heurística.
+    """
+    bound = lower_bound(lengths, capacity)
+    bins = best_fit(lengths, capacity)
+    spent = 0
+    while len(bins) > bound and spent < budget:
+        better, used = exact_fit(lengths, capacity, len(bins) - 1, budget - spent)
+        spent += used
+        if better is None:
+            break
+        bins = better
+    spread = worst_fit(lengths, capacity, len(bins))
+    if spread is not None:
+        bins = spread
+    balance(bins, lengths, capacity)
+    return bins, bound, spent
+
+
+def _manifolds(groups: List[List[int]], lengths: List[int], outlets: int) -> List[List[int]]:
+    """Reparte grupos de circuitos (los de una misma zona) entre el mínimo de colectores.
+
+    Las salidas quedan parejas (difieren en a lo sumo una). Cada grupo va
+    entero al colector con más salidas libres, y a igualdad al de menos caño;
+    un grupo que no entra en ninguno se reparte entre varios.
+    """
+    total = sum(len(group) for group in groups)
+    count = -(-total // outlets)
+    result: List[List[int]] = [[] for _ in range(count)]
+    # (-salidas libres, caño, colector): el primero es el que mejor recibe un grupo
+    heap = [(-(total // count + (1 if m < total % count else 0)), 0, m) for m in range(count)]
+    heapq.heapify(heap)
+    for group in sorted(groups, key=lambda g: (-len(g), -sum(lengths[c] for c in g))):
+        pending = sorted(group, key=lambda c: -lengths[c])
+        while pending:
+            slots, load, m = heapq.heappop(heap)
+            taken, pending = pending[:-slots], pending[-slots:]
+            result[m].extend(taken)
+            heapq.heappush(heap, (slots + len(taken), load + sum(lengths[c] for c in taken), m))
+    return result
+
+
+def partition_circuits(zones: Sequence[Any], density: float, max_length: float,
+                       outlets: int = OUTLETS, exact: bool = True) -> Dict[str, Any]:
+    """Circuitos equilibrados de hasta max_length metros y su colector.
+
+    zones es una lista de superficies en m² o de dicts con 'superficie' y
+    opcionalmente 'nombre' y 'planta' (los circuitos de plantas distintas no
+    comparten colector). density son metros de caño por m². exact=False omite
+    la búsqueda exacta y deja el resultado de la heurística.
+    """
+    if not (density > 0 and math.isfinite(density) and max_length > 0 and math.isfinite(max_length)):
+        raise CircuitError("La densidad y el largo máximo de circuito deben ser positivos")
+    capacity = round(max_length * _CM)
+    if capacity <= 0:
+        raise CircuitError("La densidad y el largo máximo de circuito deben ser positivos")
+    if outlets < 1:
+        raise CircuitError("Un colector necesita al menos una salida")
+    zone_list = _zones(zones)
+
+    floors: Dict[Any, List[int]] = {}
+    zone_lengths = []
+    count = 0  # cota superior de la cantidad de circuitos
+    for z, (name, floor, area) in enumerate(zone_list):
+        length = area * density * _CM
+        if not math.isfinite(length):
+            raise CircuitError(f"Largo de caño fuera de rango para '{name}'")
+        zone_lengths.append(max(1, round(length)))
+        count += -(-zone_lengths[-1] // capacity)
+        floors.setdefault(floor, []).append(z)
+    if count > MAX_CIRCUITS:
+        raise CircuitError(f"La obra necesita más de {MAX_CIRCUITS} circuitos; divídala en partes")
+
+    circuits: List[Dict[str, Any]] = []
+    manifolds: List[Dict[str, Any]] = []
+    bound_total = 0
+    budget = EXACT_STEPS if exact else 0
+    for floor, members in floors.items():
+        # Tramos: zonas chicas (se agrupan) y partes iguales de las zonas grandes (circuitos propios)
+        pieces: List[Tuple[int, int]] = []  # (zona, longitud)
+        floor_circuits: List[List[Tuple[int, int]]] = []
+        groups: List[List[int]] = []
+        for z in members:
+            length = zone_lengths[z]
+            parts = -(-length // capacity)
+            if parts == 1:
+                pieces.append((z, length))
+                continue
+            base, extra = divmod(length, parts)
+            groups.append(list(range(len(floor_circuits), len(floor_circuits) + parts)))
+            floor_circuits.extend([(z, base + (1 if p < extra else 0))] for p in range(parts))
+            bound_total += parts
+
+        bins, bound, used = pack([length for _, length in pieces], capacity, budget)
+        budget -= used
+        bound_total += bound
+        for items in bins:
+            groups.append([len(floor_circuits)])
+            floor_circuits.append(sorted((pieces[i] for i in items), key=lambda piece: piece[0]))
+
+        lengths = [sum(length for _, length in circuit) for circuit in floor_circuits]
+        for assigned in _manifolds(groups, lengths, outlets):
+            number = len(manifolds) + 1
+            ids = []
+            for c in sorted(assigned, key=lambda c: (-lengths[c], floor_circuits[c][0][0])):
+                ids.append(len(circuits) + 1)
+                circuits.append({
+                    'circuito': ids[-1],
+                    'planta': floor,
+                    'colector': number,
+                    'longitud': lengths[c] / _CM,
+                    'zonas': [{'nombre': zone_list[z][0], 'longitud': length / _CM} for z, length in floor_circuits[c]],
+                })
+            manifolds.append({
+                'colector': number,
+                'planta': floor,
+                'circuitos': ids,
+                'longitud': sum(lengths[c] for c in assigned) / _CM,
+            })
+
+    circuit_lengths = [circuit['longitud'] for circuit in circuits]
+    return {
+        'circuitos': circuits,
+        'colectores': manifolds,
+        'resumen': {
+            'zonas': len(zone_list),
+            'circuitos': len(circuits),
+            'colectores': len(manifolds),
+            'longitud_total': sum(zone_lengths) / _CM,
+            'longitud_maxima': max(circuit_lengths, default=0.0),
+            'longitud_minima': min(circuit_lengths, default=0.0),
+            'cota_inferior': bound_total,
+            'optimo': len(circuits) == bound_total,
+        },
+    }
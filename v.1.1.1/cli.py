@@ -0,0 +1,60 @@
+from typing import Dict, Any
+
+from app import contents, perform_calculation, replace_variables
+from engine import StepError, advance, choose_option, set_inputs
+from flow import Node
+
+
+def ask_option(node: Node) -> int:
+    """Muestra las opciones del nodo y devuelve el índice elegido"""
+    for i, texto in enumerate(node.option_texts, 1):
+        print(f"{i}. {texto}")
+    while True:
+        choice = input("Elige una opción: ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(node.options):
+            return int(choice) - 1
+        print("Opción inválida.")
+
+
+def ask_inputs(node: Node) -> Dict[str, Any]:
+    """Pide los valores numéricos de un nodo de entrada"""
+    if 'variable' in node:
+        return {'value': input("Respuesta: ").strip()}
+    return {var: input(f"Ingrese {var}: ").strip() for var in node.get('variables', [])}
+
+
+def run_chatbot():
+    """Versión de consola del asistente, sobre el mismo motor de pasos que la API"""
+    context: Dict[str, Any] = {}
+    node = contents.current.flow.get("inicio")
+    while node is not None:
+        try:
+            node = advance(node, context, perform_calculation)
+        except StepError as e:
+            print("Error en el flujo:", e)
+            break
+
+        if 'pregunta' in node:
+            print("\n" + replace_variables(node['pregunta'], context, node.id))
+        elif node.tipo == 'respuesta':
+            print("\n" + replace_variables(node['texto'], context, node.id))
+        else:
+            print("Tipo de nodo desconocido:", node.tipo)
+            break
+
+        if node.options:
+            node = choose_option(node, context, ask_option(node))
+        elif node.tipo == 'entrada_usuario':
+            while True:
+                try:
+                    node = set_inputs(node, context, ask_inputs(node))
+                    break
+                except ValueError:
+                    print("Por favor ingrese valores numéricos válidos (ej: 4.5, 3.75)")
+        else:
+            break
+
+
+if __name__ == "__main__":
+    print("Bienvenido al sistema experto PEISA Advisor")
+    run_chatbot()
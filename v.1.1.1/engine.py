@@ -0,0 +1,65 @@
+from typing import Callable, Dict, Any, Optional
+
+from flow import Node
+
+# Máximo de nodos de cálculo encadenados que se recorren en un solo paso
+MAX_STEPS = 64
+
+
+class StepError(RuntimeError):
+    """El flujo no puede avanzar (ciclo de cálculos, límite de pasos o nodo sin salida)"""
+
+
+def advance(node: Node, context: Dict[str, Any],
+            perform_calculation: Callable[[Node, Dict[str, Any]], None],
+            max_steps: int = MAX_STEPS) -> Node:
+    """Ejecuta la cadena de nodos de cálculo y devuelve el primer nodo que requiere al usuario"""
+    visited = set()
+    while node.tipo == 'calculo':
+        if node.id in visited:
+            raise StepError(f"Ciclo de cálculos en el nodo '{node.id}'")
+        if len(visited) >= max_steps:
+            raise StepError(f"Se superó el máximo de {max_steps} cálculos encadenados")
+        visited.add(node.id)
+
+        perform_calculation(node, context)
+        if node.siguiente is None:
+            raise StepError(f"El nodo de cálculo '{node.id}' no tiene siguiente")
+        node = node.siguiente
+    return node
+
+
+def peek(node: Node, max_steps: int = MAX_STEPS) -> Node:
+    """Nodo en el que se detendrá advance(), sin ejecutar ningún cálculo"""
+    steps = 0
+    while node.tipo == 'calculo' and node.siguiente is not None and steps < max_steps:
+        node = node.siguiente
+        steps += 1
+    return node
+
+
+def choose_option(node: Node, context: Dict[str, Any], option_index: Optional[int]) -> Optional[Node]:
+    """Registra la opción elegida y devuelve el nodo destino (None si el índice no es válido)"""
+    if option_index is None or not 0 <= option_index < len(node.options):
+        return None
+    selected = node.options[option_index]
+    # Guardar el valor usando el ID del nodo como clave
+    context[node.id] = selected.valor
+    # Guardar también el texto para mostrar
+    context[f"{node.id}_texto"] = selected.texto
+    return selected.siguiente
+
+
+def set_inputs(node: Node, context: Dict[str, Any], input_values: Dict[str, Any]) -> Node:
+    """Guarda los valores numéricos ingresados y devuelve el nodo siguiente.
+
+    Lanza ValueError si algún valor no es numérico; el contexto no se modifica.
+    """
+    if 'variable' in node:
+        values = {node['variable']: input_values.get('value', '')}
+    else:
+        values = {var: input_values.get(var, '') for var in node.get('variables', [])}
+
+    parsed = {var: float(str(value).replace(',', '.')) for var, value in values.items()}
+    context.update(parsed)
+    return node.siguiente
@@ -0,0 +1,136 @@
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import time
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Any, Optional, Tuple
+
+MODES = ('inline', 'thread', 'process')
+
+# Peso de la primera medición de una clave: incluye compilar plantillas y llenar cachés
+FIRST_WEIGHT = 0.5
+
+# True dentro de los procesos del pool (modo 'process')
+_in_pool_process = False
+
+
+class Overloaded(RuntimeError):
+    """Hay demasiados turnos en curso o esperando un worker del pool"""
+
+
+class TurnTimeout(TimeoutError):
+    """El turno superó el tiempo máximo"""
+
+
+def _mark_pool_process() -> None:
+    global _in_pool_process
+    _in_pool_process = True
+
+
+def in_pool_process() -> bool:
+    """True si el código corre en un proceso del pool de turnos"""
+    return _in_pool_process
+
+
+def _timed(fn: Callable[..., Any], *args: Any) -> Tuple[float, Any]:
+    """Resultado y tiempo de CPU del hilo: no cuenta el tiempo esperando el GIL o la CPU"""
+    start = time.thread_time()
+    result = fn(*args)
+    return time.thread_time() - start, result
+
+
+class TurnExecutor:
+    """Ejecuta fuera del event loop el trabajo de CPU de los turnos.
+
+    mode 'inline' lo ejecuta en el event loop (sin pool), 'thread' en un pool
+    de hilos y 'process' en un pool de procesos, que esquiva el GIL pero
+    requiere funciones y argumentos serializables con pickle.
+
+    max_pending limita los turnos en curso más los que esperan un worker: al
+    llegar al límite run() lanza Overloaded en lugar de encolar sin fin.
+    timeout es el máximo por turno; un hilo no se puede interrumpir, así que el
+    trabajo que vence sigue hasta terminar pero su resultado se descarta (la
+    función debe trabajar sobre una copia del estado).
+
+    Pasar al pool cuesta más que un turno corto: con el event loop ocupado, un
+    hilo espera el GIL hasta el intervalo de cambio (5 ms). Por eso una tarea
+    con clave (el nodo de cálculo) se ejecuta en el event loop mientras su
+    tiempo de CPU medio reciente sea menor que inline_below segundos, y pasa al pool
+    desde que se la ve lenta; las tareas sin clave van siempre al pool. La
+    primera ejecución de una clave corre en el event loop y cuenta con peso
+    FIRST_WEIGHT, así que un nodo lento pasa al pool desde la segunda.
+
+    Las tareas que corren en el event loop (y todas en modo 'inline') no tienen
+    timeout ni cuentan en max_pending: bloquean el loop hasta terminar, así
+    que no pueden acumularse.
+    """
+
+    def __init__(self, mode: str = 'thread', workers: Optional[int] = None,
+                 max_pending: Optional[int] = None, timeout: Optional[float] = None,
+                 inline_below: float = 0.0):
+        if mode not in MODES:
+            raise ValueError(f"Modo de ejecución desconocido '{mode}' (opciones: {', '.join(MODES)})")
+        self.mode = mode
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_pending = max_pending or max(64, self.workers * 16)
+        self.timeout = timeout
+        self.inline_below = inline_below
+        self.pending = 0
+        self._cost: Dict[str, float] = {}  # clave -> tiempo de CPU medio reciente en segundos
+        self._pool: Optional[Executor] = None
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            if self.mode == 'thread':
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='peisa-turn')
+            else:
+                # spawn: cada proceso importa la app y carga sus propios contenidos
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_mark_pool_process)
+        return self._pool
+
+    def expected(self, key: str) -> Optional[float]:
+        """Tiempo de CPU medio reciente de las tareas con esa clave, si ya se midieron"""
+        return self._cost.get(key)
+
+    def _observe(self, key: Optional[str], elapsed: float) -> None:
+        if key is None:
+            return
+        previous = self._cost.get(key)
+        self._cost[key] = FIRST_WEIGHT * elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+
+    async def run(self, fn: Callable[..., Any], *args: Any, key: Optional[str] = None) -> Any:
+        if self.mode == 'inline':
+            return fn(*args)
+        if key is not None and self._cost.get(key, 0.0) < self.inline_below:
+            elapsed, result = _timed(fn, *args)
+            self._observe(key, elapsed)
+            return result
+        if self.pending >= self.max_pending:
+            raise Overloaded(f"{self.pending} turnos en curso")
+
+        self.pending += 1
+        try:
+            call: Tuple[Any, ...] = (_timed, fn, *args)
+            if self.mode == 'thread':
+                # Los hilos conservan las variables de contexto del logging (conversation_id, node_id)
+                call = (contextvars.copy_context().run, *call)
+            future = asyncio.get_running_loop().run_in_executor(self._get_pool(), *call)
+            try:
+                elapsed, result = await asyncio.wait_for(future, self.timeout)
+                self._observe(key, elapsed)
+                return result
+            except asyncio.TimeoutError:
+                raise TurnTimeout(f"El turno superó {self.timeout} s") from None
+            except BrokenExecutor:
+                # Un proceso del pool murió: el próximo turno crea un pool nuevo
+                self.shutdown()
+                raise
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
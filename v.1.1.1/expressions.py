@@ -0,0 +1,162 @@
+import ast
+import marshal
+import types
+from functools import lru_cache
+from typing import Callable, Dict, Any, Tuple
+
+# Funciones que pueden invocarse desde las 'acciones' de un nodo de cálculo
+ALLOWED_CALLS = frozenset({
+    'ceil', 'filter_radiators', 'format_radiator_recommendations',
+    'radiator_mixes', 'format_radiator_mixes', 'partition_circuits',
+})
+
+# Construcciones permitidas dentro de una expresión
+_ALLOWED_NODES = (
+    ast.Expression, ast.Constant, ast.Name, ast.Load,
+    ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Subscript, ast.Call, ast.Tuple, ast.List,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.USub, ast.UAdd, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+)
+
+
+class ExpressionError(ValueError):
+    """Acción de cálculo inválida o no permitida"""
+
+
+class _UnwrapContext(ast.NodeTransformer):
+    """Convierte context['variable'] en una referencia directa a variable"""
+
+    def visit_Subscript(self, node):
+        self.generic_visit(node)
+        if (isinstance(node.value, ast.Name) and node.value.id == 'context'
+                and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)):
+            return ast.copy_location(ast.Name(id=node.slice.value, ctx=ast.Load()), node)
+        return node
+
+
+def _validate(tree: ast.AST, expr: str) -> None:
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ExpressionError(f"Construcción no permitida '{type(node).__name__}' en '{expr}'")
+        if isinstance(node, ast.Name) and node.id.startswith('__'):
+            raise ExpressionError(f"Nombre no permitido '{node.id}' en '{expr}'")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in ALLOWED_CALLS:
+                raise ExpressionError(f"Llamada no permitida en '{expr}'")
+            if node.keywords:
+                raise ExpressionError(f"Argumentos con nombre no permitidos en '{expr}'")
+
+
+# Una expresión compilada: función (contexto, funciones) -> valor
+Evaluator = Callable[[Dict[str, Any], Dict[str, Any]], Any]
+
+
+class _Localize(ast.NodeTransformer):
+    """Reescribe las variables como context['x'] y las llamadas como functions['f'](...)"""
+
+    def __init__(self):
+        self.variables = set()
+        self.calls = set()
+
+    def visit_Call(self, node):
+        self.calls.add(node.func.id)
+        node.args = [self.visit(arg) for arg in node.args]
+        node.func = self._item('functions', node.func.id, node.func)
+        return node
+
+    def visit_Name(self, node):
+        self.variables.add(node.id)
+        return self._item('context', node.id, node)
+
+    @staticmethod
+    def _item(mapping: str, key: str, node: ast.AST) -> ast.Subscript:
+        return ast.copy_location(
+            ast.Subscript(value=ast.Name(id=mapping, ctx=ast.Load()), slice=ast.Constant(key), ctx=ast.Load()),
+            node)
+
+
+def _build(tree: ast.Expression) -> Tuple[Evaluator, frozenset, frozenset]:
+    """Compila el árbol validado a una función (context, functions) -> valor.
+
+    Es una función normal: cada variable es un acceso directo al dict del
+    contexto, sin copiarlo ni pasar por los ámbitos dinámicos de eval().
+    """
+    localize = _Localize()
+    body = localize.visit(tree.body)
+    arguments = ast.arguments(
+        posonlyargs=[], args=[ast.arg(arg='context'), ast.arg(arg='functions')],
+        kwonlyargs=[], kw_defaults=[], defaults=[])
+    module = ast.Expression(body=ast.Lambda(args=arguments, body=body))
+    ast.fix_missing_locations(module)
+    # Sólo se ejecuta para construir la función; el árbol ya fue validado
+    evaluate = eval(compile(module, '<accion>', 'eval'), {'__builtins__': {}})
+    return evaluate, frozenset(localize.variables), frozenset(localize.calls)
+
+
+class CompiledAction:
+    """Acción 'variable = expresión' validada y compilada una sola vez"""
+    __slots__ = ('source', 'target', 'evaluate', 'variables', 'calls')
+
+    def __init__(self, source: str, target: str, evaluate: Evaluator,
+                 variables: frozenset = frozenset(), calls: frozenset = frozenset()):
+        self.source = source
+        self.target = target
+        self.evaluate = evaluate
+        self.variables = variables
+        self.calls = calls
+
+    def run(self, context: Dict[str, Any], functions: Dict[str, Any]) -> None:
+        """Evalúa la acción sobre el contexto y guarda el resultado"""
+        try:
+            context[self.target] = self.evaluate(context, functions)
+        except KeyError:
+            # Una variable o función ausente es un error de nombre, no de subíndice
+            for name in sorted(self.variables - context.keys()) + sorted(self.calls - functions.keys()):
+                raise NameError(f"name '{name}' is not defined") from None
+            raise
+
+    def __reduce__(self):
+        # El código compilado se guarda con marshal: sólo vale para la misma versión de Python
+        return (_restore_action, (self.source, self.target, marshal.dumps(self.evaluate.__code__),
+                                  self.variables, self.calls))
+
+    def __repr__(self) -> str:
+        return f"CompiledAction({self.source!r})"
+
+
+def _restore_action(source: str, target: str, code: bytes, variables: frozenset, calls: frozenset) -> CompiledAction:
+    evaluate = types.FunctionType(marshal.loads(code), {'__builtins__': {}})
+    return CompiledAction(source, target, evaluate, variables, calls)
+
+
+def parse_action(expr: str) -> Tuple[str, ast.Expression]:
+    """Analiza y valida una acción; devuelve la variable destino y el árbol de la expresión"""
+    try:
+        module = ast.parse(expr.strip(), mode='exec')
+    except SyntaxError as e:
+        raise ExpressionError(f"Sintaxis inválida en '{expr}': {e.msg}") from None
+
+    if (len(module.body) != 1 or not isinstance(module.body[0], ast.Assign)
+            or len(module.body[0].targets) != 1
+            or not isinstance(module.body[0].targets[0], ast.Name)):
+        raise ExpressionError(f"La acción debe tener la forma 'variable = expresión': '{expr}'")
+
+    assign = module.body[0]
+    tree = ast.Expression(body=_UnwrapContext().visit(assign.value))
+    ast.fix_missing_locations(tree)
+    _validate(tree, expr)
+    return assign.targets[0].id, tree
+
+
+@lru_cache(maxsize=None)
+def compile_action(expr: str) -> CompiledAction:
+    """Analiza, valida y compila una acción de un nodo de cálculo"""
+    target, tree = parse_action(expr)
+    return CompiledAction(expr, target, *_build(tree))
+
+
+def make_namespace(functions: Dict[str, Any]) -> Dict[str, Any]:
+    """Funciones que pueden invocar las acciones: sólo las permitidas"""
+    return {k: v for k, v in functions.items() if k in ALLOWED_CALLS}
@@ -0,0 +1,137 @@
+"""Cliente Redis falso en memoria para probar RedisStore sin servidor.
+
+    python fake_redis.py   # ejercita get/set/compare_and_set/TTL de RedisStore
+
+Implementa sólo la parte de la interfaz de redis-py que usa RedisStore. eval()
+no interpreta Lua: cada script conocido tiene su equivalente en Python, escrito
+paso a paso igual que el script.
+"""
+import fnmatch
+import time
+from typing import Callable, Dict, Any, Iterator, Optional, Tuple, Union
+
+from store import RedisStore
+
+
+def _bytes(value: Union[str, bytes, int, float]) -> bytes:
+    # redis-py envía los argumentos como bytes y devuelve bytes
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+class FakeRedis:
+    """Claves con vencimiento en milisegundos; el reloj se puede reemplazar para probar el TTL"""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}  # clave -> (valor, vence)
+        self._scripts = {RedisStore.CAS_SCRIPT: self._cas_script}
+
+    def _live(self, key: bytes) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= self.clock():
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def _expires(self, px: Optional[int]) -> Optional[float]:
+        return None if px is None else self.clock() + int(px) / 1000
+
+    def get(self, name) -> Optional[bytes]:
+        return self._live(_bytes(name))
+
+    def getex(self, name, px: Optional[int] = None) -> Optional[bytes]:
+        key = _bytes(name)
+        value = self._live(key)
+        if value is not None and px is not None:
+            self._data[key] = (value, self._expires(px))
+        return value
+
+    def set(self, name, value, px: Optional[int] = None) -> bool:
+        self._data[_bytes(name)] = (_bytes(value), self._expires(px))
+        return True
+
+    def delete(self, *names) -> int:
+        return sum(self._data.pop(_bytes(name), None) is not None for name in names)
+
+    def pttl(self, name) -> int:
+        key = _bytes(name)
+        if self._live(key) is None:
+            return -2
+        expires = self._data[key][1]
+        return -1 if expires is None else int((expires - self.clock()) * 1000)
+
+    def scan_iter(self, match: Optional[str] = None) -> Iterator[bytes]:
+        for key in list(self._data):
+            if self._live(key) is not None and (match is None or fnmatch.fnmatchcase(key.decode('utf-8'), match)):
+                yield key
+
+    def eval(self, script: str, numkeys: int, *keys_and_args) -> Any:
+        handler = self._scripts.get(script)
+        if handler is None:
+            raise NotImplementedError("Script Lua sin equivalente en FakeRedis")
+        args = [_bytes(arg) for arg in keys_and_args]
+        return handler(args[:numkeys], args[numkeys:])
+
+    def _cas_script(self, keys, argv) -> int:
+        # Equivalente de RedisStore.CAS_SCRIPT
+        value = self._live(keys[0])
+        if value is None:
+            return 0
+        turn, sep, _ = value.partition(b':')
+        stored = turn if sep and turn.isdigit() else b'0'
+        if stored != argv[0]:
+            return 0
+        self.set(keys[0], argv[1], px=int(argv[2]))
+        return 1
+
+
+def check() -> None:
+    """Ejercita RedisStore sobre FakeRedis con un reloj manual"""
+    now = [0.0]
+    client = FakeRedis(clock=lambda: now[0])
+    store = RedisStore(client, ttl=10)
+
+    assert store.get('a') is None
+    conv = {'current_node': 'inicio', 'context': {'largo': 4.5}, 'version': 'abc', 'turn': 1}
+    store.set('a', conv)
+    assert store.get('a') == conv
+    assert client.get('peisa:conv:a').startswith(b'1:')
+
+    # compare_and_set: sólo con el turno guardado, y nunca crea la conversación
+    assert not store.compare_and_set('a', dict(conv, turn=3), expected_turn=2)
+    assert store.compare_and_set('a', dict(conv, turn=2), expected_turn=1)
+    assert store.get('a')['turn'] == 2
+    assert not store.compare_and_set('a', dict(conv, turn=3), expected_turn=1)
+    assert not store.compare_and_set('b', dict(conv, turn=1), expected_turn=0)
+    assert store.get('b') is None
+
+    # Valores guardados antes del contador de turnos: turno 0
+    client.set('peisa:conv:c', b'{"current_node":"inicio","context":{}}', px=10000)
+    assert store.get('c') == {'current_node': 'inicio', 'context': {}}
+    assert store.compare_and_set('c', dict(conv, turn=1), expected_turn=0)
+
+    # TTL: get() lo renueva; sin accesos la conversación vence
+    assert len(store) == 2
+    now[0] = 9
+    assert store.get('a') is not None
+    assert client.pttl('peisa:conv:a') == 10000
+    now[0] = 15
+    assert store.get('a') is not None and store.get('c') is None
+    assert len(store) == 1
+    now[0] = 30
+    assert store.get('a') is None
+    assert not store.compare_and_set('a', dict(conv, turn=3), expected_turn=2)
+    assert len(store) == 0
+
+    store.set('d', conv)
+    store.delete('d')
+    assert store.get('d') is None
+
+
+if __name__ == "__main__":
+    check()
+    print("RedisStore: get/set/compare_and_set/TTL correctos")
@@ -0,0 +1,100 @@
+from typing import Optional, Dict, Any, List
+from expressions import ExpressionError, compile_action
+
+# Tipos de nodo que siempre continúan en su 'siguiente'
+REQUIRES_NEXT = frozenset({'entrada_usuario', 'calculo'})
+
+
+class FlowError(ValueError):
+    """Error de estructura en la base de conocimiento"""
+
+
+class Option:
+    """Opción de un nodo con su destino ya resuelto"""
+    __slots__ = ('texto', 'valor', 'siguiente', 'data')
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self.texto = data['texto']
+        self.valor = data.get('valor', data['texto'])
+        self.siguiente = None  # Se resuelve al compilar el grafo
+
+
+class Node:
+    """Nodo compilado: conserva el dict original y las aristas resueltas"""
+    __slots__ = ('id', 'tipo', 'data', 'siguiente', 'options', 'option_texts', 'actions')
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self.id = data['id']
+        self.tipo = data.get('tipo')
+        self.siguiente = None  # Se resuelve al compilar el grafo
+        self.options = [Option(opt) for opt in data.get('opciones', [])]
+        self.option_texts = [opt.texto for opt in self.options]
+        self.actions = []  # Acciones compiladas de los nodos de cálculo
+
+    # Acceso tipo dict para el código que trabaja con el nodo original
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    def __repr__(self) -> str:
+        return f"Node({self.id!r})"
+
+
+class FlowGraph:
+    """Base de conocimiento indexada por ID y validada al construirse"""
+
+    def __init__(self, knowledge_base: List[Dict[str, Any]]):
+        self.nodes: Dict[str, Node] = {}
+        errors = []
+
+        for i, data in enumerate(knowledge_base):
+            if 'id' not in data:
+                errors.append(f"nodo #{i} sin 'id'")
+                continue
+            if data['id'] in self.nodes:
+                errors.append(f"ID duplicado '{data['id']}'")
+                continue
+            try:
+                self.nodes[data['id']] = Node(data)
+            except KeyError as e:
+                errors.append(f"nodo '{data['id']}': opción sin {e}")
+                continue
+
+            # Compilar y validar las acciones una sola vez
+            for expr in data.get('acciones', []):
+                try:
+                    self.nodes[data['id']].actions.append(compile_action(expr))
+                except ExpressionError as e:
+                    errors.append(f"nodo '{data['id']}': {e}")
+
+        # Resolver las aristas 'siguiente' a objetos nodo
+        for node in self.nodes.values():
+            target = node.get('siguiente')
+            if target is not None:
+                node.siguiente = self.nodes.get(target)
+                if node.siguiente is None:
+                    errors.append(f"nodo '{node.id}': siguiente '{target}' no existe")
+            elif node.tipo in REQUIRES_NEXT:
+                errors.append(f"nodo '{node.id}' de tipo '{node.tipo}' sin 'siguiente'")
+            for opt in node.options:
+                target = opt.data.get('siguiente')
+                opt.siguiente = self.nodes.get(target)
+                if opt.siguiente is None:
+                    errors.append(f"nodo '{node.id}': opción '{opt.texto}' apunta a '{target}' que no existe")
+
+        if errors:
+            raise FlowError("Base de conocimiento inválida:\n- " + "\n- ".join(errors))
+
+    def get(self, node_id: str) -> Optional[Node]:
+        """Busca un nodo por su ID"""
+        return self.nodes.get(node_id)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional
+
+from catalog import RadiatorCatalog
+from flow import FlowGraph
+from logs import get_logger
+from snapshot import SnapshotCodec
+from state import StateLayout
+
+logger = get_logger("knowledge")
+
+
+def _read(path: str) -> bytes:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        logger.warning("No se encontró el archivo %s", path)
+        return b""
+
+
+def content_version(kb_data: bytes, catalog_data: bytes) -> str:
+    """Versión de los contenidos: hash de ambos archivos"""
+    return hashlib.sha256(kb_data + b"\0" + catalog_data).hexdigest()[:12]
+
+
+class KnowledgeBase:
+    """Una versión compilada de la base de conocimiento y del catálogo de radiadores.
+
+    La versión es un hash del contenido de ambos archivos, así que es la misma
+    en todos los workers que cargan los mismos datos.
+    """
+
+    def __init__(self, nodes: List[Dict[str, Any]], models: Dict[str, Dict[str, Any]], version: str):
+        self.version = version
+        self.nodes = nodes
+        self.models = models
+        self.flow = FlowGraph(nodes)
+        self.catalog = RadiatorCatalog(models)
+        self.namespace: Dict[str, Any] = {}  # Funciones de las acciones, ligadas a este catálogo
+        self.codec = SnapshotCodec(self)  # Formato binario del estado de las conversaciones
+        self.layout = StateLayout(self)  # Estado compacto de las conversaciones en memoria
+        self.static: Dict[str, Any] = {}  # Respuestas pre-renderizadas de los nodos estáticos
+        self.bundle: Optional[Dict[str, bytes]] = None  # Paquete del flujo para el navegador, por codificación
+
+    @classmethod
+    def from_files(cls, kb_path: str, catalog_path: str) -> "KnowledgeBase":
+        kb_data, catalog_data = _read(kb_path), _read(catalog_path)
+        version = content_version(kb_data, catalog_data)
+        nodes = json.loads(kb_data) if kb_data else []
+        models = json.loads(catalog_data) if catalog_data else {}
+        return cls(nodes, models, version)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Las funciones de las acciones son de la app: se vuelven a ligar al cargar
+        return {**self.__dict__, 'namespace': {}}
+
+
+class ContentRegistry:
+    """Versión vigente de los contenidos y las anteriores que aún usan conversaciones en curso.
+
+    reload() compila y valida la nueva versión fuera del lock y sólo después
+    la publica con un intercambio atómico; si falla, la vigente no cambia.
+    """
+
+    def __init__(self, load: Callable[[], KnowledgeBase], keep: int = 5):
+        self._load = load
+        self._keep = keep
+        self._lock = threading.Lock()
+        self._versions: "OrderedDict[str, KnowledgeBase]" = OrderedDict()
+        self.current = load()
+        self._versions[self.current.version] = self.current
+
+    def get(self, version: Optional[str]) -> KnowledgeBase:
+        """La versión con la que empezó una conversación, o la vigente si ya no está cargada"""
+        if version is None:
+            return self.current
+        return self._versions.get(version, self.current)
+
+    def find(self, version: str) -> Optional[KnowledgeBase]:
+        """La versión indicada, o None si ya no está cargada"""
+        return self._versions.get(version)
+
+    def versions(self) -> List[str]:
+        return list(self._versions)
+
+    def reload(self) -> bool:
+        """Carga los archivos de nuevo; devuelve True si cambió la versión vigente"""
+        new = self._load()
+        with self._lock:
+            if new.version == self.current.version:
+                return False
+            self._versions[new.version] = new
+            self._versions.move_to_end(new.version)
+            while len(self._versions) > self._keep:
+                self._versions.popitem(last=False)
+            self.current = new
+        logger.info("Contenidos actualizados a la versión %s", new.version)
+        return True
+
+    def watch(self, paths: List[str], interval: float = 2.0) -> None:
+        """Recarga en segundo plano cuando cambia alguno de los archivos"""
+        def mtimes():
+            return [os.path.getmtime(path) if os.path.exists(path) else None for path in paths]
+
+        def run():
+            last = mtimes()
+            stop = threading.Event()
+            while not stop.wait(interval):
+                now = mtimes()
+                if now == last:
+                    continue
+                last = now
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error("No se pudo recargar los contenidos: %s", e)
+
+        threading.Thread(target=run, daemon=True, name="content-watcher").start()
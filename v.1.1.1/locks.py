@@ -0,0 +1,31 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+
+class KeyedLock:
+    """Un asyncio.Lock por clave, que se descarta cuando nadie lo usa.
+
+    Serializa las peticiones de una misma conversación dentro del worker;
+    entre workers la protección es el contador de turnos del almacén.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, List] = {}  # clave -> [lock, usuarios]
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
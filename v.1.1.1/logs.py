@@ -0,0 +1,89 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from typing import Optional, Dict, Any
+
+# Correlación por petición: cada petición de asyncio tiene su propio contexto
+conversation_id_var: ContextVar[Optional[str]] = ContextVar('conversation_id', default=None)
+node_id_var: ContextVar[Optional[str]] = ContextVar('node_id', default=None)
+
+# Atributos propios de LogRecord que no se repiten como campos extra
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'conversation_id', 'node_id'}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class CorrelationFilter(logging.Filter):
+    """Agrega conversation_id y node_id de la petición en curso a cada registro"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.conversation_id = conversation_id_var.get()
+        record.node_id = node_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key in ('conversation_id', 'node_id'):
+            if getattr(record, key, None) is not None:
+                entry[key] = getattr(record, key)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = 'INFO', json_format: bool = True, stream=None) -> None:
+    """Configura el logger 'peisa' para escribir a stdout (o a stream) desde un hilo aparte.
+
+    Los handlers sólo encolan el registro (QueueHandler); la escritura la
+    hace un QueueListener, así el event loop nunca se bloquea en stdout.
+    Sólo la primera llamada elige el destino; las siguientes cambian el nivel.
+    """
+    global _listener
+    logger = logging.getLogger('peisa')
+    if _listener is not None:
+        logger.setLevel(level.upper())
+        return
+
+    output = logging.StreamHandler(sys.stdout if stream is None else stream)
+    output.setFormatter(JsonFormatter() if json_format else logging.Formatter(
+        '%(asctime)s %(levelname)s %(name)s [%(conversation_id)s %(node_id)s] %(message)s'))
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(CorrelationFilter())
+
+    logger.handlers[:] = [handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f'peisa.{name}')
+
+
+def log_context(logger: logging.Logger, context: Dict[str, Any], sample_rate: float) -> None:
+    """Vuelca el contexto completo en DEBUG, sólo para una muestra de las peticiones"""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < sample_rate:
+        logger.debug("contexto de la conversación", extra={'context': dict(context)})
@@ -0,0 +1,215 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, List, Tuple, Sequence
+
+# Límites de los buckets en segundos, de 50 µs a 2.5 s
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    """Métrica con etiquetas; cada combinación de valores tiene su propio hijo.
+
+    Los incrementos no toman locks: bajo el GIL una carrera entre hilos puede,
+    como mucho, perder alguna muestra, lo que es aceptable para métricas.
+    """
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for values, child in list(self._children.items()):
+            lines.extend(self._samples(values, child))
+        return lines
+
+    def _samples(self, values, child) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def _samples(self, values, child):
+        return [f'{self.name}_total{_format_labels(self.labelnames, values)} {child.value}']
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _samples(self, values, child):
+        lines = []
+        cumulative = 0
+        counts = list(child.counts)
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            bucket_labels = _format_labels(self.labelnames, values, 'le="%s"' % le)
+            lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {child.sum}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge cuyo valor se calcula al leer /metrics.
+
+    Con max_age el valor se reutiliza durante max_age segundos, para callbacks
+    caros (contar las conversaciones de un backend compartido).
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float], max_age: float = 0):
+        self.callback = callback
+        self.max_age = max_age
+        self._value = None
+        self._expires = 0.0
+        super().__init__(name, documentation)
+
+    def _new_child(self):
+        return None
+
+    def value(self) -> float:
+        if not self.max_age:
+            return self.callback()
+        now = time.monotonic()
+        if self._value is None or now >= self._expires:
+            self._value, self._expires = self.callback(), now + self.max_age
+        return self._value
+
+    def _samples(self, values, child):
+        return [f'{self.name} {self.value()}']
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self) -> str:
+        """Formato de texto de Prometheus (versión 0.0.4)"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Métricas del proceso; con varios workers cada uno expone las suyas
+registry = Registry()
+
+requests_total = registry.register(Counter(
+    'peisa_http_requests', 'Peticiones atendidas por endpoint y resultado', ('path', 'outcome')))
+request_seconds = registry.register(Histogram(
+    'peisa_http_request_duration_seconds', 'Latencia de los endpoints de conversación', ('path',)))
+node_seconds = registry.register(Histogram(
+    'peisa_node_duration_seconds', 'Tiempo de procesamiento por tipo de nodo', ('tipo',)))
+action_seconds = registry.register(Histogram(
+    'peisa_action_duration_seconds', 'Tiempo de evaluación de cada acción de cálculo', ('node_id', 'variable')))
+template_seconds = registry.register(Histogram(
+    'peisa_template_render_duration_seconds', 'Tiempo de renderizado de plantillas'))
+turns_rejected = registry.register(Counter(
+    'peisa_turns_rejected', 'Turnos rechazados por el pool de turnos, por motivo (saturado, tiempo)', ('reason',)))
+
+
+@contextmanager
+def track_request(path: str):
+    """Cuenta y mide una petición, distinguiendo las que terminan en error"""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        request_seconds.labels(path).observe(time.perf_counter() - start)
+        requests_total.labels(path, outcome).inc()
+
+
+def instrument(path: str):
+    """Decorador para endpoints async: equivale a envolver el cuerpo en track_request"""
+    def decorator(endpoint):
+        @wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            with track_request(path):
+                return await endpoint(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,107 @@
+"""Contenidos precompilados para que los workers arranquen sin compilar los JSON.
+
+    python precompiled.py [salida]   # por defecto peisa_knowledge.snapshot
+
+Guarda con pickle la versión vigente ya compilada: grafo del flujo, acciones
+(su código con marshal), índices del catálogo, respuestas pre-renderizadas y
+paquete del navegador. Al cargar se comprueban la cabecera, el SHA-256 del
+cuerpo, la versión de los JSON y la huella del código que los compila; si algo
+no coincide load() devuelve None y la app compila los JSON como siempre.
+
+El archivo se carga con pickle: debe generarse en el despliegue, igual que el código.
+"""
+import hashlib
+import importlib.util
+import os
+import pickle
+import struct
+from typing import Optional
+
+from knowledge import KnowledgeBase, content_version
+from logs import get_logger
+
+logger = get_logger("precompiled")
+
+# Formato del archivo:
+#   'PKB' | formato (1 byte) | magic de Python (4 bytes) | versión de contenidos (6 bytes)
+#   | huella del código (8 bytes) | SHA-256 del cuerpo (32 bytes) | cuerpo (pickle)
+MAGIC = b'PKB'
+FORMAT = 1
+_HEADER = struct.Struct('<3sB4s6s8s32s')
+
+DEFAULT_PATH = "peisa_knowledge.snapshot"
+
+# Módulos cuyo código determina el resultado de compilar los contenidos: los que
+# usa app.compile_knowledge() directa o indirectamente (render arma las
+# respuestas pre-renderizadas). Al agregar una importación a esos módulos, sumarla.
+CODE_MODULES = ('app', 'knowledge', 'flow', 'expressions', 'catalog', 'radiator_mix',
+                'snapshot', 'state', 'prerender', 'render', 'bundle', 'responses', 'precompiled')
+
+
+def code_fingerprint() -> bytes:
+    """Hash del código de CODE_MODULES: un cambio en cualquiera invalida el archivo"""
+    digest = hashlib.sha256()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_MODULES:
+        with open(os.path.join(base, name + '.py'), 'rb') as f:
+            digest.update(f.read())
+        digest.update(b'\0')
+    return digest.digest()[:8]
+
+
+def dump(kb: KnowledgeBase) -> bytes:
+    body = pickle.dumps(kb, protocol=pickle.HIGHEST_PROTOCOL)
+    header = _HEADER.pack(MAGIC, FORMAT, importlib.util.MAGIC_NUMBER, bytes.fromhex(kb.version),
+                          code_fingerprint(), hashlib.sha256(body).digest())
+    return header + body
+
+
+def load(path: str, kb_path: str, catalog_path: str) -> Optional[KnowledgeBase]:
+    """Contenidos del archivo, o None si falta o no corresponde a los JSON y al código actuales"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(kb_path, 'rb') as f:
+            kb_data = f.read()
+        with open(catalog_path, 'rb') as f:
+            catalog_data = f.read()
+    except FileNotFoundError:
+        return None
+
+    if len(data) < _HEADER.size:
+        logger.warning("Contenidos precompilados %s incompletos; se compilan los JSON", path)
+        return None
+    magic, fmt, python, version, fingerprint, checksum = _HEADER.unpack_from(data)
+    body = memoryview(data)[_HEADER.size:]
+    if magic != MAGIC or fmt != FORMAT or python != importlib.util.MAGIC_NUMBER:
+        reason = "formato o versión de Python distintos"
+    elif hashlib.sha256(body).digest() != checksum:
+        reason = "checksum inválido"
+    elif version.hex() != content_version(kb_data, catalog_data):
+        reason = "los JSON cambiaron"
+    elif fingerprint != code_fingerprint():
+        reason = "el código cambió"
+    else:
+        kb = pickle.loads(body)
+        logger.info("Contenidos %s cargados de %s", kb.version, path)
+        return kb
+    logger.warning("Contenidos precompilados %s descartados (%s); se compilan los JSON", path, reason)
+    return None
+
+
+if __name__ == "__main__":
+    import sys
+
+    output = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else None
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    import app
+
+    kb = app.compile_knowledge()
+    data = dump(kb)
+    output = output or os.path.abspath(app.KNOWLEDGE_SNAPSHOT_PATH)
+    # Se escribe aparte y se reemplaza: un worker que arranca nunca lee un archivo a medias
+    with open(output + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(output + '.tmp', output)
+    print(f"versión {kb.version}: {len(data)} bytes en {output}")
@@ -0,0 +1,140 @@
+"""Respuestas pre-renderizadas de los nodos estáticos del flujo.
+
+    python prerender.py   # informe de nodos estáticos y dinámicos de la versión vigente
+
+Un nodo es estático si su texto no usa variables: la respuesta es la misma
+para todos los usuarios salvo el conversation_id, así que se serializa una
+sola vez al cargar los contenidos y se envía como bytes, sin construir el
+modelo de Pydantic ni renderizar la plantilla.
+"""
+from collections import deque
+from typing import Callable, Dict, Any, List, Optional
+
+from fastapi.responses import Response
+
+from render import environment
+from responses import dumps
+
+
+class StaticMessage:
+    """Respuesta serializada de un nodo estático, sin el conversation_id"""
+    __slots__ = ('node_id', 'payload', 'text', 'is_final', '_suffix')
+
+    def __init__(self, node_id: str, payload: Dict[str, Any]):
+        self.node_id = node_id
+        self.payload = payload
+        self.text = payload.get('text')
+        self.is_final = payload.get('is_final')
+        # '{"conversation_id":' + id + este sufijo
+        self._suffix = b',' + dumps(payload)[1:]
+
+    def body(self, conversation_id: str) -> bytes:
+        return b'{"conversation_id":' + dumps(conversation_id) + self._suffix
+
+
+class PrerenderedMessage:
+    """Respuesta de un nodo estático para una conversación concreta.
+
+    Expone lo mismo que Message (node_id, text, is_final, model_dump y
+    to_response()), así que los handlers los tratan igual.
+    """
+    __slots__ = ('conversation_id', 'static')
+
+    def __init__(self, conversation_id: str, static: StaticMessage):
+        self.conversation_id = conversation_id
+        self.static = static
+
+    @property
+    def node_id(self) -> str:
+        return self.static.node_id
+
+    @property
+    def text(self) -> Optional[str]:
+        return self.static.text
+
+    @property
+    def is_final(self) -> Optional[bool]:
+        return self.static.is_final
+
+    def model_dump(self, exclude_none: bool = False) -> Dict[str, Any]:
+        data = {'conversation_id': self.conversation_id, **self.static.payload}
+        if exclude_none:
+            return {k: v for k, v in data.items() if v is not None}
+        return data
+
+    def to_response(self) -> Response:
+        return Response(content=self.static.body(self.conversation_id), media_type="application/json")
+
+
+def template_variables(text: str) -> set:
+    """Variables que usa una plantilla de la base de conocimiento"""
+    from jinja2 import meta
+    return meta.find_undeclared_variables(environment().parse(text))
+
+
+def reachable(flow, start: str = "inicio") -> List[str]:
+    """Nodos alcanzables desde el inicio, en orden de recorrido"""
+    seen, order = set(), []
+    queue = deque([flow.get(start)])
+    while queue:
+        node = queue.popleft()
+        if node is None or node.id in seen:
+            continue
+        seen.add(node.id)
+        order.append(node.id)
+        queue.append(node.siguiente)
+        queue.extend(opt.siguiente for opt in node.options)
+    return order
+
+
+def classify(node) -> str:
+    """'estatico', 'dinamico' o 'calculo'"""
+    if node.tipo == 'calculo':
+        return 'calculo'
+    if 'pregunta' in node:
+        text = node['pregunta']
+    elif node.tipo == 'respuesta':
+        text = node['texto']
+    else:
+        return 'dinamico'  # opciones_dinamicas y tipos desconocidos
+    if not isinstance(text, str):
+        return 'estatico'
+    return 'dinamico' if template_variables(text) else 'estatico'
+
+
+def prerender(flow, payload: Callable[[Any], Dict[str, Any]], start: str = "inicio") -> Dict[str, StaticMessage]:
+    """Serializa la respuesta de cada nodo estático alcanzable.
+
+    payload(node) devuelve la respuesta completa del nodo (sin conversation_id),
+    con los mismos campos y en el mismo orden que ConversationResponse.
+    """
+    return {
+        node_id: StaticMessage(node_id, payload(flow.get(node_id)))
+        for node_id in reachable(flow, start)
+        if classify(flow.get(node_id)) == 'estatico'
+    }
+
+
+def report(flow, start: str = "inicio") -> Dict[str, List[str]]:
+    """Nodos alcanzables agrupados por tipo de respuesta, más los no alcanzables"""
+    groups: Dict[str, List[str]] = {'estatico': [], 'dinamico': [], 'calculo': []}
+    ids = reachable(flow, start)
+    for node_id in ids:
+        groups[classify(flow.get(node_id))].append(node_id)
+    seen = set(ids)
+    groups['inalcanzable'] = [node_id for node_id in flow.nodes if node_id not in seen]
+    return groups
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    import app
+
+    kb = app.contents.current
+    for group, ids in report(kb.flow).items():
+        print(f"{group} ({len(ids)}): {', '.join(ids) or '-'}")
+    print(f"pre-renderizados: {len(kb.static)} nodos, {sum(len(m.body('')) for m in kb.static.values())} bytes")
@@ -0,0 +1,118 @@
+"""Combinaciones de radiadores (modelo x cantidad de módulos) para una carga térmica.
+
+Una combinación son hasta MAX_UNITS equipos, cada uno de un modelo con
+MIN_MODULES a MAX_MODULES módulos, que en total cubren la carga y caben en el largo de
+pared disponible. Se devuelven las combinaciones Pareto-óptimas en exceso de
+potencia, cantidad de equipos y módulos (largo de pared): ninguna otra es
+mejor o igual en los tres a la vez.
+
+Búsqueda exacta sobre la potencia real: para cada cantidad de equipos y de
+módulos se guarda la combinación de menor potencia que cubre la carga. Los
+equipos se eligen en orden (modelo, módulos) para no repetir combinaciones, y
+de cada modelo sólo se prueba el mínimo de módulos que completa la carga: con
+más módulos la combinación queda dominada. Las combinaciones que todavía no
+cubren la carga se extienden con otro equipo. static/flow.js implementa el
+mismo cálculo para el chat.
+"""
+import math
+from typing import Dict, Any, List, Sequence, Tuple
+
+MAX_UNITS = 3
+MIN_MODULES = 3  # módulos por equipo
+MAX_MODULES = 15
+MODULE_WIDTH_CM = 8
+TOLERANCE = 1e-6  # kcal/h
+
+# (equipos, módulos, ((candidato, módulos, cantidad), ...))
+Mix = Tuple[int, int, Tuple[Tuple[int, int, int], ...]]
+
+
+def wall_modules(wall_length: float, max_units: int = MAX_UNITS, max_modules: int = MAX_MODULES) -> int:
+    """Módulos que entran en wall_length metros; sin límite práctico si sobra pared"""
+    limit = max_units * max_modules
+    modules = wall_length * 100 / MODULE_WIDTH_CM
+    return limit if not modules < limit else math.floor(modules)
+
+
+def _modules_for(total: float, power: float, heat_load: float, start: int) -> int:
+    """Mínimo de módulos (desde start) de potencia power que llevan total a cubrir la carga"""
+    k = max(start, math.ceil((heat_load - total) / power))
+    # El cociente puede errar en uno por redondeo: se confirma con la misma suma que se guarda
+    while k > start and total + (k - 1) * power >= heat_load:
+        k -= 1
+    while total + k * power < heat_load:
+        k += 1
+    return k
+
+
+def pareto_mixes(effective: Sequence[float], heat_load: float, wall: int,
+                 max_units: int = MAX_UNITS, max_modules: int = MAX_MODULES) -> List[Mix]:
+    """Frente de Pareto de las combinaciones que cubren heat_load con a lo sumo wall módulos.
+
+    effective es la potencia por módulo de cada candidato. El resultado va
+    ordenado por cantidad de equipos y, para cada una, de menor a mayor exceso.
+    """
+    # Dos candidatos de igual potencia dan las mismas combinaciones: basta el primero
+    candidates = [c for c, power in enumerate(effective) if power > 0 and power not in effective[:c]]
+    if not candidates or max_units * max_modules * max(effective) < heat_load:
+        return []
+    # Lo más que aporta un equipo de los candidatos desde cada posición en adelante
+    reach = [max(effective[c] for c in candidates[i:]) * max_modules for i in range(len(candidates))]
+
+    best: Dict[Tuple[int, int], Tuple[float, Tuple[Tuple[int, int], ...]]] = {}  # (equipos, módulos) -> (potencia, equipos)
+    partial = [(0.0, 0, 0, ())]  # (potencia, módulos, primer candidato posible, equipos) sin cubrir la carga
+    for units in range(1, max_units + 1):
+        left = max_units - units
+        grown = []
+        for total, modules, first, picks in partial:
+            for i in range(first, len(candidates)):
+                c = candidates[i]
+                power = effective[c]
+                start = picks[-1][1] if i == first and picks else MIN_MODULES
+                k = _modules_for(total, power, heat_load, start)
+                if k <= max_modules and modules + k <= wall:
+                    reached = total + k * power
+                    cell = best.get((units, modules + k))
+                    if cell is None or reached < cell[0]:
+                        best[(units, modules + k)] = (reached, picks + ((c, k),))
+                if left:
+                    # Con menos módulos no alcanza: se sigue con otro equipo si todavía puede alcanzar
+                    for j in range(start, min(k, max_modules + 1, wall - modules - MIN_MODULES + 1)):
+                        reached = total + j * power
+                        if reached + left * reach[i] >= heat_load:
+                            grown.append((reached, modules + j, i, picks + ((c, j),)))
+        partial = grown
+
+    front: List[Tuple[float, Mix]] = []
+    for (units, modules), (total, picks) in best.items():
+        # Sumas iguales en otro orden pueden diferir en el último decimal: se comparan con tolerancia
+        if any(other != (units, modules) and other[0] <= units and other[1] <= modules and cell[0] <= total + TOLERANCE
+               for other, cell in best.items()):
+            continue
+        counts: Dict[Tuple[int, int], int] = {}
+        for pick in picks:
+            counts[pick] = counts.get(pick, 0) + 1
+        equipment = tuple(sorted(((c, k, n) for (c, k), n in counts.items()), key=lambda e: (e[0], -e[1])))
+        front.append((total, (units, modules, equipment)))
+    return [mix for _, mix in sorted(front, key=lambda item: (item[1][0], item[0], item[1][1]))]
+
+
+def power(equipment: Sequence[Tuple[int, int, int]], effective: Sequence[float]) -> float:
+    """Potencia real de una combinación, en kcal/h"""
+    total = 0.0
+    for c, k, n in equipment:
+        total += n * k * effective[c]
+    return total
+
+
+def describe(mix: Mix, names: Sequence[str], effective: Sequence[float], heat_load: float) -> Dict[str, Any]:
+    """Combinación como la guarda el contexto de la conversación"""
+    _, modules, equipment = mix
+    total = power(equipment, effective)
+    return {
+        'equipos': [{'name': names[c], 'modulos': k, 'cantidad': n} for c, k, n in equipment],
+        'potencia': total,
+        'exceso': total - heat_load,
+        'modulos': modules,
+        'largo_cm': modules * MODULE_WIDTH_CM,
+    }
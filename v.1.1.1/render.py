@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import TYPE_CHECKING, Optional, Dict, Any, Tuple
+
+if TYPE_CHECKING:
+    from jinja2 import Environment, Template
+
+_environment: "Optional[Environment]" = None
+
+
+def environment() -> "Environment":
+    """Entorno compartido por todas las plantillas de la base de conocimiento.
+
+    jinja2 se importa con la primera plantilla: con los contenidos
+    precompilados (precompiled.py) el arranque no lo necesita.
+    """
+    global _environment
+    if _environment is None:
+        from jinja2 import Environment
+        _environment = Environment(autoescape=False)
+    return _environment
+
+
+class TemplateCache:
+    """Plantillas Jinja2 compiladas, indexadas por nodo y hash del texto, con desalojo LRU"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._templates: "OrderedDict[Tuple[Optional[str], int], Tuple[str, Template]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str, node_id: Optional[str] = None) -> "Template":
+        """Devuelve la plantilla compilada para el texto, compilándola si hace falta"""
+        key = (node_id, hash(text))
+        with self._lock:
+            entry = self._templates.get(key)
+            if entry is not None and entry[0] == text:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        template = environment().from_string(text)
+
+        with self._lock:
+            self.misses += 1
+            self._templates[key] = (text, template)
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        return template
+
+    def render(self, text: str, context: Dict[str, Any], node_id: Optional[str] = None) -> str:
+        return self.get(text, node_id).render(context)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+
+    def __len__(self) -> int:
+        return len(self._templates)
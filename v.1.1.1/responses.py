@@ -0,0 +1,54 @@
+import json
+from typing import Dict, Any, List, Optional
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa json de la biblioteca estándar
+    orjson = None
+
+
+def dumps(value: Any) -> bytes:
+    """JSON compacto en UTF-8, el mismo formato que JSONResponse"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class Message:
+    """Respuesta de la conversación, sin validación de Pydantic.
+
+    Tiene los mismos campos y en el mismo orden que ConversationResponse, que
+    queda sólo para documentar la API; los valores los arma el propio servidor.
+    """
+    __slots__ = ('conversation_id', 'node_id', 'type', 'text', 'options', 'input_type',
+                 'input_label', 'inputs', 'is_final', 'error')
+
+    def __init__(self, conversation_id: str, node_id: str, type: Optional[str] = None,
+                 text: Optional[str] = None, options: Optional[List[str]] = None,
+                 input_type: Optional[str] = None, input_label: Optional[str] = None,
+                 inputs: Optional[List[Dict[str, Any]]] = None, is_final: Optional[bool] = None,
+                 error: Optional[str] = None):
+        self.conversation_id = conversation_id
+        self.node_id = node_id
+        self.type = type
+        self.text = text
+        self.options = options
+        self.input_type = input_type
+        self.input_label = input_label
+        self.inputs = inputs
+        self.is_final = is_final
+        self.error = error
+
+    def model_dump(self, exclude_none: bool = False) -> Dict[str, Any]:
+        data = {field: getattr(self, field) for field in self.__slots__}
+        if exclude_none:
+            return {k: v for k, v in data.items() if v is not None}
+        return data
+
+    def to_response(self) -> Response:
+        return Response(content=dumps(self.model_dump()), media_type="application/json")
+
+    def __repr__(self) -> str:
+        return f"Message({self.conversation_id!r}, {self.node_id!r})"
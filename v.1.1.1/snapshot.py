@@ -0,0 +1,324 @@
+import hashlib
+import hmac
+import json
+import struct
+import zlib
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+# Formato binario del estado de una conversación:
+#   'PS' | formato (1 byte) | flags (1 byte) | versión de contenidos (6 bytes) | cuerpo
+# El cuerpo es el dict de la conversación (sin 'version') codificado con etiquetas
+# de tipo; las claves y textos conocidos por la base de conocimiento se guardan
+# como índices de su tabla de símbolos, y las recomendaciones que coinciden con
+# el catálogo como índice del modelo.
+MAGIC = b'PS'
+FORMAT = 1
+FLAG_ZLIB = 0x01
+COMPRESS_MIN_SIZE = 200
+
+# Claves del estado de la conversación que no provienen de la base de conocimiento
+BASE_SYMBOLS = ('current_node', 'context', 'version', 'turn', 'replies')
+
+_NONE, _TRUE, _FALSE, _INT, _FLOAT, _STR, _SYM, _LIST, _DICT, _MODEL, _INTFLOAT = range(11)
+_DOUBLE = struct.Struct('<d')
+SIGNATURE_SIZE = 16
+
+
+class SnapshotError(ValueError):
+    """Snapshot inválido o de una versión de contenidos que no está cargada"""
+
+
+def build_symbols(kb) -> List[str]:
+    """Textos que la base de conocimiento puede poner en el estado de una conversación, en orden estable"""
+    symbols: Dict[str, None] = dict.fromkeys(BASE_SYMBOLS)
+
+    def add_keys(value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                symbols.setdefault(key)
+                add_keys(item)
+
+    for node in kb.flow.nodes.values():
+        symbols.setdefault(node.id)
+        symbols.setdefault(f"{node.id}_texto")
+        if 'variable' in node:
+            symbols.setdefault(node['variable'])
+        for var in node.get('variables', []):
+            symbols.setdefault(var)
+        for action in node.actions:
+            symbols.setdefault(action.target)
+        add_keys(node.get('parametros', {}))
+        for opt in node.options:
+            symbols.setdefault(opt.texto)
+            if isinstance(opt.valor, str):
+                symbols.setdefault(opt.valor)
+    for record in kb.catalog.records:
+        add_keys(record)
+        symbols.setdefault(record['name'])
+    return list(symbols)
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+class SnapshotCodec:
+    """Codificador del estado de conversación ligado a una versión de los contenidos"""
+
+    def __init__(self, kb):
+        self.kb = kb
+        self.version = bytes.fromhex(kb.version)
+        self.symbols = build_symbols(kb)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.records = kb.catalog.records
+        self.record_index = {record['name']: i for i, record in enumerate(self.records)}
+        self._build_context_rules(kb.flow)
+
+    def _build_context_rules(self, flow) -> None:
+        """Valores que el flujo puede poner en cada clave del contexto (check_context)"""
+        self.input_variables = set()
+        self.option_values: Dict[str, List[Any]] = {}
+        self.computed = set()
+        self.parameters: Dict[str, List[Any]] = {}
+        for node in flow.nodes.values():
+            if node.tipo == 'entrada_usuario':
+                if 'variable' in node:
+                    self.input_variables.add(node['variable'])
+                self.input_variables.update(node.get('variables', []))
+            if node.options:
+                self.option_values.setdefault(node.id, []).extend(opt.valor for opt in node.options)
+                self.option_values.setdefault(f"{node.id}_texto", []).extend(node.option_texts)
+            self.computed.update(action.target for action in node.actions)
+            for key, value in node.get('parametros', {}).items():
+                self.parameters.setdefault(key, []).append(value)
+
+    # --- codificación ---
+
+    def encode(self, conv: Dict[str, Any]) -> bytes:
+        body = bytearray()
+        self._write_dict(body, {k: v for k, v in conv.items() if k != 'version'})
+        flags = 0
+        if len(body) >= COMPRESS_MIN_SIZE:
+            compressed = zlib.compress(bytes(body), 6)
+            if len(compressed) < len(body):
+                body, flags = compressed, FLAG_ZLIB
+        return MAGIC + bytes((FORMAT, flags)) + self.version + bytes(body)
+
+    def _write_key(self, out: bytearray, key: str) -> None:
+        index = self.symbol_index.get(key)
+        if index is not None:
+            _write_varint(out, index << 1)
+        else:
+            raw = key.encode('utf-8')
+            _write_varint(out, (len(raw) << 1) | 1)
+            out += raw
+
+    def _write_dict(self, out: bytearray, value: Dict[str, Any]) -> None:
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            self._write_key(out, key)
+            self._write_value(out, item)
+
+    def _write_value(self, out: bytearray, value: Any) -> None:
+        if value is None:
+            out.append(_NONE)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, int):
+            if not -2**63 <= value < 2**63:
+                raise SnapshotError(f"Entero fuera de rango: {value}")
+            out.append(_INT)
+            _write_varint(out, (value << 1) ^ (value >> 63))
+        elif isinstance(value, float):
+            if value.is_integer() and 0 <= value < 2**53:
+                out.append(_INTFLOAT)
+                _write_varint(out, int(value))
+            else:
+                out.append(_FLOAT)
+                out += _DOUBLE.pack(value)
+        elif isinstance(value, str):
+            index = self.symbol_index.get(value)
+            if index is not None:
+                out.append(_SYM)
+                _write_varint(out, index)
+            else:
+                raw = value.encode('utf-8')
+                out.append(_STR)
+                _write_varint(out, len(raw))
+                out += raw
+        elif isinstance(value, (list, tuple)):
+            out.append(_LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                self._write_value(out, item)
+        elif isinstance(value, dict):
+            index = self.record_index.get(value.get('name'))
+            if index is not None and value == self.records[index]:
+                out.append(_MODEL)
+                _write_varint(out, index)
+            else:
+                out.append(_DICT)
+                self._write_dict(out, value)
+        else:
+            raise SnapshotError(f"Tipo no serializable: {type(value).__name__}")
+
+    def encode_value(self, value: Any) -> bytes:
+        """Un valor suelto con las mismas etiquetas del cuerpo, sin cabecera (state.py)"""
+        out = bytearray()
+        self._write_value(out, value)
+        return bytes(out)
+
+    def check_context(self, context: Dict[str, Any]) -> None:
+        """Comprueba que el contexto de un snapshot tenga sólo lo que el flujo puede producir.
+
+        Los valores ingresados deben ser números y los de las opciones, los
+        de alguna opción del nodo; los parámetros, los de algún nodo de
+        cálculo. Los resultados de las acciones sólo se comprueban por su clave.
+        """
+        for key, value in context.items():
+            if key in self.input_variables:
+                ok = type(value) is float
+            elif key in self.option_values:
+                ok = any(type(value) is type(allowed) and value == allowed for allowed in self.option_values[key])
+            elif key in self.parameters:
+                ok = key in self.computed or any(type(value) is type(allowed) and value == allowed for allowed in self.parameters[key])
+            else:
+                ok = key in self.computed
+            if not ok:
+                raise SnapshotError(f"Valor inválido en el contexto: {key!r}")
+
+    # --- decodificación ---
+
+    def decode_value(self, data: bytes) -> Any:
+        return self._read_value(data, 0)[0]
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        if data[:2] != MAGIC or len(data) < 10 or data[2] != FORMAT:
+            raise SnapshotError("Snapshot inválido")
+        if data[4:10] != self.version:
+            raise SnapshotError("El snapshot corresponde a otra versión de los contenidos")
+        try:
+            body = zlib.decompress(data[10:]) if data[3] & FLAG_ZLIB else data[10:]
+            conv, _ = self._read_dict(body, 0)
+        except (IndexError, UnicodeDecodeError, struct.error, zlib.error) as e:
+            raise SnapshotError(f"Snapshot dañado: {e}") from None
+        except RecursionError:
+            raise SnapshotError("Snapshot dañado: demasiados niveles anidados") from None
+        conv['version'] = self.kb.version
+        return conv
+
+    def _read_dict(self, data: bytes, pos: int) -> Tuple[Dict[str, Any], int]:
+        count, pos = _read_varint(data, pos)
+        result = {}
+        for _ in range(count):
+            header, pos = _read_varint(data, pos)
+            if header & 1:
+                end = pos + (header >> 1)
+                key, pos = data[pos:end].decode('utf-8'), end
+            else:
+                key = self.symbols[header >> 1]
+            result[key], pos = self._read_value(data, pos)
+        return result, pos
+
+    def _read_value(self, data: bytes, pos: int) -> Tuple[Any, int]:
+        tag = data[pos]
+        pos += 1
+        if tag == _NONE:
+            return None, pos
+        if tag == _TRUE:
+            return True, pos
+        if tag == _FALSE:
+            return False, pos
+        if tag == _INT:
+            value, pos = _read_varint(data, pos)
+            return (value >> 1) ^ -(value & 1), pos
+        if tag == _INTFLOAT:
+            value, pos = _read_varint(data, pos)
+            return float(value), pos
+        if tag == _FLOAT:
+            return _DOUBLE.unpack_from(data, pos)[0], pos + 8
+        if tag == _SYM:
+            index, pos = _read_varint(data, pos)
+            return self.symbols[index], pos
+        if tag == _STR:
+            length, pos = _read_varint(data, pos)
+            return data[pos:pos + length].decode('utf-8'), pos + length
+        if tag == _LIST:
+            length, pos = _read_varint(data, pos)
+            items = []
+            for _ in range(length):
+                item, pos = self._read_value(data, pos)
+                items.append(item)
+            return items, pos
+        if tag == _DICT:
+            return self._read_dict(data, pos)
+        if tag == _MODEL:
+            index, pos = _read_varint(data, pos)
+            return dict(self.records[index]), pos
+        raise SnapshotError(f"Etiqueta desconocida {tag}")
+
+
+def snapshot_version(data: bytes) -> str:
+    """Versión de contenidos con la que se generó el snapshot"""
+    if data[:2] != MAGIC or len(data) < 10:
+        raise SnapshotError("Snapshot inválido")
+    return data[4:10].hex()
+
+
+def sign(data: bytes, key: bytes) -> bytes:
+    """Agrega una firma HMAC para que el cliente no pueda alterar el estado"""
+    return data + hmac.new(key, data, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+
+def verify(data: bytes, key: bytes) -> bytes:
+    """Comprueba la firma y devuelve el snapshot sin ella"""
+    body, signature = data[:-SIGNATURE_SIZE], data[-SIGNATURE_SIZE:]
+    expected = hmac.new(key, body, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+    if len(data) <= SIGNATURE_SIZE or not hmac.compare_digest(signature, expected):
+        raise SnapshotError("Firma del snapshot inválida")
+    return body
+
+
+class SessionSerializer:
+    """Serializador binario para los backends compartidos de conversaciones.
+
+    Cada conversación se codifica con la versión de contenidos a la que está
+    ligada. Lee también los registros JSON guardados antes del formato binario;
+    si la versión del registro ya no está cargada, la conversación se da por perdida.
+    """
+
+    def __init__(self, registry, logger=None):
+        self.registry = registry
+        self.logger = logger
+
+    def dumps(self, conv: Dict[str, Any]) -> bytes:
+        return self.registry.get(conv.get('version')).codec.encode(conv)
+
+    def loads(self, data: Union[str, bytes]) -> Optional[Dict[str, Any]]:
+        if isinstance(data, str) or data[:2] != MAGIC:
+            return json.loads(data)
+        try:
+            kb = self.registry.find(snapshot_version(data))
+            if kb is None:
+                raise SnapshotError("El snapshot corresponde a otra versión de los contenidos")
+            return kb.codec.decode(data)
+        except SnapshotError as e:
+            if self.logger is not None:
+                self.logger.warning("No se pudo leer la conversación guardada: %s", e)
+            return None
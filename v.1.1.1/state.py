@@ -0,0 +1,209 @@
+"""Estado compacto de las conversaciones que guarda MemoryStore.
+
+Un dict por conversación repite en cada una las claves del contexto, los
+textos de las opciones y copias de los modelos del catálogo. ConversationState
+guarda en su lugar:
+
+- el nodo actual como índice del grafo;
+- el contexto como pares (posición, valor) de la tabla de variables del flujo
+  (StateLayout), en el formato binario de snapshot.py: los textos conocidos
+  son índices de su tabla de símbolos y los modelos del catálogo, su índice;
+- sólo la posición de los textos que arman las funciones de DERIVED_CALLS,
+  si el contexto guardado los reproduce: se recalculan al leer;
+- las respuestas guardadas por Idempotency-Key, comprimidas con los textos
+  de los contenidos como diccionario de zlib.
+
+Una tupla con una posición por variable ocuparía más que todo el contexto
+codificado: cada conversación usa pocas de las variables del flujo.
+
+Los handlers siguen trabajando con el dict: unpack() lo reconstruye en cada
+get() y pack() lo compacta en cada set(). Como en los backends compartidos,
+las tuplas vuelven como listas.
+"""
+import json
+import zlib
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from responses import dumps
+from snapshot import SnapshotError
+
+# Funciones baratas y deterministas: sus resultados se recalculan en lugar de guardarse
+DERIVED_CALLS = frozenset({'format_radiator_recommendations', 'format_radiator_mixes'})
+
+# Claves de la conversación que entran en ConversationState; con otras se guarda el dict
+_KEYS = frozenset({'current_node', 'context', 'version', 'turn', 'replies'})
+
+# Ventana de zlib de 8 KB (y su diccionario): alcanza para las respuestas y se inicializa más rápido
+_WBITS = 13
+
+
+class ConversationState:
+    """Conversación compactada con la tabla de su versión de los contenidos"""
+    __slots__ = ('layout', 'node', 'turn', 'context', 'replies')
+
+    def __init__(self, layout: "StateLayout", node: int, turn: Optional[int], context: bytes,
+                 replies: Optional[bytes]):
+        self.layout = layout
+        self.node = node
+        self.turn = turn
+        # [clave, valor, ...]: la clave es la posición de la variable, -1 - posición si se
+        # recalcula (sin valor) o el nombre si no está en la tabla
+        self.context = context
+        self.replies = replies
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self.layout.unpack(self)
+
+
+def context_variables(flow) -> List[str]:
+    """Claves que el flujo puede poner en el contexto, en el orden de los nodos"""
+    names: Dict[str, None] = {}
+    for node in flow.nodes.values():
+        if node.options:
+            names.setdefault(node.id)
+            names.setdefault(f"{node.id}_texto")
+        if 'variable' in node:
+            names.setdefault(node['variable'])
+        for var in node.get('variables', []):
+            names.setdefault(var)
+        for action in node.actions:
+            names.setdefault(action.target)
+    return list(names)
+
+
+def compression_dictionary(kb) -> bytes:
+    """Textos que repiten las respuestas: los del flujo y los del catálogo"""
+    parts = []
+    for node in kb.flow.nodes.values():
+        parts.extend(node[key] for key in ('pregunta', 'texto') if isinstance(node.get(key), str))
+        parts.extend(node.option_texts)
+    for record in kb.catalog.records:
+        parts += (record['name'], record['description'])
+    # zlib sólo usa el final que entra en la ventana
+    return '\n'.join(parts).encode('utf-8')[-(1 << _WBITS):]
+
+
+def derived_actions(flow, variable_index: Dict[str, int]) -> List[Tuple[int, Any]]:
+    """(posición, acción) de las variables que se pueden recalcular, en orden de cálculo.
+
+    Cada una la asigna una sola acción, que sólo llama a DERIVED_CALLS y lee
+    variables guardadas o recalculadas antes.
+    """
+    actions = [action for node in flow.nodes.values() for action in node.actions]
+    counts = Counter(action.target for action in actions)
+    candidates = {action.target for action in actions
+                  if counts[action.target] == 1 and action.calls and action.calls <= DERIVED_CALLS
+                  and action.target not in action.variables}
+    derived, seen = [], set()
+    for action in actions:
+        if action.target in candidates and (action.variables & candidates) <= seen:
+            derived.append((variable_index[action.target], action))
+            seen.add(action.target)
+    return derived
+
+
+class StateLayout:
+    """Tabla de posiciones del estado de las conversaciones de una versión de los contenidos"""
+
+    def __init__(self, kb):
+        self.kb = kb
+        self.version = kb.version
+        self.codec = kb.codec
+        self.node_ids = list(kb.flow.nodes)
+        self.node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.variables = context_variables(kb.flow)
+        self.variable_index = {name: i for i, name in enumerate(self.variables)}
+        self.derived = derived_actions(kb.flow, self.variable_index)
+        self.zdict = compression_dictionary(kb)
+
+    # --- compactar ---
+
+    def pack(self, conv: Dict[str, Any]) -> Union[ConversationState, Dict[str, Any]]:
+        """Estado compacto de la conversación, o el mismo dict si no encaja en la tabla"""
+        context = conv.get('context')
+        node = self.node_index.get(conv.get('current_node'))
+        if node is None or not isinstance(context, dict) or conv.keys() - _KEYS:
+            return conv
+
+        derived = {action.target for _, action in self.derived
+                   if isinstance(context.get(action.target), str)
+                   and self._reproduces(action, context, context[action.target])}
+        entries: List[Any] = []
+        for key, value in context.items():
+            slot = self.variable_index.get(key)
+            if slot is None:
+                entries += (key, value)
+            elif key in derived:
+                entries.append(-1 - slot)
+            else:
+                entries += (slot, value)
+        try:
+            data = self.codec.encode_value(entries)
+            replies = self._compress(dumps(conv['replies'])) if 'replies' in conv else None
+        except (SnapshotError, TypeError, ValueError):
+            return conv  # Un valor que el formato binario o JSON no admiten
+        return ConversationState(self, node, conv.get('turn'), data, replies)
+
+    def _compress(self, data: bytes) -> bytes:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, _WBITS, 5, zdict=self.zdict)
+        return compressor.compress(data) + compressor.flush()
+
+    def _reproduces(self, action, context: Dict[str, Any], value: str) -> bool:
+        try:
+            return action.evaluate(context, self.kb.namespace) == value
+        except Exception:
+            return False
+
+    # --- reconstruir ---
+
+    def unpack(self, state: ConversationState) -> Dict[str, Any]:
+        """Dict de la conversación que se compactó"""
+        entries = self.codec.decode_value(state.context)
+        variables = self.variables
+        context: Dict[str, Any] = {}
+        derived = set()
+        i = 0
+        while i < len(entries):
+            key = entries[i]
+            if isinstance(key, str):
+                context[key] = entries[i + 1]
+                i += 2
+            elif key < 0:
+                name = variables[-1 - key]
+                context[name] = None  # Conserva la posición hasta recalcularla
+                derived.add(name)
+                i += 1
+            else:
+                context[variables[key]] = entries[i + 1]
+                i += 2
+        if derived:
+            for _, action in self.derived:
+                if action.target in derived:
+                    context[action.target] = action.evaluate(context, self.kb.namespace)
+
+        conv = {'current_node': self.node_ids[state.node], 'context': context, 'version': self.version}
+        if state.turn is not None:
+            conv['turn'] = state.turn
+        if state.replies is not None:
+            decompressor = zlib.decompressobj(_WBITS, zdict=self.zdict)
+            conv['replies'] = json.loads(decompressor.decompress(state.replies) + decompressor.flush())
+        return conv
+
+
+class StatePacker:
+    """Compacta las conversaciones de MemoryStore con la tabla de su versión de los contenidos.
+
+    Si la versión ya no está cargada la conversación se guarda como dict.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def pack(self, conv: Dict[str, Any]) -> Union[ConversationState, Dict[str, Any]]:
+        version = conv.get('version')
+        kb = self.registry.find(version) if isinstance(version, str) else None
+        return conv if kb is None else kb.layout.pack(conv)
+
+    def unpack(self, value: Union[ConversationState, Dict[str, Any]]) -> Dict[str, Any]:
+        return value if isinstance(value, dict) else value.layout.unpack(value)
@@ -0,0 +1,662 @@
+// Motor del flujo en el navegador: ejecuta el paquete de /flow/bundle (bundle.py)
+// con la misma semántica que el servidor (engine.py, expressions.py y las
+// funciones de app.py), para que cada opción no sea una petición.
+//
+// Los números siguen las reglas de Python: los enteros son number y los float
+// van envueltos en PyFloat, así '/' siempre da float, ceil() da entero y los
+// textos muestran 4.0 en lugar de 4.
+//
+// Al cambiar este archivo o la lógica que replica, comparar con el servidor:
+//     python benchmark.py parity --sessions 300
+(function (root) {
+    'use strict';
+
+    const FORMAT = 2;
+    const MAX_STEPS = 64;
+    const INPUT_ERROR = 'Por favor ingrese valores numéricos válidos (ej: 4.5, 3.75)';
+    const NO_MODELS = 'No encontramos modelos que coincidan con tus requisitos. Por favor intenta con diferentes parámetros.';
+    const NO_MIXES = 'No encontramos combinaciones de equipos que cubran la carga térmica en el largo de pared disponible.';
+    // Constantes de radiator_mix.py
+    const MIX = { maxUnits: 3, minModules: 3, maxModules: 15, moduleWidthCm: 8, tolerance: 1e-6 };
+    const RESPONSE_FIELDS = ['conversation_id', 'node_id', 'type', 'text', 'options', 'input_type',
+                             'input_label', 'inputs', 'is_final', 'error'];
+
+    class PyFloat {
+        constructor(value) { this.value = value; }
+    }
+
+    class FlowError extends Error {
+        constructor(kind, message) {
+            super(`${kind}: ${message}`);
+            this.kind = kind;
+        }
+    }
+
+    const has = (obj, key) => Object.prototype.hasOwnProperty.call(obj, key);
+    const isDict = value => value !== null && typeof value === 'object' && !Array.isArray(value) && !(value instanceof PyFloat);
+    const isNumber = value => typeof value === 'number' || typeof value === 'boolean' || value instanceof PyFloat;
+    const num = value => (value instanceof PyFloat ? value.value : +value);
+
+    // --- valores del paquete ---
+
+    function decode(value) {
+        if (Array.isArray(value)) return value.map(decode);
+        if (isDict(value)) {
+            if (has(value, '$f') && Object.keys(value).length === 1) return new PyFloat(value.$f);
+            const result = {};
+            for (const key of Object.keys(value)) result[key] = decode(value[key]);
+            return result;
+        }
+        return value;
+    }
+
+    function copyValue(value) {
+        if (Array.isArray(value)) return value.map(copyValue);
+        if (isDict(value)) {
+            const result = {};
+            for (const key of Object.keys(value)) result[key] = copyValue(value[key]);
+            return result;
+        }
+        return value;
+    }
+
+    // --- aritmética y comparaciones de Python ---
+
+    function truthy(value) {
+        if (value === null || value === undefined) return false;
+        if (value instanceof PyFloat) return value.value !== 0;
+        if (typeof value === 'string' || Array.isArray(value)) return value.length > 0;
+        if (isDict(value)) return Object.keys(value).length > 0;
+        return Boolean(value);
+    }
+
+    function zeroDivision() {
+        return new FlowError('ZeroDivisionError', 'division by zero');
+    }
+
+    function arithmetic(op, left, right) {
+        if (op === '+' && typeof left === 'string' && typeof right === 'string') return left + right;
+        if (op === '+' && Array.isArray(left) && Array.isArray(right)) return left.concat(right);
+        if (op === '*' && typeof left === 'string' && isNumber(right) && !(right instanceof PyFloat)) return left.repeat(Math.max(+right, 0));
+        if (op === '*' && typeof right === 'string' && isNumber(left) && !(left instanceof PyFloat)) return right.repeat(Math.max(+left, 0));
+        if (!isNumber(left) || !isNumber(right)) {
+            throw new FlowError('TypeError', `unsupported operand type(s) for ${op}`);
+        }
+        const x = num(left), y = num(right);
+        const float = left instanceof PyFloat || right instanceof PyFloat;
+        let result;
+        switch (op) {
+            case '+': result = x + y; break;
+            case '-': result = x - y; break;
+            case '*': result = x * y; break;
+            case '/':
+                if (y === 0) throw zeroDivision();
+                return new PyFloat(x / y);
+            case '//':
+                if (y === 0) throw zeroDivision();
+                result = float ? floatDivmod(x, y)[0] : Math.floor(x / y);
+                break;
+            case '%':
+                if (y === 0) throw zeroDivision();
+                result = float ? floatDivmod(x, y)[1] : x % y;
+                if (!float && result !== 0 && (result < 0) !== (y < 0)) result += y;
+                break;
+            case '**':
+                if (x === 0 && y < 0) throw zeroDivision();
+                result = y === 0.5 ? Math.sqrt(x) : Math.pow(x, y);
+                if (Math.abs(result) === Infinity && Number.isFinite(x) && Number.isFinite(y)) {
+                    throw new FlowError('OverflowError', 'Numerical result out of range');
+                }
+                if (Number.isNaN(result) && !Number.isNaN(x) && !Number.isNaN(y)) {
+                    // Python devuelve un número complejo
+                    throw new FlowError('TypeError', 'resultado complejo');
+                }
+                if (!float && y < 0) return new PyFloat(result);
+                break;
+            default:
+                throw new FlowError('TypeError', `operador desconocido ${op}`);
+        }
+        return float ? new PyFloat(result) : result + 0;  // los enteros no tienen -0
+    }
+
+    // divmod() de floats como en Python: el cociente se calcula a partir del
+    // resto exacto y no de x / y, que puede redondear al entero siguiente
+    function floatDivmod(x, y) {
+        let mod = x % y;
+        let div = (x - mod) / y;
+        if (mod !== 0) {
+            if ((y < 0) !== (mod < 0)) {
+                mod += y;
+                div -= 1;
+            }
+        } else {
+            mod = y < 0 ? -0 : 0;
+        }
+        let floordiv;
+        if (div !== 0) {
+            floordiv = Math.floor(div);
+            if (div - floordiv > 0.5) floordiv += 1;
+        } else {
+            floordiv = x / y < 0 || Object.is(x / y, -0) ? -0 : 0;
+        }
+        return [floordiv, mod];
+    }
+
+    function equals(left, right) {
+        if (isNumber(left) && isNumber(right)) return num(left) === num(right);
+        if (Array.isArray(left) && Array.isArray(right)) {
+            return left.length === right.length && left.every((item, i) => equals(item, right[i]));
+        }
+        if (isDict(left) && isDict(right)) {
+            const keys = Object.keys(left);
+            return keys.length === Object.keys(right).length
+                && keys.every(key => has(right, key) && equals(left[key], right[key]));
+        }
+        return left === right;
+    }
+
+    function contains(container, item) {
+        if (typeof container === 'string') {
+            if (typeof item !== 'string') throw new FlowError('TypeError', "'in <string>' requires string as left operand");
+            return container.includes(item);
+        }
+        if (Array.isArray(container)) return container.some(value => equals(value, item));
+        if (isDict(container)) return typeof item === 'string' && has(container, item);
+        throw new FlowError('TypeError', 'argument is not iterable');
+    }
+
+    function compare(op, left, right) {
+        switch (op) {
+            case '==': return equals(left, right);
+            case '!=': return !equals(left, right);
+            case 'in': return contains(right, left);
+            case 'not in': return !contains(right, left);
+        }
+        let x, y;
+        if (isNumber(left) && isNumber(right)) {
+            x = num(left); y = num(right);
+        } else if (typeof left === 'string' && typeof right === 'string') {
+            x = left; y = right;
+        } else {
+            throw new FlowError('TypeError', `'${op}' not supported`);
+        }
+        switch (op) {
+            case '<': return x < y;
+            case '<=': return x <= y;
+            case '>': return x > y;
+            case '>=': return x >= y;
+        }
+        throw new FlowError('TypeError', `comparación desconocida ${op}`);
+    }
+
+    function subscript(container, key) {
+        if (typeof container === 'string' || Array.isArray(container)) {
+            if (typeof key !== 'number' && typeof key !== 'boolean') {
+                throw new FlowError('TypeError', 'indices must be integers');
+            }
+            const index = +key < 0 ? container.length + +key : +key;
+            if (index < 0 || index >= container.length) throw new FlowError('IndexError', 'index out of range');
+            return container[index];
+        }
+        if (isDict(container)) {
+            if (typeof key !== 'string' || !has(container, key)) throw new FlowError('KeyError', String(key));
+            return container[key];
+        }
+        throw new FlowError('TypeError', 'object is not subscriptable');
+    }
+
+    function evaluate(expr, context, functions) {
+        switch (expr[0]) {
+            case 'const':
+                return expr[1];
+            case 'name':
+                if (!has(context, expr[1])) throw new FlowError('NameError', `name '${expr[1]}' is not defined`);
+                return context[expr[1]];
+            case 'bin':
+                return arithmetic(expr[1], evaluate(expr[2], context, functions), evaluate(expr[3], context, functions));
+            case 'unary': {
+                const value = evaluate(expr[2], context, functions);
+                if (expr[1] === 'not') return !truthy(value);
+                if (!isNumber(value)) throw new FlowError('TypeError', `bad operand type for unary ${expr[1]}`);
+                if (value instanceof PyFloat) return expr[1] === '-' ? new PyFloat(-value.value) : value;
+                return expr[1] === '-' ? -num(value) : num(value);
+            }
+            case 'bool': {
+                let value;
+                for (const item of expr[2]) {
+                    value = evaluate(item, context, functions);
+                    if (truthy(value) === (expr[1] === 'or')) return value;
+                }
+                return value;
+            }
+            case 'cmp': {
+                let left = evaluate(expr[1], context, functions);
+                for (const [op, item] of expr[2]) {
+                    const right = evaluate(item, context, functions);
+                    if (!compare(op, left, right)) return false;
+                    left = right;
+                }
+                return true;
+            }
+            case 'if':
+                return truthy(evaluate(expr[1], context, functions))
+                    ? evaluate(expr[2], context, functions)
+                    : evaluate(expr[3], context, functions);
+            case 'sub':
+                return subscript(evaluate(expr[1], context, functions), evaluate(expr[2], context, functions));
+            case 'call': {
+                if (!has(functions, expr[1])) throw new FlowError('NameError', `name '${expr[1]}' is not defined`);
+                return functions[expr[1]](...expr[2].map(arg => evaluate(arg, context, functions)));
+            }
+            case 'list':
+                return expr[1].map(item => evaluate(item, context, functions));
+        }
+        throw new FlowError('TypeError', `expresión desconocida ${expr[0]}`);
+    }
+
+    // --- textos como los muestra Python ---
+
+    function floatRepr(x) {
+        if (Number.isNaN(x)) return 'nan';
+        if (!Number.isFinite(x)) return x > 0 ? 'inf' : '-inf';
+        if (x === 0) return Object.is(x, -0) ? '-0.0' : '0.0';
+        const abs = Math.abs(x);
+        if (abs >= 1e16 || abs < 1e-4) {
+            // repr() usa notación exponencial con al menos dos dígitos de exponente
+            const [mantissa, exponent] = x.toExponential().split('e');
+            const sign = exponent[0] === '-' ? '-' : '+';
+            const digits = exponent.replace(/^[+-]/, '').padStart(2, '0');
+            return `${mantissa}e${sign}${digits}`;
+        }
+        const text = String(x);
+        return text.includes('.') ? text : `${text}.0`;
+    }
+
+    function intText(x) {
+        return Number.isInteger(x) && !Number.isSafeInteger(x) ? BigInt(x).toString() : String(x);
+    }
+
+    function repr(value) {
+        if (typeof value === 'string') {
+            const quote = value.includes("'") && !value.includes('"') ? '"' : "'";
+            const escaped = value.replace(/\\/g, '\\\\').replace(/\n/g, '\\n').replace(/\r/g, '\\r').replace(/\t/g, '\\t');
+            return quote + (quote === "'" ? escaped.replace(/'/g, "\\'") : escaped) + quote;
+        }
+        return pyStr(value);
+    }
+
+    function pyStr(value) {
+        if (value === null || value === undefined) return 'None';
+        if (value === true) return 'True';
+        if (value === false) return 'False';
+        if (value instanceof PyFloat) return floatRepr(value.value);
+        if (typeof value === 'number') return intText(value);
+        if (typeof value === 'string') return value;
+        if (Array.isArray(value)) return `[${value.map(repr).join(', ')}]`;
+        return `{${Object.keys(value).map(key => `${repr(key)}: ${repr(value[key])}`).join(', ')}}`;
+    }
+
+    // format(x, '.0f'): redondeo al par más cercano sobre el valor exacto del double
+    function formatFixed0(value) {
+        if (!(value instanceof PyFloat)) return intText(num(value));
+        const x = value.value;
+        if (!Number.isFinite(x)) return floatRepr(x);
+        const floor = Math.floor(x);
+        const diff = x - floor;
+        let result = diff > 0.5 || (diff === 0.5 && floor % 2 !== 0) ? floor + 1 : floor;
+        const text = intText(result);
+        return result === 0 && (x < 0 || Object.is(x, -0)) ? `-${text}` : text;
+    }
+
+    // float(str(value).replace(',', '.')) de Python
+    const FLOAT_PATTERN = /^[+-]?(?:\d(?:_?\d)*(?:\.(?:\d(?:_?\d)*)?)?|\.\d(?:_?\d)*)(?:[eE][+-]?\d(?:_?\d)*)?$/;
+    const SPECIAL_PATTERN = /^([+-]?)(inf|infinity|nan)$/i;
+
+    function parseFloatInput(value) {
+        const text = (typeof value === 'string' ? value : pyStr(value)).replace(/,/g, '.').trim();
+        if (FLOAT_PATTERN.test(text)) return new PyFloat(Number(text.replace(/_/g, '')));
+        const special = SPECIAL_PATTERN.exec(text);
+        if (special) {
+            const magnitude = special[2].toLowerCase() === 'nan' ? NaN : Infinity;
+            return new PyFloat(special[1] === '-' ? -magnitude : magnitude);
+        }
+        return null;
+    }
+
+    function renderTemplate(template, context) {
+        if (!Array.isArray(template)) return template;
+        return template.map(part => {
+            if (typeof part === 'string') return part;
+            // Jinja2 muestra vacías las variables que no están en el contexto
+            return has(context, part[1]) ? pyStr(context[part[1]]) : '';
+        }).join('');
+    }
+
+    // --- funciones de las acciones (app.py y catalog.py) ---
+
+    // math.ceil: siempre devuelve un entero
+    function ceil(value) {
+        if (!isNumber(value)) throw new FlowError('TypeError', 'must be real number');
+        const result = Math.ceil(num(value));
+        if (!Number.isFinite(result)) throw new FlowError('OverflowError', 'cannot convert float to integer');
+        return result === 0 ? 0 : result;
+    }
+
+    function makeFunctions(catalog) {
+        const models = catalog.models;
+        const effective = models.map(model => num(model.potencia) * num(model.coeficiente));
+        const matches = (values, value, allowAny) => (allowAny && value === catalog.any) || values.includes(value);
+
+        function filterRadiators(radiatorType, installation, style, color, heatLoad, limit = 3) {
+            const load = num(heatLoad);
+            const rows = [];
+            models.forEach((model, row) => {
+                const attrs = model.attributes;
+                if (model.modular && matches(attrs.type, radiatorType, false) && matches(attrs.installation, installation, true)
+                        && matches(attrs.style, style, true) && matches(attrs.colors, color, true)) {
+                    rows.push(row);
+                }
+            });
+            rows.sort((a, b) => (Math.abs(effective[a] - load) - Math.abs(effective[b] - load)) || a - b);
+            return rows.slice(0, limit).map(row => {
+                const { attributes, ...record } = models[row];
+                return copyValue(record);
+            });
+        }
+
+        function formatRadiatorRecommendations(modelList, heatLoad) {
+            if (!truthy(modelList) || !Array.isArray(modelList)) return NO_MODELS;
+            const result = [];
+            modelList.forEach((model, i) => {
+                try {
+                    if (!isDict(model)) throw new FlowError('AttributeError', 'get');
+                    const get = (key, fallback) => (has(model, key) ? model[key] : fallback);
+                    const potencia = arithmetic('*', get('potencia', 0), get('coeficiente', 1));
+                    const modulos = compare('>', potencia, 0) ? ceil(arithmetic('/', heatLoad, potencia)) : 0;
+                    const lines = [
+                        `${i + 1}. ${pyStr(get('name', 'Modelo desconocido'))}`,
+                        `   - Potencia efectiva: ${formatFixed0(potencia)} kcal/h`,
+                        `   - Módulos estimados: ${intText(modulos)}`,
+                        `   - Descripción: ${pyStr(get('description', 'Sin descripción disponible'))}`,
+                    ];
+                    if (has(model, 'colors')) {
+                        // ', '.join() de Python también acepta un texto: une sus caracteres
+                        const colors = typeof model.colors === 'string' ? [...model.colors] : model.colors;
+                        if (!Array.isArray(colors) || !colors.every(color => typeof color === 'string')) {
+                            throw new FlowError('TypeError', 'sequence item: expected str instance');
+                        }
+                        lines.push(`   - Colores disponibles: ${colors.join(', ')}`);
+                    }
+                    result.push(lines.join('\n'));
+                } catch (e) {
+                    // Igual que el servidor: el modelo que no se puede formatear se omite
+                }
+            });
+            return result.length ? result.join('\n\n') : 'No se pudieron generar recomendaciones.';
+        }
+
+        // radiator_mix._modules_for
+        function modulesFor(total, power, load, start) {
+            let k = Math.max(start, Math.ceil((load - total) / power));
+            while (k > start && total + (k - 1) * power >= load) k--;
+            while (total + k * power < load) k++;
+            return k;
+        }
+
+        // radiator_mix.pareto_mixes: búsqueda exacta sobre la potencia real, en el mismo orden
+        function paretoMixes(powers, load, wall) {
+            const candidates = [];
+            powers.forEach((power, c) => {
+                if (power > 0 && powers.indexOf(power) === c) candidates.push(c);
+            });
+            if (!candidates.length || MIX.maxUnits * MIX.maxModules * Math.max(...powers) < load) return [];
+            const reach = candidates.map((c, i) => Math.max(...candidates.slice(i).map(d => powers[d])) * MIX.maxModules);
+
+            const best = new Map();  // equipos * 1000 + módulos -> { total, units, modules, picks }
+            let partial = [[0, 0, 0, []]];
+            for (let units = 1; units <= MIX.maxUnits; units++) {
+                const left = MIX.maxUnits - units;
+                const grown = [];
+                for (const [total, modules, first, picks] of partial) {
+                    for (let i = first; i < candidates.length; i++) {
+                        const c = candidates[i];
+                        const power = powers[c];
+                        const start = i === first && picks.length ? picks[picks.length - 1][1] : MIX.minModules;
+                        const k = modulesFor(total, power, load, start);
+                        if (k <= MIX.maxModules && modules + k <= wall) {
+                            const reached = total + k * power;
+                            const key = units * 1000 + modules + k;
+                            const cell = best.get(key);
+                            if (cell === undefined || reached < cell.total) {
+                                best.set(key, { total: reached, units, modules: modules + k, picks: [...picks, [c, k]] });
+                            }
+                        }
+                        if (left) {
+                            const end = Math.min(k, MIX.maxModules + 1, wall - modules - MIX.minModules + 1);
+                            for (let j = start; j < end; j++) {
+                                const reached = total + j * power;
+                                if (reached + left * reach[i] >= load) grown.push([reached, modules + j, i, [...picks, [c, j]]]);
+                            }
+                        }
+                    }
+                }
+                partial = grown;
+            }
+
+            const cells = [...best.values()];
+            const front = [];
+            for (const cell of cells) {
+                if (cells.some(other => other !== cell && other.units <= cell.units && other.modules <= cell.modules
+                                        && other.total <= cell.total + MIX.tolerance)) continue;
+                const counts = new Map();
+                for (const [c, k] of cell.picks) {
+                    const key = c * 100 + k;
+                    counts.set(key, counts.has(key) ? [c, k, counts.get(key)[2] + 1] : [c, k, 1]);
+                }
+                const equipment = [...counts.values()].sort((a, b) => (a[0] - b[0]) || (b[1] - a[1]));
+                front.push({ total: cell.total, units: cell.units, modules: cell.modules, equipment });
+            }
+            return front.sort((a, b) => (a.units - b.units) || (a.total - b.total) || (a.modules - b.modules));
+        }
+
+        function mixPower(equipment, powers) {
+            let total = 0;
+            for (const [c, k, n] of equipment) total += n * k * powers[c];
+            return total;
+        }
+
+        // RadiatorCatalog.mixes
+        function radiatorMixes(radiatorType, installation, style, color, heatLoad, wallLength, limit = 3) {
+            if (!isNumber(heatLoad)) throw new FlowError('TypeError', 'must be real number');
+            const load = num(heatLoad);
+            if (!Number.isFinite(load) || load <= 0) return [];
+            if (!isNumber(wallLength)) throw new FlowError('TypeError', 'unsupported operand type(s) for /');
+            const rows = [];
+            models.forEach((model, row) => {
+                const attrs = model.attributes;
+                if (model.modular && matches(attrs.type, radiatorType, false) && matches(attrs.installation, installation, true)
+                        && matches(attrs.style, style, true) && matches(attrs.colors, color, true)) {
+                    rows.push(row);
+                }
+            });
+            const maxModules = MIX.maxUnits * MIX.maxModules;
+            const wallModules = num(wallLength) * 100 / MIX.moduleWidthCm;
+            const wall = !(wallModules < maxModules) ? maxModules : Math.floor(wallModules);
+            const powers = rows.map(row => effective[row]);
+            return paretoMixes(powers, load, wall).slice(0, limit).map(mix => ({
+                equipos: mix.equipment.map(([c, k, n]) => ({ name: models[rows[c]].name, modulos: k, cantidad: n })),
+                potencia: new PyFloat(mix.total),
+                exceso: new PyFloat(mix.total - load),
+                modulos: mix.modules,
+                largo_cm: mix.modules * MIX.moduleWidthCm,
+            }));
+        }
+
+        function formatRadiatorMixes(mixes) {
+            if (!truthy(mixes) || !Array.isArray(mixes)) return NO_MIXES;
+            const item = (value, key) => {
+                if (!isDict(value)) throw new FlowError('TypeError', 'indices must be integers');
+                if (!has(value, key)) throw new FlowError('KeyError', key);
+                return value[key];
+            };
+            const number = value => {
+                if (!isNumber(value)) throw new FlowError('ValueError', 'Unknown format code');
+                return formatFixed0(value);
+            };
+            const lines = ['Combinaciones de equipos que cubren la carga térmica:'];
+            mixes.forEach((mix, i) => {
+                const units = item(mix, 'equipos');
+                if (!Array.isArray(units)) throw new FlowError('TypeError', 'equipos');
+                const text = units.map(unit => `${pyStr(item(unit, 'cantidad'))} x ${pyStr(item(unit, 'name'))} de ${pyStr(item(unit, 'modulos'))} módulos`);
+                lines.push(`${i + 1}. ${text.join(' + ')}`);
+                lines.push(`   - Potencia total: ${number(item(mix, 'potencia'))} kcal/h (exceso: ${number(item(mix, 'exceso'))} kcal/h)`);
+                lines.push(`   - Largo total: ${pyStr(item(mix, 'largo_cm'))} cm`);
+            });
+            return lines.join('\n');
+        }
+
+        return {
+            'filter_radiators': filterRadiators,
+            'format_radiator_recommendations': formatRadiatorRecommendations,
+            'radiator_mixes': radiatorMixes,
+            'format_radiator_mixes': formatRadiatorMixes,
+            'ceil': ceil,
+        };
+    }
+
+    // --- conversación ---
+
+    function supports(bundle) {
+        if (!bundle || bundle.format !== FORMAT) return false;
+        const functions = makeFunctions({ any: null, models: [] });
+        return bundle.functions.every(name => has(functions, name));
+    }
+
+    class Flow {
+        constructor(bundle) {
+            if (!supports(bundle)) throw new FlowError('BundleError', 'formato de paquete no soportado');
+            this.version = bundle.version;
+            this.start = bundle.start;
+            this.nodes = {};
+            for (const node of bundle.nodes) {
+                this.nodes[node.id] = Object.assign({}, node, {
+                    opciones: node.opciones && node.opciones.map(opt => Object.assign({}, opt, { valor: decode(opt.valor) })),
+                    parametros: node.parametros && decode(node.parametros),
+                    acciones: node.acciones && node.acciones.map(action => ({ target: action.target, expr: decode(action.expr) })),
+                });
+            }
+            this.functions = makeFunctions(decode(bundle.catalog));
+        }
+
+        node(nodeId) {
+            if (!has(this.nodes, nodeId)) throw new FlowError('KeyError', `Nodo no encontrado: ${nodeId}`);
+            return this.nodes[nodeId];
+        }
+
+        session(conversationId) {
+            return new Session(this, conversationId);
+        }
+    }
+
+    class Session {
+        constructor(flow, conversationId) {
+            this.flow = flow;
+            this.conversationId = conversationId;
+            this.currentNode = flow.start;
+            this.context = Object.create(null);
+            // Respuestas del usuario, en orden, para /flow/submit
+            this.replies = [];
+        }
+
+        // Equivale a /start
+        begin() {
+            return this.nextMessage();
+        }
+
+        // Equivale a /reply: {option_index} o {input_values}
+        reply(data) {
+            const step = {
+                option_index: data.option_index === undefined ? null : data.option_index,
+                input_values: data.input_values || {},
+            };
+            this.replies.push(step);
+            const error = this.applyInput(step.option_index, step.input_values);
+            return error || this.nextMessage();
+        }
+
+        applyInput(optionIndex, inputValues) {
+            const node = this.flow.node(this.currentNode);
+            if (node.tipo === 'entrada_usuario') {
+                const names = has(node, 'variable') ? [node.variable] : (node.variables || []);
+                const parsed = {};
+                for (const name of names) {
+                    const key = has(node, 'variable') ? 'value' : name;
+                    const value = parseFloatInput(has(inputValues, key) ? inputValues[key] : '');
+                    if (value === null) {
+                        // Como en el servidor, el error no lleva los campos del nodo
+                        return this.message(node, { error: INPUT_ERROR, type: 'input_error', text: node.pregunta }, false);
+                    }
+                    parsed[name] = value;
+                }
+                Object.assign(this.context, parsed);
+                this.currentNode = node.siguiente;
+            } else if (node.opciones && node.opciones.length) {
+                if (Number.isInteger(optionIndex) && optionIndex >= 0 && optionIndex < node.opciones.length) {
+                    const selected = node.opciones[optionIndex];
+                    this.context[node.id] = selected.valor;
+                    this.context[`${node.id}_texto`] = selected.texto;
+                    this.currentNode = selected.siguiente;
+                }
+            }
+            return null;
+        }
+
+        advance(node) {
+            const visited = new Set();
+            while (node.tipo === 'calculo') {
+                if (visited.has(node.id)) throw new FlowError('StepError', `Ciclo de cálculos en el nodo '${node.id}'`);
+                if (visited.size >= MAX_STEPS) throw new FlowError('StepError', `Se superó el máximo de ${MAX_STEPS} cálculos encadenados`);
+                visited.add(node.id);
+                for (const key of Object.keys(node.parametros || {})) this.context[key] = node.parametros[key];
+                for (const action of node.acciones || []) {
+                    this.context[action.target] = evaluate(action.expr, this.context, this.flow.functions);
+                }
+                if (node.siguiente === undefined) throw new FlowError('StepError', `El nodo de cálculo '${node.id}' no tiene siguiente`);
+                node = this.flow.node(node.siguiente);
+            }
+            return node;
+        }
+
+        nextMessage() {
+            const node = this.advance(this.flow.node(this.currentNode));
+            this.currentNode = node.id;
+            const templates = node.plantillas || {};
+            if (has(node, 'pregunta')) {
+                return this.message(node, { text: renderTemplate(has(templates, 'pregunta') ? templates.pregunta : node.pregunta, this.context) });
+            }
+            if (node.tipo === 'respuesta') {
+                return this.message(node, { text: renderTemplate(has(templates, 'texto') ? templates.texto : node.texto, this.context) });
+            }
+            if (node.tipo === 'opciones_dinamicas' && has(this.context, 'modelos_recomendados')) {
+                // El servidor lee 'pregunta' del nodo, que este tipo no tiene
+                throw new FlowError('KeyError', 'pregunta');
+            }
+            return this.message(node, {});
+        }
+
+        message(node, values, withFields = true) {
+            const data = Object.assign({ conversation_id: this.conversationId, node_id: node.id },
+                                       withFields ? node.fields : {}, values);
+            const response = {};
+            for (const field of RESPONSE_FIELDS) response[field] = has(data, field) ? data[field] : null;
+            return response;
+        }
+    }
+
+    const api = { FORMAT, Flow, Session, FlowError, PyFloat, supports, evaluate, pyStr, formatFixed0, parseFloatInput, decode };
+    if (typeof module !== 'undefined' && module.exports) {
+        module.exports = api;
+    } else {
+        root.PeisaFlow = api;
+    }
+})(typeof window !== 'undefined' ? window : this);
@@ -0,0 +1,139 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Dict
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # Brotli es opcional: sin él se sirve gzip
+    brotli = None
+
+# Recursos con hash en el nombre (app.3f2a9c1b.js): su contenido nunca cambia
+FINGERPRINT = re.compile(r'\.[0-9a-f]{8,}\.[^./]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+COMPRESS_MIN_SIZE = 512
+MAX_CACHED_SIZE = 5 * 1024 * 1024
+_COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+class CachedFile:
+    """Contenido de un archivo en memoria, con sus variantes comprimidas y validadores HTTP"""
+    __slots__ = ('path', 'mtime', 'body', 'gzip', 'br', 'etag', 'last_modified', 'media_type')
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.body = f.read()
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if media_type.startswith('text/') or media_type == 'application/javascript':
+            media_type += '; charset=utf-8'
+        self.media_type = media_type
+
+        self.gzip = self.br = None
+        if len(self.body) >= COMPRESS_MIN_SIZE and media_type.startswith(_COMPRESSIBLE):
+            self.gzip = gzip.compress(self.body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.br = brotli.compress(self.body)
+
+    def is_fresh(self, request: Request) -> bool:
+        """True si la copia del cliente sigue siendo válida (respuesta 304)"""
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or self.etag in tags or f'W/{self.etag}' in tags
+        if_modified_since = request.headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                return int(self.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def response(self, request: Request, cache_control: str) -> Response:
+        headers = {
+            'ETag': self.etag,
+            'Last-Modified': self.last_modified,
+            'Cache-Control': cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        if self.is_fresh(request):
+            return Response(status_code=304, headers=headers)
+
+        accept = request.headers.get('accept-encoding', '')
+        body = self.body
+        if self.br is not None and 'br' in accept:
+            body, headers['Content-Encoding'] = self.br, 'br'
+        elif self.gzip is not None and 'gzip' in accept:
+            body, headers['Content-Encoding'] = self.gzip, 'gzip'
+        return Response(content=body, media_type=self.media_type, headers=headers)
+
+
+class AssetCache:
+    """Archivos servidos desde memoria; en modo desarrollo un hilo vigila cambios en disco"""
+
+    def __init__(self, watch: bool = False, interval: float = 1.0):
+        self._files: Dict[str, CachedFile] = {}
+        self._lock = threading.Lock()
+        if watch:
+            threading.Thread(target=self._watch, args=(interval,), daemon=True, name='asset-watcher').start()
+
+    def get(self, path: str) -> Optional[CachedFile]:
+        cached = self._files.get(path)
+        if cached is not None:
+            return cached
+        try:
+            if os.path.getsize(path) > MAX_CACHED_SIZE:
+                return None
+            cached = CachedFile(path)
+        except OSError:
+            return None
+        with self._lock:
+            self._files[path] = cached
+        return cached
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        with self._lock:
+            if path is None:
+                self._files.clear()
+            else:
+                self._files.pop(path, None)
+
+    def _watch(self, interval: float) -> None:
+        stop = threading.Event()
+        while not stop.wait(interval):
+            for path, cached in list(self._files.items()):
+                try:
+                    changed = os.stat(path).st_mtime != cached.mtime
+                except OSError:
+                    changed = True
+                if changed:
+                    self.invalidate(path)
+
+    def serve(self, request: Request, path: str) -> Optional[Response]:
+        """Respuesta para el archivo, o None si no existe o es demasiado grande para la caché"""
+        cached = self.get(path)
+        if cached is None:
+            return None
+        cache_control = IMMUTABLE if FINGERPRINT.search(path) else REVALIDATE
+        return cached.response(request, cache_control)
+
+
+def safe_join(root: str, path: str) -> Optional[str]:
+    """Ruta dentro de root, o None si intenta salir del directorio"""
+    root = os.path.realpath(root)
+    full = os.path.realpath(os.path.join(root, path))
+    if full != root and not full.startswith(root + os.sep):
+        return None
+    return full
@@ -0,0 +1,296 @@
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Dict, Any, Iterator, Union
+
+
+class JsonSerializer:
+    """Formato por defecto de los backends compartidos: JSON compacto"""
+
+    def dumps(self, conv: Dict[str, Any]) -> Union[str, bytes]:
+        return json.dumps(conv, ensure_ascii=False, separators=(',', ':'))
+
+    def loads(self, data: Union[str, bytes]) -> Optional[Dict[str, Any]]:
+        return json.loads(data)
+
+
+class ConversationStore(ABC):
+    """Interfaz de almacenamiento del estado de las conversaciones.
+
+    Los handlers leen la conversación con get(), la modifican y la vuelven a
+    guardar con set(); los backends compartidos (SQLite, Redis) dependen de ello.
+    compare_and_set() guarda sólo si el turno guardado ('turn') sigue siendo el
+    leído, para que dos workers no pisen el estado de la misma conversación.
+    """
+
+    @abstractmethod
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def set(self, conversation_id: str, conv: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def compare_and_set(self, conversation_id: str, conv: Dict[str, Any], expected_turn: int) -> bool:
+        """Guarda la conversación si su turno guardado es expected_turn; devuelve si se guardó"""
+
+    @abstractmethod
+    def delete(self, conversation_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return self.get(conversation_id) is not None
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStore(ConversationStore):
+    """Diccionario en memoria del proceso con expiración (TTL) y tamaño máximo (LRU).
+
+    No se comparte entre workers: usar sólo con un worker de uvicorn. Con un
+    packer (state.py) cada conversación se guarda compactada y get() devuelve
+    un dict nuevo; sin él se guarda el mismo dict que modifica el handler.
+    """
+
+    def __init__(self, ttl: float = 3600, max_size: int = 10000, packer=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.packer = packer
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = Lock()
+
+    def _purge(self, now: float) -> None:
+        # Las entradas están ordenadas por último acceso: las vencidas quedan al principio
+        while self._data:
+            key, entry = next(iter(self._data.items()))
+            if entry[0] > now:
+                break
+            del self._data[key]
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(conversation_id)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._data[conversation_id]
+                return None
+            # Renovar el vencimiento en cada acceso
+            self._data[conversation_id] = (now + self.ttl, entry[1], entry[2])
+            self._data.move_to_end(conversation_id)
+        return entry[1] if self.packer is None else self.packer.unpack(entry[1])
+
+    def set(self, conversation_id: str, conv: Dict[str, Any]) -> None:
+        value = conv if self.packer is None else self.packer.pack(conv)
+        with self._lock:
+            self._store(conversation_id, value, conv.get('turn', 0), time.monotonic())
+
+    def compare_and_set(self, conversation_id: str, conv: Dict[str, Any], expected_turn: int) -> bool:
+        # Sin packer el dict guardado es el mismo que modifica el handler, así que
+        # el turno guardado se conserva aparte en la entrada
+        value = conv if self.packer is None else self.packer.pack(conv)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(conversation_id)
+            if entry is None or entry[0] <= now or entry[2] != expected_turn:
+                return False
+            self._store(conversation_id, value, conv.get('turn', 0), now)
+            return True
+
+    def _store(self, conversation_id: str, value: Any, turn: int, now: float) -> None:
+        self._data[conversation_id] = (now + self.ttl, value, turn)
+        self._data.move_to_end(conversation_id)
+        self._purge(now)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, conversation_id: str) -> None:
+        with self._lock:
+            self._data.pop(conversation_id, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._purge(time.monotonic())
+            return len(self._data)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._data))
+
+
+class SQLiteStore(ConversationStore):
+    """Tabla SQLite en modo WAL, compartida por todos los workers de la máquina"""
+
+    PURGE_EVERY = 500  # Escrituras entre barridos de conversaciones vencidas
+
+    def __init__(self, path: str, ttl: float = 3600, max_size: int = 10000, serializer=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.serializer = serializer or JsonSerializer()
+        self._lock = Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL, turn INTEGER NOT NULL DEFAULT 0)"
+        )
+        # Tablas creadas antes del contador de turnos
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(conversations)")}
+        if 'turn' not in columns:
+            self._db.execute("ALTER TABLE conversations ADD COLUMN turn INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS conversations_expires ON conversations (expires_at)")
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            # Renovar el vencimiento en cada acceso, como en los otros backends
+            renewed = self._db.execute(
+                "UPDATE conversations SET expires_at = ? WHERE id = ? AND expires_at > ?",
+                (now + self.ttl, conversation_id, now)
+            ).rowcount
+            row = self._db.execute(
+                "SELECT data FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone() if renewed else None
+        return self.serializer.loads(row[0]) if row else None
+
+    def set(self, conversation_id: str, conv: Dict[str, Any]) -> None:
+        now = time.time()
+        data = self.serializer.dumps(conv)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO conversations (id, data, expires_at, turn) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at, "
+                "turn = excluded.turn",
+                (conversation_id, data, now + self.ttl, conv.get('turn', 0))
+            )
+            self._written(now)
+
+    def compare_and_set(self, conversation_id: str, conv: Dict[str, Any], expected_turn: int) -> bool:
+        now = time.time()
+        data = self.serializer.dumps(conv)
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE conversations SET data = ?, expires_at = ?, turn = ? "
+                "WHERE id = ? AND turn = ? AND expires_at > ?",
+                (data, now + self.ttl, conv.get('turn', 0), conversation_id, expected_turn, now)
+            ).rowcount
+            self._written(now)
+        return updated == 1
+
+    def _written(self, now: float) -> None:
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._purge(now)
+
+    def _purge(self, now: float) -> None:
+        self._db.execute("DELETE FROM conversations WHERE expires_at <= ?", (now,))
+        # Si aún se supera el máximo, descartar las menos recientes
+        self._db.execute(
+            "DELETE FROM conversations WHERE id IN ("
+            "SELECT id FROM conversations ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,)
+        )
+
+    def delete(self, conversation_id: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM conversations WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class RedisStore(ConversationStore):
+    """Backend sobre el protocolo Redis, compartido entre workers y máquinas.
+
+    Acepta cualquier cliente con la interfaz de redis-py (getex, set con px,
+    delete, scan_iter, eval), lo que permite probarlo con el cliente falso de
+    fake_redis.py (python fake_redis.py).
+    El vencimiento lo gestiona el propio servidor con PX. El valor guardado
+    lleva delante el turno ('<turno>:'), que compare_and_set() comprueba en el
+    servidor con un script Lua.
+    """
+
+    CAS_SCRIPT = (
+        "local v = redis.call('GET', KEYS[1]) "
+        "if not v or (string.match(v, '^(%d+):') or '0') ~= ARGV[1] then return 0 end "
+        "redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3]) "
+        "return 1"
+    )
+
+    def __init__(self, client, ttl: float = 3600, prefix: str = "peisa:conv:", serializer=None):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.serializer = serializer or JsonSerializer()
+
+    @classmethod
+    def from_url(cls, url: str, ttl: float = 3600, serializer=None) -> "RedisStore":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("El backend Redis requiere el paquete 'redis' (pip install redis)") from None
+        return cls(redis.Redis.from_url(url), ttl=ttl, serializer=serializer)
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        # GETEX renueva el vencimiento en la misma ida y vuelta
+        data = self.client.getex(self.prefix + conversation_id, px=int(self.ttl * 1000))
+        if data is None:
+            return None
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        # Valores guardados antes del contador de turnos no llevan el prefijo
+        turn, sep, rest = data.partition(b':')
+        return self.serializer.loads(rest if sep and turn.isdigit() else data)
+
+    def _encode(self, conv: Dict[str, Any]) -> bytes:
+        data = self.serializer.dumps(conv)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return b"%d:" % conv.get('turn', 0) + data
+
+    def set(self, conversation_id: str, conv: Dict[str, Any]) -> None:
+        self.client.set(self.prefix + conversation_id, self._encode(conv), px=int(self.ttl * 1000))
+
+    def compare_and_set(self, conversation_id: str, conv: Dict[str, Any], expected_turn: int) -> bool:
+        return bool(self.client.eval(self.CAS_SCRIPT, 1, self.prefix + conversation_id,
+                                     str(expected_turn), self._encode(conv), int(self.ttl * 1000)))
+
+    def delete(self, conversation_id: str) -> None:
+        self.client.delete(self.prefix + conversation_id)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+
+def create_store(url: str = "memory://", ttl: float = 3600, max_size: int = 10000,
+                 serializer=None, packer=None) -> ConversationStore:
+    """Crea el backend indicado por la URL: memory://, sqlite:///ruta.db o redis://host:puerto/db.
+
+    El serializador sólo se usa en los backends compartidos y el packer sólo
+    en memoria; sin packer se guardan los dicts tal cual.
+    """
+    if url.startswith("memory:"):
+        return MemoryStore(ttl=ttl, max_size=max_size, packer=packer)
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):] or ":memory:", ttl=ttl, max_size=max_size, serializer=serializer)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore.from_url(url, ttl=ttl, serializer=serializer)
+    raise ValueError(f"Backend de conversaciones desconocido: {url}")